@@ -26,6 +26,7 @@ import os
 from tqdm import tqdm
 import scipy.stats
 from util.math import VecRotTen, VecRot, TransTen, PointsTen, qdist, vec_to_quat, angles_to_axis
+from util.math import VecRotTenBatch, quat_distances, rotation_tour
 from util.image import NormaliseBasic, NormaliseNull
 
 
@@ -86,6 +87,69 @@ def basic_viz(rot_pairs):
     show(vol, TITLE, axes=1).close()
 
 
+def render_all(splat, points, rots, trans, mask, sigma, normaliser):
+    """
+    Render the points at every rotation in a batch, normalising the
+    images together.
+
+    Parameters
+    ----------
+    splat : Splat
+        The renderer.
+    points : PointsTen
+        The points to render.
+    rots : VecRotTenBatch
+        The rotations.
+    trans : TransTen
+        The translation, the same for every image.
+    mask : torch.Tensor
+        The mask for the points.
+    sigma : float
+        The sigma to render with.
+    normaliser : NormaliseBasic or NormaliseNull
+        The normaliser.
+
+    Returns
+    -------
+    torch.Tensor
+        The (B, 1, h, w) images.
+    """
+    rods = rots.data
+    offsets = torch.cat((trans.x.reshape(1), trans.y.reshape(1))).to(rods.device)
+    sigmas = torch.full((len(rots),), float(sigma), device=rods.device)
+    images = splat.render_batch(
+        points.data, rods, offsets.expand(len(rots), 2), mask, sigmas
+    )
+    return normaliser.normalise(images.reshape(len(rots), 1, *splat.size))
+
+
+def pairwise_l1(images: torch.Tensor, block=64) -> torch.Tensor:
+    """
+    The summed L1 loss between every pair of images, a block of rows
+    at a time so the memory cdist needs stays small.
+
+    Parameters
+    ----------
+    images : torch.Tensor
+        The (B, 1, h, w) images.
+    block : int
+        How many images to compare with all the others at once
+        (default: 64).
+
+    Returns
+    -------
+    torch.Tensor
+        The (B, B) losses.
+    """
+    flat = images.reshape(images.shape[0], -1)
+    return torch.cat(
+        [
+            torch.cdist(flat[start:start + block], flat, p=1)
+            for start in range(0, flat.shape[0], block)
+        ]
+    )
+
+
 def sigma_effect(args, points, prev_args, device):
     """
     What effect does sigma have on the loss, particularly
@@ -144,46 +208,22 @@ def sigma_effect(args, points, prev_args, device):
     t = TransTen(xt, yt)
 
     losses_basic = np.zeros((len(sigmas), dim_size, dim_size, 2), dtype=float)
-    rotations = []
-
-    for x in range(dim_size):
-        rotations.append(VecRot(0, 0, 0).random().to_ten(device=device))
-    
-    for s in range(len(sigmas)):
-
-        for x in range(dim_size):
-            rx = rotations[x]
+    rotations = VecRotTenBatch.random(dim_size, device=device)
 
-            for y in range(dim_size):
-                ry = rotations[y]
-                q0 = vec_to_quat(rx)
-                q1 = vec_to_quat(ry)
-                rdist = qdist(q0, q1)
-                losses_basic[s][x][y][0] = rdist
+    # The distances between every pair of rotations, all at once
+    quats = rotations.to_quaternions()
+    dists = quat_distances(quats, quats).fill_diagonal_(0.0)
+    losses_basic[:, :, :, 0] = dists.cpu().numpy()
 
     splat = Splat(device=device)
 
     for sidx in tqdm(range(len(sigmas))):
-        current_sigma = sigmas[sidx]
-
-        for xidx in range(dim_size-1):
-            r0 = rotations[xidx]
-            base_image = splat.render(base_points, r0, t, mask_base, sigma=current_sigma)
-            base_image = base_image.reshape(1, 1, 128, 128)
-            base_image = normaliser.normalise(base_image)
-                
-            for yidx in range(xidx+1, dim_size):
-                r1 = rotations[yidx]
-
-                second_image = splat.render(base_points, r1, t, mask_base, sigma=current_sigma)
-                second_image = second_image.reshape(1, 1, 128, 128)
-                second_image = normaliser.normalise(second_image)
-                second_image = second_image.squeeze()
-                base_image = base_image.squeeze()
-                loss_base = F.l1_loss(base_image, second_image, reduction="sum")
-                losses_basic[sidx][xidx][yidx][1] = loss_base.item()
-                losses_basic[sidx][yidx][xidx][1] = loss_base.item()
-    
+        # Each rotation is rendered once, then compared with all the others
+        images = render_all(
+            splat, base_points, rotations, t, mask_base, sigmas[sidx], normaliser
+        )
+        losses_basic[sidx, :, :, 1] = pairwise_l1(images).cpu().numpy()
+
     # pp = pprint.PrettyPrinter(indent=4, width=dim_size * 10)
 
     for i in range(len(sigmas)):
@@ -260,36 +300,30 @@ def sigma_effect_model(args, model, points, prev_args, device):
     # Build our cube of results
     # Each entry has the two angles and the error
     losses_basic = np.zeros((len(sigmas), dim_size, 2), dtype=float)
-    rotations = []
-
-    for x in range(dim_size):
-        rotations.append(VecRot(0, 0, 0).random().to_ten(device=device))
-           
+    rotations = VecRotTenBatch.random(dim_size, device=device)
+    quats = rotations.to_quaternions()
     splat = Splat(device=device)
 
     for sidx in tqdm(range(len(sigmas))):
-        current_sigma = sigmas[sidx]
-
-        for xidx in range(dim_size-1):
-            r0 = rotations[xidx]
-            base_image = splat.render(base_points, r0, t, mask_base, sigma=current_sigma)
-            base_image = base_image.reshape(1, 1, 128, 128)
-            base_image = normaliser.normalise(base_image)
+        base_images = render_all(
+            splat, base_points, rotations, t, mask_base, sigmas[sidx], normaliser
+        )
 
+        # Through the network in batches, comparing with what went in
+        for start in range(0, dim_size, args.batch_size):
+            base_image = base_images[start:start + args.batch_size]
             model_image = model.forward(base_image, points)
-            model_image = normaliser.normalise(model_image.reshape(1, 1, 128, 128))
-            loss_model = F.l1_loss(model_image, base_image, reduction="sum")
-            model_image = torch.squeeze(model_image.cpu()[0])
-            model_rots = model.get_render_params()
-            r1 = VecRot(model_rots[0][0], model_rots[0][1], model_rots[0][2])
-
-            # Rotation 0, Rotation 1, Rotation network, qdist, loss, loss network
-            q0 = vec_to_quat(r0)
-            q1 = vec_to_quat(r1)
-            rdist = qdist(q0, q1)
-            losses_basic[sidx][xidx][0] = rdist
-            losses_basic[sidx][xidx][1] = loss_model.item()
-    
+            model_image = normaliser.normalise(model_image.reshape(base_image.shape))
+            loss_model = F.l1_loss(model_image, base_image, reduction="none")
+            model_rots = VecRotTenBatch(model.get_render_params()[:, 0:3])
+            rdist = quat_distances(
+                quats[start:start + args.batch_size], model_rots.to_quaternions()
+            ).diagonal()
+            losses_basic[sidx, start:start + len(base_image), 0] = rdist.cpu().numpy()
+            losses_basic[sidx, start:start + len(base_image), 1] = (
+                loss_model.sum(dim=(1, 2, 3)).cpu().numpy()
+            )
+
     # pp = pprint.PrettyPrinter(indent=4, width=dim_size * 10)
 
     for i in range(len(sigmas)):
@@ -355,11 +389,12 @@ def angle_check(args, model, points, prev_args, device):
 
     rots_in_out = []
 
-    for i in range(args.num_rots):
-        rot = VecRot(0, 0, 0)
-        rot.random()
-        rot = rot.to_ten(device=device)
-        splat = Splat(device=device)
+    # Order the rotations so each is near the last, sweeping smoothly
+    rots = VecRotTenBatch.random(args.num_rots, device=device)
+    splat = Splat(device=device)
+
+    for i in rotation_tour(rots, passes=args.two_opt):
+        rot = rots[i]
         target = splat.render(scaled_points, rot, trans, mask, sigma=args.sigma)
         target = target.reshape(1, 128, 128)
         target = target.repeat(prev_args.batch_size, 1, 1, 1)
@@ -424,9 +459,22 @@ if __name__ == "__main__":
     parser.add_argument(
         "--num-rots", default=360, type=int, help="The number of rots to try (default 360)."
     )
+    parser.add_argument(
+        "--two-opt",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Passes of 2-opt to shorten the tour of the rots (default: 0)",
+    )
     parser.add_argument(
         "--dim-size", default=20, type=int, help="How many angles in loss check (default 20)."
     )
+    parser.add_argument(
+        "--batch-size",
+        default=32,
+        type=int,
+        help="How many images go through the model at once (default 32).",
+    )
     parser.add_argument(
         "--seed", type=int, default=1, metavar="S", help="random seed (default: 1)"
     )
@@ -8,8 +8,9 @@ Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
 blender_vis.py - Visualisations that make use of Blender.
 
 Running this script inside blender (version >=2.8) will
-launch a file dialog box. Select the animation.json from
-a neural network run you wish to visualise.
+launch a file dialog box. Select the animation.json (or the
+smaller, faster animation.bin) from a neural network run you wish
+to visualise.
 
 """
 
@@ -24,7 +25,7 @@ SCALE_FACTOR = 10.0
 
 class ScanFileOperator(bpy.types.Operator):
     bl_idname = "error.scan_file"
-    bl_label = "Load JSON Animation File"
+    bl_label = "Load JSON or Binary Animation File"
     filepath = bpy.props.StringProperty(subtype="FILE_PATH")
 
     def execute(self, context):
@@ -36,11 +37,43 @@ class ScanFileOperator(bpy.types.Operator):
         return {"RUNNING_MODAL"}
 
 
-def parseJSON(filepath):
+def load_frames(raw):
+    """Return the frames of the animation as lists of (x, y, z). The
+    animation.bin written by objs_to_json.py or trajectory.py is read
+    straight into a flat float array, using only the standard library."""
+    import array
     import json
+    import struct
+    import sys
+
+    if raw[0:4] != b"HANI":
+        data = json.loads(raw.decode("utf-8"))
+        return [
+            [(v["x"], v["y"], v["z"]) for v in frame["vertices"]]
+            for frame in data["frames"]
+        ]
+
+    (length,) = struct.unpack_from("<I", raw, 4)
+    header = json.loads(raw[8:8 + length].decode("utf-8"))
+    values = array.array("f")
+    values.frombytes(raw[256:])
+
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    frames = []
+    width = header["points"] * 3
 
-    with open(filepath, "rU") as f:
-        raw_json = f.read()
+    for i in range(header["frames"]):
+        flat = values[i * width:(i + 1) * width]
+        frames.append(list(zip(flat[0::3], flat[1::3], flat[2::3])))
+
+    return frames
+
+
+def parseJSON(filepath):
+    with open(filepath, "rb") as f:
+        raw = f.read()
 
         points = []
         points_group = bpy.data.collections.new("NN Points")
@@ -48,14 +81,13 @@ def parseJSON(filepath):
         scene = bpy.context.scene
 
         try:
-            data = json.loads(raw_json)
-            frame = data["frames"][0]
-            num_frames = len(data["frames"])
+            frames = load_frames(raw)
+            num_frames = len(frames)
 
-            for vertex in frame["vertices"]:
-                x = vertex["x"] * SCALE_FACTOR
-                y = vertex["y"] * SCALE_FACTOR
-                z = vertex["z"] * SCALE_FACTOR
+            for vertex in frames[0]:
+                x = vertex[0] * SCALE_FACTOR
+                y = vertex[1] * SCALE_FACTOR
+                z = vertex[2] * SCALE_FACTOR
 
                 point = bpy.ops.mesh.primitive_ico_sphere_add(location=(x, y, z))
                 C = bpy.context
@@ -75,11 +107,10 @@ def parseJSON(filepath):
                 scene.frame_set(i)
 
                 for j, point in enumerate(points):
-                    frame = data["frames"][i]
-                    vertex = frame["vertices"][j]
-                    x = vertex["x"] * SCALE_FACTOR
-                    y = vertex["y"] * SCALE_FACTOR
-                    z = vertex["z"] * SCALE_FACTOR
+                    vertex = frames[i][j]
+                    x = vertex[0] * SCALE_FACTOR
+                    y = vertex[1] * SCALE_FACTOR
+                    z = vertex[2] * SCALE_FACTOR
                     point.location = (x, y, z)
                     point.keyframe_insert(data_path="location", index=-1)
 
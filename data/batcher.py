@@ -13,6 +13,7 @@ supports iteration, typically a buffer.
 
 import torch
 from data.buffer import BufferItem, ItemRendered
+from util.math import VecRotTenBatch, TransTenBatch
 
 
 class Batch(object):
@@ -28,8 +29,8 @@ class Batch(object):
             device=device,
         )
 
-        self.rotations = []
-        self.translations = []
+        self._rotations = []
+        self._translations = []
         self.sigmas = []
         self.stretches = []
 
@@ -37,12 +38,28 @@ class Batch(object):
         self.data[self._idx][0] = datum.datum
 
         if isinstance(datum, ItemRendered):
-            self.rotations.append(datum.rotation)
-            self.translations.append(datum.translation)
+            self._rotations.append(datum.rotation)
+            self._translations.append(datum.translation)
             self.sigmas.append(datum.sigma)
 
         self._idx += 1
 
+    @property
+    def rotations(self) -> VecRotTenBatch:
+        """ The rotations of the batch, as a single (B, 3) tensor."""
+        if len(self._rotations) == 0:
+            return VecRotTenBatch(self.data.new_zeros((0, 3)))
+
+        return VecRotTenBatch.from_list(self._rotations)
+
+    @property
+    def translations(self) -> TransTenBatch:
+        """ The translations of the batch, as a single (B, 2) tensor."""
+        if len(self._translations) == 0:
+            return TransTenBatch(self.data.new_zeros((0, 2)))
+
+        return TransTenBatch.from_list(self._translations)
+
 
 class Batcher:
     def __init__(self, buffer, batch_size=16):
@@ -242,6 +242,126 @@ class Buffer(BaseBuffer):
         return self.renderer.size
 
 
+class BufferCached(Buffer):
+    """
+    A Buffer that holds on to its rendered images between passes over
+    the set. Intended for the test and validation sets, which are
+    iterated over many times during training. Images are only
+    re-rendered when the loader's sigma has drifted further than
+    sigma_tolerance from the sigma they were rendered at, or when the
+    items the set holds have changed.
+    """
+
+    def __init__(
+        self,
+        dataset: DataSet,
+        renderer,
+        buffer_size=1000,
+        device=torch.device("cpu"),
+        sigma_tolerance=0.0,
+    ):
+        """
+        Create our BufferCached.
+
+        Parameters
+        ----------
+        dataset : Dataset
+            The dataset behind the buffer
+        renderer : Splat
+            The renderer used to create the images.
+        buffer_size : int
+            How big is our buffer (default: 1000)
+        device : str
+            The device the buffer lives on - CUDA/cpu (default: "cpu")
+        sigma_tolerance : float
+            How far can the loader sigma move before we re-render
+            (default: 0.0 - any change re-renders).
+
+        Returns
+        -------
+        BufferCached
+        """
+        super().__init__(dataset, renderer, buffer_size, device)
+        self.sigma_tolerance = sigma_tolerance
+        self._cache = {}
+        self._cache_sigma = None
+        self._cache_ids = None
+
+    def invalidate(self):
+        """
+        Throw away all the cached renders, forcing a re-render on the
+        next fill. Call this if the loader has been reset or reloaded.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        self
+        """
+        self._cache.clear()
+        self._cache_sigma = None
+        self._cache_ids = None
+        return self
+
+    def _check_cache(self):
+        """ Internal function. Drop the cache if it is stale."""
+        sigma = self.set.loader.sigma
+        ids = frozenset(self.set.allocated)
+
+        if (
+            self._cache_sigma is None
+            or abs(sigma - self._cache_sigma) > self.sigma_tolerance
+            or ids != self._cache_ids
+        ):
+            self._cache.clear()
+            self._cache_sigma = sigma
+            self._cache_ids = ids
+
+    def fill(self):
+        """
+        Perform a fill, as with Buffer, but take the images from our
+        cache where we can.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        self
+        """
+        self.counter = 0
+        try:
+            del self.buffer[:]
+            self._check_cache()
+
+            for i in range(0, min(self.buffer_size, self.set.remaining())):
+                idx = self.set.next_id()
+
+                if idx not in self._cache:
+                    datum = self.set.loader[idx]
+                    assert datum.type == ItemType.SIMULATED
+                    points = PointsTen(device=self.device)
+                    points.from_points(datum.points)
+                    mask = datum.mask.to_ten(device=self.device)
+                    r = datum.angle_axis.to_ten(device=self.device)
+                    t = datum.trans.to_ten(device=self.device)
+                    rendered = self.renderer.render(
+                        points, r, t, mask=mask, sigma=datum.sigma
+                    )
+                    self._cache[idx] = ItemRendered(rendered, r, t, datum.sigma)
+
+                self.buffer.append(self._cache[idx])
+
+        except Exception as e:
+            print("Buffer exception on Fill", e)
+            raise e
+
+        return self
+
+
 class BufferImage(BaseBuffer):
     """
     This buffer requires no splat as it loads images instead of
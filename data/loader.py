@@ -24,6 +24,7 @@ import random
 import pickle
 import array
 import math
+import numpy as np
 from tqdm import tqdm
 from enum import Enum
 from util.math import Points, Point, Mask, Trans, VecRot
@@ -271,16 +272,9 @@ class Loader(object):
         LoaderItem
             The item at idx
         """
-        points = Points()
-        for i in range(int(self.points_chunk / 4)):
-            ts = idx * self.points_chunk + i * 4
-            point = Point(
-                self.points[ts],
-                self.points[ts + 1],
-                self.points[ts + 2],
-                self.points[ts + 3],
-            )
-            points.append(point)
+        ts = idx * self.points_chunk
+        chunk = np.frombuffer(self.points, dtype=np.float64)
+        points = Points().from_chunk(chunk[ts:ts + self.points_chunk])
 
         tmask = []
         for i in range(self.masks_chunk):
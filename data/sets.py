@@ -188,15 +188,31 @@ class DataSet(object):
         mask, transforms."""
         return self.loader.__getitem__(self.allocated[idx])
 
-    def __next__(self):
+    def next_id(self) -> int:
+        """
+        Advance through the set as __next__ does, but return the id
+        into the loader rather than the LoaderItem itself. Useful when
+        the caller already holds the item (such as a caching buffer).
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            The index into the loader of the next item.
+        """
         if self.remaining() <= 0:
             self.counter = 0
             raise StopIteration
         else:
-            item = self.loader[self.allocated[self.counter]]
-
+            idx = self.allocated[self.counter]
             self.counter += 1
-            return item
+            return idx
+
+    def __next__(self):
+        return self.loader[self.next_id()]
 
     def load(self, filename: str):
         """
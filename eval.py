@@ -20,28 +20,64 @@ import random
 import argparse
 import sys
 import os
+from multiprocessing import Pool
 from stats import stats as S
 from tqdm import tqdm
-from pyquaternion import Quaternion
 from net.renderer import Splat
+from net.optimise import optimise_for_inference
 from util.image import NormaliseBasic, save_image
 from util.plyobj import load_obj, save_obj, save_ply
-from util.loadsave import load_checkpoint, load_model
+from util.loadsave import load_checkpoint, load_model, load_bundle
 from util.image import NormaliseBasic, NormaliseNull
-from util.math import VecRotTen, VecRot, TransTen, PointsTen, vec_to_quat, qdist
+from util.math import VecRotTen, VecRot, TransTen, PointsTen
+from util.math import VecRotTenBatch, quat_slerp, rotation_tour
+
+
+def sweep_poses(rots: VecRotTenBatch, order: list, lerps: int) -> VecRotTenBatch:
+    """
+    All the poses of a sweep at once - lerps slerped steps from each
+    rotation to the next, visiting them in order.
+
+    Parameters
+    ----------
+    rots : VecRotTenBatch
+        The rotations we visit.
+    order : list
+        The order to visit them in.
+    lerps : int
+        The number of steps from one rotation to the next.
+
+    Returns
+    -------
+    VecRotTenBatch
+        (len(order) - 1) * lerps poses.
+    """
+    q = rots.to_quaternions().double()[order]
+    q0 = q[:-1].repeat_interleave(lerps, dim=0)
+    q1 = q[1:].repeat_interleave(lerps, dim=0)
+    amount = torch.arange(lerps, dtype=torch.float64).repeat(len(order) - 1) / lerps
+    return VecRotTenBatch.from_quaternions(quat_slerp(q0, q1, amount))
+
+
+def _save_pair(job):
+    """ Save the in and out images of a pose. Run in the writer pool."""
+    (image_in, image_out, idx, savedir) = job
+    save_image(image_in, savedir + "/" + "eval_in_" + str(idx).zfill(4) + ".jpg")
+    save_image(image_out, savedir + "/" + "eval_out_" + str(idx).zfill(4) + ".jpg")
 
 
 def angle_eval(args, model, points, prev_args, device):
     """For every angle, save the in and out so we can assess where the
-    network is failing."""
-    xt = 0.0
-    yt = 0.0
+    network is failing. All the poses of the sweep are generated up
+    front and run through the network in batches, with the images
+    written out by a pool of processes."""
     num_angles = args.num_angles
     lerps = args.lerps
-
-    # pp = 1.0 / num_angles ** (1. / 3)
-    xt = torch.tensor([xt], dtype=torch.float32, device=device)
-    yt = torch.tensor([yt], dtype=torch.float32, device=device)
+    batch_size = args.batch_size
+    size = (
+        getattr(prev_args, "image_height", 128),
+        getattr(prev_args, "image_width", 128),
+    )
 
     # Generate random rotations then lerp between them
     rand_rots = []
@@ -49,22 +85,9 @@ def angle_eval(args, model, points, prev_args, device):
         rand_rots.append(VecRot(0, 0, 0).random())
 
     # Order the randrots based on quaternion distance
-    ordered_idx = [0]
-    while len(ordered_idx) < num_angles:
-        cidx = ordered_idx[-1]
-        min_d = 2
-        min_idx = 0
-        q0 = vec_to_quat(rand_rots[cidx])
-
-        for i in range(num_angles):
-            if i not in ordered_idx:
-                q1 = vec_to_quat(rand_rots[i])
-                dd = qdist(q0, q1)
-                if dd < min_d:
-                    min_idx = i
-                    min_d = dd
-
-        ordered_idx.append(min_idx)
+    rots = VecRotTenBatch.from_list([r.to_ten() for r in rand_rots])
+    ordered_idx = rotation_tour(rots, passes=args.two_opt)
+    poses = sweep_poses(rots, ordered_idx, lerps)
 
     # Set up the normaliser
     normaliser = NormaliseNull()
@@ -75,57 +98,48 @@ def angle_eval(args, model, points, prev_args, device):
 
     # Load some base points from an obj
     loaded_points = load_obj(objpath=args.obj)
-    mask = []
-    for _ in loaded_points:
-        mask.append(1.0)
-    mask = torch.tensor(mask, device=device)
     scaled_points = PointsTen(device=device).from_points(loaded_points)
-
-    for i in tqdm(range(num_angles-1)):
-        rot_s = rand_rots[ordered_idx[i]]
-        rot_n = rand_rots[ordered_idx[i+1]]
-        qrot_s = Quaternion(axis=rot_s.get_normalised(), radians=rot_s.get_angle())
-        qrot_n = Quaternion(axis=rot_n.get_normalised(), radians=rot_n.get_angle())
-
-        for j in range(lerps):
-            idx = i * lerps + j
-            qrot = Quaternion.slerp(qrot_s, qrot_n, amount=float(j) / float(lerps))
-
-            fx = qrot.axis[0] * qrot.radians
-            fy = qrot.axis[1] * qrot.radians
-            fz = qrot.axis[2] * qrot.radians
-
-            xv = torch.tensor([fx], dtype=torch.float32, device=device)
-            yv = torch.tensor([fy], dtype=torch.float32, device=device)
-            zv = torch.tensor([fz], dtype=torch.float32, device=device)
-            r = VecRotTen(xv, yv, zv)
-            t = TransTen(xt, yt)
-
-            # Stats turn on
-            if args.stats:
-                S.write_immediate((fx, fy, fz), "eval_rot_in", 0, 0, idx)
-
-            # Setup our splatting pipeline which is added to both dataloader
-            # and our network as they use thTraine same settings
-            splat = Splat(device=device)
-            result = splat.render(scaled_points, r, t, mask, sigma=args.sigma)
-            save_image(result, args.savedir + "/" + "eval_in_" + str(idx).zfill(4) + ".jpg")
-
-            target = result.reshape(1, 128, 128)
-            target = target.repeat(prev_args.batch_size, 1, 1, 1)
-            target = target.to(device)
+    mask = torch.ones(len(loaded_points), dtype=torch.float32, device=device)
+
+    # One renderer for the whole sweep, so its matrices are only built once
+    splat = Splat(size=size, device=device)
+    writes = []
+
+    with Pool(processes=args.workers) as pool:
+        for start in tqdm(range(0, len(poses), batch_size)):
+            batch = VecRotTenBatch(poses.data[start:start + batch_size].to(device))
+            target = splat.render_batch(
+                scaled_points.data,
+                batch.data,
+                batch.data.new_zeros(len(batch), 2),
+                mask,
+                batch.data.new_full((len(batch),), args.sigma),
+            ).reshape(len(batch), 1, size[0], size[1])
             target = normaliser.normalise(target)
 
             output = model.forward(target, points)
-            output = normaliser.normalise(output.reshape(prev_args.batch_size, 1, 128, 128))
-            loss = F.l1_loss(output, target)
-            output = torch.squeeze(output.cpu()[0])
-            save_image(output, args.savedir + "/" + "eval_out_" + str(idx).zfill(4) + ".jpg")
-            rots = model.get_render_params()
+            output = normaliser.normalise(output.reshape(len(batch), 1, size[0], size[1]))
+            losses = F.l1_loss(output, target, reduction="none").mean(dim=(1, 2, 3))
+            rots_out = model.get_render_params()
+
+            images_in = target.squeeze(1).cpu().numpy()
+            images_out = output.squeeze(1).cpu().numpy()
+            jobs = [
+                (images_in[i], images_out[i], start + i, args.savedir)
+                for i in range(len(batch))
+            ]
+            writes.append(pool.map_async(_save_pair, jobs))
 
+            # Stats turn on
             if args.stats:
-                S.write_immediate(rots[0], "eval_rot_out", 0, 0, idx)
-                S.write_immediate(loss, "eval_loss", 0, 0, idx)
+                for (i, r) in enumerate(batch.data.tolist()):
+                    S.write_immediate(tuple(r), "eval_rot_in", 0, 0, start + i)
+                    S.write_immediate(rots_out[i], "eval_rot_out", 0, 0, start + i)
+                    S.write_immediate(losses[i], "eval_loss", 0, 0, start + i)
+
+        # Make sure every image is written, raising any errors
+        for w in writes:
+            w.get()
 
 
 def basic_eval(args, model, points, prev_args, device):
@@ -225,9 +239,12 @@ def evaluate(args, device, animate=False):
         S.on(args.savedir)
     model = None
     points = None
-    model = load_model(args.savedir + "/model.tar", device)
 
-    if os.path.isfile(args.savedir + "/" + args.savename):
+    if os.path.isfile(args.savedir + "/bundle.pt"):
+        (model, points, prev_args) = load_bundle(args.savedir + "/bundle.pt", device)
+        print("Loaded bundle", model)
+    elif os.path.isfile(args.savedir + "/" + args.savename):
+        model = load_model(args.savedir + "/model.tar", device)
         (model, points, _, _, _, _, prev_args) = load_checkpoint(
             model, args.savedir, args.savename, device
         )
@@ -237,6 +254,9 @@ def evaluate(args, device, animate=False):
         print("Error - need to pass in a model")
         return
 
+    if not args.no_optimise:
+        model = optimise_for_inference(model)
+
     with torch.no_grad():
         model.eval()
         basic_eval(args, model, points, prev_args, device)
@@ -261,9 +281,28 @@ if __name__ == "__main__":
     parser.add_argument(
         "--lerps", type=int, default=10, metavar="S", help="Number of SLERP steps between angles(default: 10)"
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="How many poses of the angle sweep to run at once (default: 32)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="How many processes write the sweep images (default: all cpus)",
+    )
     parser.add_argument(
         "--num-angles", type=int, default=100, metavar="S", help="Number of angles to test (default: 100)"
     )
+    parser.add_argument(
+        "--two-opt",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Passes of 2-opt to shorten the tour of the angles (default: 0)",
+    )
     parser.add_argument(
         "--seed", type=int, default=1, metavar="S", help="random seed (default: 1)"
     )
@@ -297,6 +336,12 @@ if __name__ == "__main__":
         default="checkpoint.pth.tar",
         help="The name for checkpoint save file.",
     )
+    parser.add_argument(
+        "--no-optimise",
+        action="store_true",
+        default=False,
+        help="Run the model as trained, without folding the BatchNorm layers.",
+    )
 
     # Initial setup of PyTorch
     args = parser.parse_args()
@@ -0,0 +1,49 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/          # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/          # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+export.py - write the inference bundle for a training run.
+
+The bundle holds the weights, the points and the settings inference
+needs, as plain tensors. run.py, serve.py and eval.py use bundle.pt in
+a run directory in place of model.tar and the checkpoint when they find
+it, starting far quicker.
+
+  python export.py --load ../runs/2021_05_06_bl_0
+
+"""
+
+import argparse
+import os
+import sys
+import torch
+from util.loadsave import load_checkpoint, load_model, save_bundle
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shaper export")
+    parser.add_argument("--load", default=".", help="Path to our model dir.")
+    parser.add_argument(
+        "--savename",
+        default="checkpoint.pth.tar",
+        help="The name for checkpoint save file.",
+    )
+    parser.add_argument(
+        "--out", default="", help="The bundle to write (default: <load>/bundle.pt)."
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.load + "/" + args.savename):
+        print("--load must point to a run directory.")
+        sys.exit(0)
+
+    device = torch.device("cpu")
+    model = load_model(args.load + "/model.tar", device)
+    (model, points, _, _, _, _, prev_args) = load_checkpoint(
+        model, args.load, args.savename, device
+    )
+    out = args.out if args.out != "" else args.load + "/bundle.pt"
+    save_bundle(model, points, prev_args, out)
+    print("Saved bundle", out, os.path.getsize(out), "bytes")
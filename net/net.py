@@ -13,7 +13,7 @@ import random
 import torch.nn as nn
 import torch.nn.functional as F
 from net.renderer import Splat
-from util.math import VecRotTen, TransTen, PointsTen
+from util.math import VecRotTenBatch, TransTenBatch, PointsTen
 
 
 def conv_size(shape, padding=0, kernel_size=5, stride=1) -> int:
@@ -70,7 +70,8 @@ class Flatten(nn.Module):
 
     """
     def forward(self, x):
-        return x.view(x.size()[0], -1)
+        # reshape rather than view, as channels_last input isn't contiguous
+        return x.reshape(x.size()[0], -1)
         #return x.view(-1, num_flat_features(x))
 
 
@@ -153,7 +154,8 @@ class Net(nn.Module):
         self.splat = splat
         self.device = self.splat.device
         self._lidx = 0
-        self._mask = torch.zeros(splat.size, dtype=torch.float32)
+        # render_tensors, once compiled by net.optimise.compile_model
+        self._compiled = None
 
         self.seq = nn.Sequential(
             self.conv1,
@@ -215,6 +217,12 @@ class Net(nn.Module):
     def __iter__(self):
         return iter(self.layers)
 
+    def __getstate__(self):
+        # A compiled function can't be pickled or copied, so we drop it
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        return state
+
     def __next__(self):
         """
         Return the 'next' layer in the network
@@ -247,6 +255,19 @@ class Net(nn.Module):
         """
         return self._final
 
+    def get_poses(self):
+        """
+        Return the rotations, translations and sigmas the last forward
+        pass rendered with, rather than the raw outputs of the network.
+        They are detached from the graph.
+
+        Returns
+        -------
+        tuple
+            A VecRotTenBatch, a TransTenBatch and the (B) sigmas.
+        """
+        return self._poses
+
     def forward(self, source: torch.Tensor, points: PointsTen):
         """
         Our forward pass. We take the input image (x), the
@@ -267,25 +288,45 @@ class Net(nn.Module):
         None
 
         """
-        self._final = self.seq(source)
-        self._mask = points.data.new_full([points.data.shape[0], 1, 1], fill_value=1.0)
-        images = []
-
-        for param in self._final:
-            tx = (torch.tanh(param[3]) * 2.0) * self.max_shift
-            ty = (torch.tanh(param[4]) * 2.0) * self.max_shift
-            sp = nn.Softplus(threshold=12)
-            final_sigma = torch.clamp(sp(param[5]), max=14)
-            r = VecRotTen(param[0], param[1], param[2])
-            t = TransTen(tx, ty)
-
-            images.append(
-                self.splat.render(points, r, t, self._mask, final_sigma).reshape(
-                    (1, self.splat.size[0], self.splat.size[1])
-                )
-            )
+        render = getattr(self, "_compiled", None) or self.render_tensors
+        (images, self._final, rots, trans, sigmas) = render(source, points.data)
+        # Detached, as these are for reporting and a module holding
+        # non-leaf tensors can't be deep-copied
+        self._poses = (
+            VecRotTenBatch(rots.detach()),
+            TransTenBatch(trans.detach()),
+            sigmas.detach(),
+        )
         # TODO - should we return the params we've predicted as well?
-        return torch.stack(images)
+        return images
+
+    def render_tensors(self, source: torch.Tensor, points: torch.Tensor) -> tuple:
+        """
+        The forward pass on plain tensors alone - the encoder, then the
+        whole batch rendered at once - with no branches on the values of
+        the tensors, so torch.compile can follow it without breaks.
+
+        Parameters
+        ----------
+        source : torch.Tensor
+            The (B, 1, h, w) source images.
+        points : torch.Tensor
+            The (N, 4, 1) points.
+
+        Returns
+        -------
+        tuple
+            The (B, 1, h, w) rendered images, the (B, 6) raw outputs of
+            the network, then the (B, 3) rotations, (B, 2) translations
+            and (B) sigmas they were rendered with.
+        """
+        final = self.seq(source)
+        rots = final[:, 0:3]
+        trans = (torch.tanh(final[:, 3:5]) * 2.0) * self.max_shift
+        sigmas = torch.clamp(F.softplus(final[:, 5], threshold=12), max=14)
+        mask = points.new_ones(points.shape[0])
+        images = self.splat.render_batch(points, rots, trans, mask, sigmas)
+        return (images.unsqueeze(1), final, rots, trans, sigmas)
 
 
 # Our drawing graph functions. We rely / have borrowed from the following
@@ -0,0 +1,258 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/          # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/          # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+optimise.py - faster copies of a trained Net, for inference only.
+
+At inference the BatchNorm layers are fixed affine maps, so each can be
+folded into the weights and bias of the conv before it. The copy can
+also hold its weights channels_last and have its encoder traced and
+frozen, letting oneDNN fuse each conv with the LeakyReLU after it.
+
+For CPU-only machines the convs and fully connected layers can go to
+int8 as well. Static quantisation needs a few hundred calibration
+images, either read from disk or rendered from the points at random
+poses. Dynamic quantisation needs none, but only covers the fully
+connected layers. The renderer stays in float either way.
+
+compile_model hands the tensor-only forward pass, encoder and batched
+renderer together, to torch.compile.
+
+"""
+
+import copy
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from util.math import PointsTen, VecRotTenBatch, TransTenBatch
+
+
+def fold_batchnorm(seq: nn.Sequential) -> nn.Sequential:
+    """
+    Fold every BatchNorm2d that follows a Conv2d into that conv.
+
+    Parameters
+    ----------
+    seq : nn.Sequential
+        The layers, in eval mode.
+
+    Returns
+    -------
+    nn.Sequential
+        New layers, with a fused conv in place of each conv and an
+        Identity in place of its BatchNorm2d.
+    """
+    layers = list(seq)
+
+    for i in range(len(layers) - 1):
+        if isinstance(layers[i], nn.Conv2d) and isinstance(
+            layers[i + 1], nn.BatchNorm2d
+        ):
+            layers[i] = fuse_conv_bn_eval(layers[i], layers[i + 1])
+            layers[i + 1] = nn.Identity()
+
+    return nn.Sequential(*layers)
+
+
+def optimise_for_inference(model, channels_last=True, jit=False):
+    """
+    Return an inference-only copy of a Net, with the BatchNorm folded
+    into the convs. The model passed in is left alone.
+
+    Parameters
+    ----------
+    model : Net
+        The trained model.
+    channels_last : bool
+        Hold the conv weights in the channels_last memory format
+        (default: True).
+    jit : bool
+        Trace and freeze the encoder, so oneDNN can fuse the convs with
+        their activations (default: False).
+
+    Returns
+    -------
+    Net
+        The copy, in eval mode. Its layers no longer match the
+        state_dict of a Net, so don't train or save it.
+    """
+    optimised = copy.deepcopy(model)
+    optimised.eval()
+
+    with torch.no_grad():
+        seq = fold_batchnorm(optimised.seq)
+
+        # Point the named layers at the fused ones, so they don't hang
+        # on to the unfused weights
+        fused = {id(a): b for (a, b) in zip(optimised.seq, seq)}
+
+        for (name, child) in list(optimised.named_children()):
+            if id(child) in fused:
+                setattr(optimised, name, fused[id(child)])
+
+        optimised.layers = [fused.get(id(layer), layer) for layer in optimised.layers]
+
+        if channels_last:
+            seq = seq.to(memory_format=torch.channels_last)
+
+        if jit:
+            device = next(seq.parameters()).device
+            example = torch.rand(2, 1, *optimised.splat.size, device=device)
+
+            if channels_last:
+                example = example.to(memory_format=torch.channels_last)
+
+            seq = torch.jit.optimize_for_inference(
+                torch.jit.freeze(torch.jit.trace(seq, example).eval())
+            )
+
+        optimised.seq = seq
+
+    return optimised
+
+
+def render_calibration(
+    splat, points: PointsTen, count: int, max_trans=0.1, sigma=1.25, batch_size=64
+) -> tuple:
+    """
+    Render the points at random rotations and translations, as
+    calibration images for quantise or as a held-out set to test it.
+
+    Parameters
+    ----------
+    splat : Splat
+        The renderer.
+    points : PointsTen
+        The points to render.
+    count : int
+        How many images.
+    max_trans : float
+        The largest translation, as the model was trained with
+        (default: 0.1).
+    sigma : float
+        The sigma to render with (default: 1.25).
+    batch_size : int
+        How many images to render at once (default: 64).
+
+    Returns
+    -------
+    tuple
+        The (count, 1, h, w) images, not yet normalised, and the
+        VecRotTenBatch and TransTenBatch they were rendered at.
+    """
+    device = points.data.device
+    rots = VecRotTenBatch.random(count, device=device)
+    trans = TransTenBatch(
+        (torch.rand(count, 2, device=device) * 2.0 - 1.0) * max_trans
+    )
+    mask = torch.ones(points.data.shape[0], dtype=torch.float32, device=device)
+
+    images = []
+
+    with torch.no_grad():
+        for start in range(0, count, batch_size):
+            batch = rots.data[start:start + batch_size]
+            images.append(
+                splat.render_batch(
+                    points.data,
+                    batch,
+                    trans.data[start:start + batch_size],
+                    mask,
+                    batch.new_full((len(batch),), sigma),
+                )
+            )
+
+    return (torch.cat(images).reshape(count, 1, *splat.size), rots, trans)
+
+
+def quantise(model, images=None, static=True, batch_size=32):
+    """
+    Return an int8 copy of a Net for the CPU, with the BatchNorm folded
+    in first. The model passed in is left alone.
+
+    Parameters
+    ----------
+    model : Net
+        The trained model, on the CPU.
+    images : torch.Tensor
+        The (B, 1, h, w) calibration images, normalised as the model
+        expects. Needed for static quantisation (default: None).
+    static : bool
+        Quantise the convs and the fully connected layers, with the
+        activation ranges measured on the calibration images. Otherwise,
+        quantise only the fully connected weights, with the activations
+        quantised on the fly (default: True).
+    batch_size : int
+        How many calibration images go through at once (default: 32).
+
+    Returns
+    -------
+    Net
+        The copy, in eval mode. As with optimise_for_inference, don't
+        train or save it.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    assert next(model.parameters()).device.type == "cpu", (
+        "Quantised models only run on the CPU."
+    )
+    quantised = optimise_for_inference(model, channels_last=False)
+
+    with torch.no_grad():
+        if not static:
+            quantised.seq = quantize_dynamic(
+                quantised.seq, {nn.Linear}, dtype=torch.qint8
+            )
+            return quantised
+
+        assert images is not None and len(images) > 0, (
+            "Static quantisation needs calibration images."
+        )
+        # Pick the qconfig for the engine this machine runs quantised ops on
+        engine = torch.backends.quantized.engine
+        qconfig = get_default_qconfig_mapping(
+            engine if engine in ("x86", "fbgemm", "qnnpack", "onednn") else "x86"
+        )
+        prepared = prepare_fx(quantised.seq, qconfig, (images[0:1],))
+
+        # Observe the range of every activation over the calibration set
+        for start in range(0, len(images), batch_size):
+            prepared(images[start:start + batch_size])
+
+        quantised.seq = convert_fx(prepared)
+
+    return quantised
+
+
+def compile_model(model, backend="inductor", dynamic=None):
+    """
+    Compile the forward pass of a Net - the encoder and the batched
+    renderer - with torch.compile. Unlike the functions above, this
+    works in place and the model can still be trained and saved.
+
+    Parameters
+    ----------
+    model : Net
+        The model to compile.
+    backend : str
+        The torch.compile backend (default: "inductor").
+    dynamic : bool
+        Passed on to torch.compile - None leaves it to decide whether
+        to compile for varying batch sizes (default: None).
+
+    Returns
+    -------
+    Net
+        The same model.
+    """
+    assert hasattr(torch, "compile"), (
+        "--compile needs torch 2.0 or later, this is torch " + torch.__version__
+    )
+    model._compiled = torch.compile(
+        model.render_tensors, backend=backend, dynamic=dynamic
+    )
+    return model
@@ -13,7 +13,9 @@ import torch
 import math
 from util.math import (
     gen_mat_from_rod,
+    gen_mats_from_rods,
     gen_trans_xy,
+    gen_trans_xys,
     gen_identity,
     gen_ndc,
     gen_scale,
@@ -68,6 +70,9 @@ class Splat(object):
         self.ndc = gen_ndc(self.size, device=self.device)
         self.xs = torch.tensor([0], dtype=torch.float32)
         self.ys = torch.tensor([0], dtype=torch.float32)
+        # The pixel co-ordinates along each axis, for render_batch
+        self.grid_x = torch.arange(self.size[1], dtype=torch.float32, device=device)
+        self.grid_y = torch.arange(self.size[0], dtype=torch.float32, device=device)
         # self.w_mask = torch.tensor([0])
 
         mask = []
@@ -137,6 +142,16 @@ class Splat(object):
         o = torch.matmul(self.modelview, points.data)
         return o
 
+    def __setstate__(self, state):
+        # Renderers pickled into model.tar before render_batch have no grids
+        self.__dict__.update(state)
+
+        if "grid_x" not in state:
+            self.grid_x = torch.arange(self.size[1], dtype=torch.float32)
+            self.grid_y = torch.arange(self.size[0], dtype=torch.float32)
+            self.grid_x = self.grid_x.to(self.device)
+            self.grid_y = self.grid_y.to(self.device)
+
     def to(self, device):
         """
         Move this class and all it's associated data from
@@ -162,6 +177,8 @@ class Splat(object):
         self.ndc = self.ndc.to(device)
         self.xs = self.xs.to(device)
         self.ys = self.ys.to(device)
+        self.grid_x = self.grid_x.to(device)
+        self.grid_y = self.grid_y.to(device)
         # self.w_mask = self.w_mask.to(device)
         return self
 
@@ -234,3 +251,54 @@ class Splat(object):
         )
 
         return model
+
+    def render_batch(
+        self,
+        points: torch.Tensor,
+        rots: torch.Tensor,
+        trans: torch.Tensor,
+        mask: torch.Tensor,
+        sigmas: torch.Tensor,
+    ) -> torch.Tensor:
+        """
+        Render a whole batch at once, as render does for one image. It
+        takes and returns plain tensors and has no branches on their
+        values, so torch.compile and torch.jit.trace can follow it.
+
+        A gaussian splat is the product of a gaussian in x and one in y,
+        so rather than an (N, h, w) tensor per image we sum the (N, w)
+        and (N, h) gaussians with a single batched matmul.
+
+        Parameters
+        ----------
+        points : torch.Tensor
+            The (N, 4, 1) points.
+        rots : torch.Tensor
+            The (B, 3) Rodrigues vectors.
+        trans : torch.Tensor
+            The (B, 2) translations.
+        mask : torch.Tensor
+            The (N) 1.0s or 0.0s to mask out certain points.
+        sigmas : torch.Tensor
+            The (B) sigmas.
+
+        Returns
+        -------
+        torch.Tensor
+            The (B, h, w) images.
+        """
+        modelview = torch.matmul(
+            torch.matmul(self.scale_mat, gen_trans_xys(trans)),
+            gen_mats_from_rods(rots),
+        )
+        # (B, 4, 4) @ (4, N) gives the (B, 4, N) screen positions
+        screen = torch.matmul(
+            torch.matmul(self.ndc, modelview), points.reshape(-1, 4).T
+        )
+        px = screen[:, 0, :].unsqueeze(2)
+        py = screen[:, 1, :].unsqueeze(2)
+        s2 = (2.0 * sigmas ** 2).reshape(-1, 1, 1)
+        gx = torch.exp(-((self.grid_x - px) ** 2) / s2)
+        gy = torch.exp(-((self.grid_y - py) ** 2) / s2) * mask.reshape(1, -1, 1)
+        images = torch.matmul(gy.transpose(1, 2), gx)
+        return images / (math.pi * s2)
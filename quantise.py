@@ -0,0 +1,273 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/          # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/          # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+quantise.py - how much pose accuracy the int8 models give up, and how
+much faster they are, so we can choose per deployment.
+
+The float model, the dynamic int8 model (fully connected layers only)
+and the static int8 model (convs and fully connected layers, calibrated
+on --calibration) each run over a held-out set. We report the time per
+image and how far each model's poses are from the float ones. When the
+held-out set is rendered, the error against the true rotations is given
+too.
+
+  python quantise.py --load ../runs/2021_05_06_bl_0 --calibration "acq/*.fits"
+
+Pass the same --quantise and --calibration to run.py or serve.py to use
+the trade-off you pick.
+
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+import torch
+import torch.nn.functional as F
+from net.optimise import optimise_for_inference, quantise, render_calibration
+from run import load_run, calibration_images
+
+
+def rotation_errors(q0: torch.Tensor, q1: torch.Tensor) -> torch.Tensor:
+    """
+    The angles, in degrees, between two batches of rotations.
+
+    Parameters
+    ----------
+    q0 : torch.Tensor
+        The (B, 4) unit quaternions.
+    q1 : torch.Tensor
+        The (B, 4) unit quaternions.
+
+    Returns
+    -------
+    torch.Tensor
+        The (B) angles.
+    """
+    # q and -q are the same rotation. atan2 keeps small angles accurate,
+    # where acos of a dot product close to one would not
+    q1 = torch.where((q0 * q1).sum(dim=1, keepdim=True) < 0, -q1, q1)
+    angles = torch.atan2((q0 - q1).norm(dim=1), (q0 + q1).norm(dim=1))
+    return torch.rad2deg(4.0 * angles)
+
+
+def run_model(model, points, images, batch_size=32) -> tuple:
+    """
+    Run a model over the held-out set.
+
+    Parameters
+    ----------
+    model : Net
+        The model, float or quantised.
+    points : PointsTen
+        The points to render with.
+    images : torch.Tensor
+        The (B, 1, h, w) normalised images.
+    batch_size : int
+        How many images go through at once (default: 32).
+
+    Returns
+    -------
+    tuple
+        The (B, 4) quaternions, the (B, 2) translations, the (B) sigmas,
+        the (B) losses, then the seconds spent in the encoder and in the
+        whole forward pass, rendering included.
+    """
+    results = ([], [], [], [])
+    (encoder, elapsed) = (0.0, 0.0)
+
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            # The encoder alone is what quantisation speeds up
+            tick = time.perf_counter()
+            model.seq(batch)
+            encoder += time.perf_counter() - tick
+            tick = time.perf_counter()
+            guesses = model.forward(batch, points)
+            elapsed += time.perf_counter() - tick
+            (rots, trans, sigmas) = model.get_poses()
+            losses = F.l1_loss(guesses, batch, reduction="none").sum(dim=(1, 2, 3))
+
+            for (result, value) in zip(
+                results, (rots.to_quaternions(), trans.data, sigmas, losses)
+            ):
+                result.append(value)
+
+    return tuple(torch.cat(r) for r in results) + (encoder, elapsed)
+
+
+def report(name: str, outputs: tuple, baseline: tuple, truth=None) -> dict:
+    """
+    Compare one model's outputs with those of the float model.
+
+    Parameters
+    ----------
+    name : str
+        The model.
+    outputs : tuple
+        What run_model returned for it.
+    baseline : tuple
+        What run_model returned for the float model.
+    truth : torch.Tensor
+        The (B, 4) true rotations of the held-out set, if known
+        (default: None).
+
+    Returns
+    -------
+    dict
+        One row of the report.
+    """
+    (quats, trans, sigmas, losses, encoder, elapsed) = outputs
+    errors = rotation_errors(quats, baseline[0])
+    row = {
+        "model": name,
+        "encoder_ms_per_image": encoder * 1000.0 / len(quats),
+        "ms_per_image": elapsed * 1000.0 / len(quats),
+        "rot_err_mean": float(errors.mean()),
+        "rot_err_p95": float(torch.quantile(errors, 0.95)),
+        "rot_err_max": float(errors.max()),
+        "trans_err_mean": float((trans - baseline[1]).norm(dim=1).mean()),
+        "sigma_err_mean": float((sigmas - baseline[2]).abs().mean()),
+        "loss_mean": float(losses.mean()),
+    }
+
+    if truth is not None:
+        truth_errors = rotation_errors(quats, truth)
+        row["truth_err_mean"] = float(truth_errors.mean())
+        row["truth_err_median"] = float(truth_errors.median())
+
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shaper quantisation report")
+    parser.add_argument("--load", default=".", help="Path to our model dir.")
+    parser.add_argument(
+        "--points", default="", help="Alternative points to use (default: none)."
+    )
+    parser.add_argument(
+        "--calibration",
+        default="",
+        help="Images to calibrate static quantisation on - a directory, a glob "
+        + "or a list file (default: rendered from the points).",
+    )
+    parser.add_argument(
+        "--calibration-count",
+        type=int,
+        default=256,
+        help="The most calibration images to use (default: 256).",
+    )
+    parser.add_argument(
+        "--held-out",
+        default="",
+        help="Images to test on, kept apart from the calibration images "
+        + "(default: rendered from the points, at random poses).",
+    )
+    parser.add_argument(
+        "--held-out-count",
+        type=int,
+        default=512,
+        help="The most held-out images to use (default: 512).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="How many images go through the model at once (default: 32).",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=1, help="Random seed (default: 1)."
+    )
+    parser.add_argument(
+        "--output", default="", help="Write the report to this CSV (default: none)."
+    )
+    args = parser.parse_args()
+
+    if not (
+        os.path.isfile(args.load + "/bundle.pt")
+        or os.path.isfile(args.load + "/checkpoint.pth.tar")
+    ):
+        print("--load must point to a run directory.")
+        sys.exit(0)
+
+    torch.manual_seed(args.seed)
+    device = torch.device("cpu")
+    (model, points, normaliser) = load_run(args.load, args.points, device, False)
+    calibration = calibration_images(
+        model,
+        points,
+        normaliser,
+        args.calibration,
+        args.calibration_count,
+        model.max_shift,
+    )
+    truth = None
+
+    if args.held_out != "":
+        held_out = calibration_images(
+            model, points, normaliser, args.held_out, args.held_out_count
+        )
+    else:
+        (held_out, rots, _) = render_calibration(
+            model.splat, points, args.held_out_count, max_trans=model.max_shift
+        )
+        held_out = normaliser.normalise(held_out)
+        truth = rots.to_quaternions()
+
+    print(
+        "Calibrating on", len(calibration), "images, testing on", len(held_out), "."
+    )
+    models = [
+        ("float", optimise_for_inference(model)),
+        ("dynamic", quantise(model, static=False)),
+        ("static", quantise(model, calibration, static=True)),
+    ]
+    baseline = None
+    rows = []
+
+    for (name, variant) in models:
+        outputs = run_model(variant, points, held_out, args.batch_size)
+        baseline = outputs if baseline is None else baseline
+        rows.append(report(name, outputs, baseline, truth))
+
+    for row in rows:
+        print(
+            "{:8} {:6.2f} ms/image in the encoder, {:6.2f} in all, rotation "
+            "error vs float {:5.2f} mean {:5.2f} p95 {:5.2f} max (degrees), "
+            "translation {:.4f}, sigma {:.4f}, loss {:.2f}".format(
+                row["model"],
+                row["encoder_ms_per_image"],
+                row["ms_per_image"],
+                row["rot_err_mean"],
+                row["rot_err_p95"],
+                row["rot_err_max"],
+                row["trans_err_mean"],
+                row["sigma_err_mean"],
+                row["loss_mean"],
+            )
+        )
+
+        if truth is not None:
+            print(
+                "{:8} rotation error vs truth {:6.2f} mean {:6.2f} median".format(
+                    "", row["truth_err_mean"], row["truth_err_median"]
+                )
+            )
+
+    if args.output != "":
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print(
+        "The static int8 encoder is {:.1f}x the speed of float.".format(
+            rows[0]["encoder_ms_per_image"] / max(rows[2]["encoder_ms_per_image"], 1e-9)
+        )
+    )
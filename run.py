@@ -17,19 +17,39 @@ To load a trained network:
 
   python run.py --load ../runs/2021_05_06_bl_0 --image renderer.fits --points ../runs/2021_05_06_bl_0/last.ply
 
+To run over a whole acquisition at once, pass --batch a directory, a
+glob or a text file listing the images. The model is loaded once, the
+images are read ahead by a pool of workers and the poses go to one CSV
+(or Parquet) file:
+
+  python run.py --load ../runs/2021_05_06_bl_0 --batch "acq/*.fits" --output poses.csv
+
 """
 
 import torch
 import math
 import argparse
+import csv
+import glob
 import sys
 import os
+from collections import deque
+from multiprocessing import Pool
+from torch.utils.data import Dataset, DataLoader
 from net.renderer import Splat
-from util.image import save_image, load_fits, save_fits
-from util.loadsave import load_checkpoint, load_model
+from net.optimise import (
+    compile_model,
+    optimise_for_inference,
+    quantise,
+    render_calibration,
+)
+from util.image import save_image, load_fits, save_fits, load_image
+from util.loadsave import load_checkpoint, load_model, load_bundle
 from util.plyobj import load_obj, load_ply
 from util.math import PointsTen
+from util.templates import TemplateIndex
 import torch.nn.functional as F
+from tqdm import tqdm
 from util.image import NormaliseBasic, NormaliseNull
 from PIL import Image
 
@@ -53,6 +73,122 @@ def _print_rotations(self, input, output):
     # but for now it's ok. Callbacks need to have something passed.
 
 
+def load_run(
+    savedir: str,
+    points_path: str,
+    device,
+    optimise=True,
+    quantisation="",
+    calibration="",
+):
+    """
+    Load a trained model, ready for inference, along with its points
+    and the normaliser it was trained with.
+
+    Parameters
+    ----------
+    savedir : str
+        The run directory, holding bundle.pt, or model.tar and
+        checkpoint.pth.tar.
+    points_path : str
+        An OBJ or PLY file of points to use in place of the trained
+        ones, or "" for the trained ones.
+    device : torch.device
+        The device to run on.
+    optimise : bool
+        Return the inference-optimised copy of the model, with the
+        BatchNorm folded and channels_last weights (default: True).
+    quantisation : str
+        "static" or "dynamic" for an int8 copy of the model on the CPU,
+        or "" for none (default: "").
+    calibration : str
+        The images to calibrate static quantisation on, as for
+        gather_images, or "" to render them (default: "").
+
+    Returns
+    -------
+    tuple
+        The model, the points and the normaliser.
+    """
+    if os.path.isfile(savedir + "/bundle.pt"):
+        (model, points, prev_args) = load_bundle(savedir + "/bundle.pt", device)
+    else:
+        model = load_model(savedir + "/model.tar", device)
+        (model, points, _, _, _, _, prev_args) = load_checkpoint(
+            model, savedir, "checkpoint.pth.tar", device
+        )
+        model = model.to(device)
+        model.eval()
+
+    normaliser = NormaliseNull()
+    if prev_args.normalise_basic:
+        normaliser = NormaliseBasic()
+
+    # Potentially load a different set of points
+    if points_path != "":
+        points = PointsTen(device=device)
+
+        if "ply" in points_path:
+            points.from_points(load_ply(points_path))
+        else:
+            points.from_points(load_obj(points_path))
+
+    if quantisation != "":
+        images = None
+
+        if quantisation == "static":
+            images = calibration_images(
+                model, points, normaliser, calibration, max_trans=model.max_shift
+            )
+
+        model = quantise(model, images, static=quantisation == "static")
+    elif optimise:
+        model = optimise_for_inference(model)
+
+    return (model, points, normaliser)
+
+
+def calibration_images(
+    model, points, normaliser, source="", count=256, max_trans=0.1
+) -> torch.Tensor:
+    """
+    Gather the images to calibrate static quantisation on.
+
+    Parameters
+    ----------
+    model : Net
+        The model, for its image size and renderer.
+    points : PointsTen
+        The points to render, if there are no images on disk.
+    normaliser : NormaliseBasic or NormaliseNull
+        The normaliser the model was trained with.
+    source : str
+        A directory, a glob or a list file of images, as for
+        gather_images, or "" to render them (default: "").
+    count : int
+        The most images to use (default: 256).
+    max_trans : float
+        The largest translation to render at (default: 0.1).
+
+    Returns
+    -------
+    torch.Tensor
+        The (B, 1, h, w) normalised images.
+    """
+    if source != "":
+        paths = gather_images(source)[:count]
+        assert len(paths) > 0, "No calibration images found in " + source
+        files = ImageFiles(paths, tuple(model.splat.size))
+        images = torch.stack([files[i][0] for i in range(len(files))])
+        images = images.to(points.data.device)
+    else:
+        (images, _, _) = render_calibration(
+            model.splat, points, count, max_trans=max_trans
+        )
+
+    return normaliser.normalise(images)
+
+
 def file_test(model, device, sigma, input_image):
     """Test our model by making an image, printing the rotations
     and then seeing what our model comes up with.
@@ -97,7 +233,6 @@ def image_test(model, points, device, sigma, input_image, normaliser):
         model.eval()
         im = normaliser.normalise(input_image.reshape((1, 1, 128, 128)))
         im = im.to(device)
-        model.set_sigma(sigma)
         x = normaliser.normalise(model.forward(im, points))
         x = torch.squeeze(x)
         im = torch.squeeze(im)
@@ -111,6 +246,190 @@ def image_test(model, points, device, sigma, input_image, normaliser):
         save_fits(x, name="guess.fits")
 
 
+IMAGE_EXTENSIONS = (".fits", ".fit", ".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+
+def gather_images(source: str) -> list:
+    """
+    Find the images to run over.
+
+    Parameters
+    ----------
+    source : str
+        A directory, a glob such as "acq/*.fits", or a text file with
+        one image path per line.
+
+    Returns
+    -------
+    list
+        The image paths, sorted for a directory or a glob.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, f)
+            for f in os.listdir(source)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    if os.path.isfile(source) and not source.lower().endswith(IMAGE_EXTENSIONS):
+        with open(source, "r") as f:
+            return [line.strip() for line in f if line.strip() != ""]
+
+    return sorted(glob.glob(source))
+
+
+class ImageFiles(Dataset):
+    """The images for a batch run, read from disk as they are needed
+    so the DataLoader workers can read ahead of the model."""
+
+    def __init__(self, paths: list, size: tuple):
+        self.paths = paths
+        self.size = size
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        path = self.paths[idx]
+
+        if path.lower().endswith((".fits", ".fit")):
+            image = load_fits(path, flip=True)
+        else:
+            image = load_image(path)
+
+        assert tuple(image.shape) == tuple(self.size), (
+            path + " is not of size " + str(self.size)
+        )
+        return (image.reshape(1, *self.size), idx)
+
+
+def _save_guess(job):
+    """ Save a rendered guess. Run in the writer pool."""
+    (guess, path) = job
+    save_image(guess, name=path + ".jpg")
+
+    if os.path.exists(path + ".fits"):
+        os.remove(path + ".fits")
+
+    save_fits(guess, name=path + ".fits")
+
+
+class ResultsWriter(object):
+    """ Write the per-image results to CSV, or to Parquet."""
+
+    FIELDS = [
+        "image", "rot_x", "rot_y", "rot_z", "trans_x", "trans_y", "sigma", "loss"
+    ]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self.rows = []
+
+        if not self.parquet:
+            self.f = open(path, "w", newline="")
+            self.writer = csv.writer(self.f)
+            self.writer.writerow(ResultsWriter.FIELDS)
+
+    def append(self, rows: list):
+        if self.parquet:
+            self.rows.extend(rows)
+        else:
+            self.writer.writerows(rows)
+
+    def close(self):
+        if self.parquet:
+            # Parquet needs pandas and pyarrow, so we only import them here
+            import pandas as pd
+
+            pd.DataFrame(self.rows, columns=ResultsWriter.FIELDS).to_parquet(self.path)
+        else:
+            self.f.close()
+
+
+def batch_run(model, points, device, normaliser, paths, args):
+    """Run the model over many images, a batch at a time, writing the
+    pose, sigma and loss for each image to a single file. The rendered
+    guesses are optionally saved by a pool of processes, with only a few
+    batches of them waiting to be written at any one time."""
+    size = tuple(model.splat.size)
+    loader = DataLoader(
+        ImageFiles(paths, size),
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        pin_memory=device.type == "cuda",
+    )
+    results = ResultsWriter(args.output)
+    writes = deque()
+    max_writes = 2 * max(1, args.workers)
+    pool = None
+
+    if args.guesses != "":
+        if not os.path.exists(args.guesses):
+            os.makedirs(args.guesses)
+
+        pool = Pool(processes=max(1, args.workers))
+
+    try:
+        with torch.no_grad():
+            model.eval()
+
+            for (images, idx) in tqdm(loader):
+                images = normaliser.normalise(images.to(device, non_blocking=True))
+                guesses = normaliser.normalise(model.forward(images, points))
+                losses = F.l1_loss(guesses, images, reduction="none").sum(
+                    dim=(1, 2, 3)
+                )
+                (rots, trans, sigmas) = model.get_poses()
+                rows = torch.cat(
+                    (
+                        rots.data,
+                        trans.data,
+                        sigmas.reshape(-1, 1),
+                        losses.reshape(-1, 1),
+                    ),
+                    dim=1,
+                )
+                names = [paths[i] for i in idx.tolist()]
+                results.append([[n] + r for (n, r) in zip(names, rows.tolist())])
+
+                if pool is not None:
+                    jobs = [
+                        (
+                            g.squeeze().cpu(),
+                            os.path.join(
+                                args.guesses,
+                                os.path.splitext(os.path.basename(n))[0] + "_guess",
+                            ),
+                        )
+                        for (g, n) in zip(guesses, names)
+                    ]
+                    writes.append(pool.map_async(_save_guess, jobs))
+
+                    # Wait on the oldest batch if the writers have fallen
+                    # behind, so the guesses don't pile up in memory
+                    while len(writes) > max_writes:
+                        writes.popleft().get()
+
+        while len(writes) > 0:
+            writes.popleft().get()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    results.close()
+
+
+def template_check(index, input_image, normaliser):
+    """Find the templates closest to the input image, printing their
+    rotations as a check on the pose the network came up with."""
+    im = normaliser.normalise(input_image.reshape((1, 1, *index.size)))
+    (dists, idx) = index.query(im, k=3)
+
+    for (d, r) in zip(dists[0], index.rotations(idx[0])):
+        print("Template:", float(d), ",", [float(r.x), float(r.y), float(r.z)])
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Shaper run")
     parser.add_argument("--load", default=".", help="Path to our model dir.")
@@ -126,40 +445,120 @@ if __name__ == "__main__":
     parser.add_argument(
         "--sigma", type=float, default=1.2, help="Sigma for the output (default: 1.2)"
     )
+    parser.add_argument(
+        "--templates",
+        default="",
+        help="Directory of template indices. Print the closest templates to the "
+        + "image, building the index for these points if needed (default: none).",
+    )
+    parser.add_argument(
+        "--template-count",
+        type=int,
+        default=4608,
+        help="Roughly how many templates in a new index (default: 4608).",
+    )
+    parser.add_argument(
+        "--template-pca",
+        type=int,
+        default=0,
+        help="Compress a new index to this many PCA components (default: 0, none).",
+    )
+    parser.add_argument(
+        "--batch",
+        default="",
+        help="Run over a directory, a glob or a list file of images (default: none).",
+    )
+    parser.add_argument(
+        "--output",
+        default="results.csv",
+        help="Where a batch run writes its results - .csv or .parquet "
+        + "(default: results.csv).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="How many images go through the model at once (default: 32).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(4, os.cpu_count()),
+        help="How many processes read images and write guesses (default: 4).",
+    )
+    parser.add_argument(
+        "--guesses",
+        default="",
+        help="Save the rendered guesses of a batch run here (default: none).",
+    )
+    parser.add_argument(
+        "--no-optimise",
+        action="store_true",
+        default=False,
+        help="Run the model as trained, without folding the BatchNorm layers.",
+    )
+    parser.add_argument(
+        "--quantise",
+        default="",
+        choices=["", "static", "dynamic"],
+        help="Run an int8 copy of the model on the CPU - static quantises the "
+        + "convs too, dynamic only the fully connected layers (default: none).",
+    )
+    parser.add_argument(
+        "--calibration",
+        default="",
+        help="Images to calibrate static quantisation on - a directory, a glob "
+        + "or a list file (default: rendered from the points).",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        default=False,
+        help="Compile the forward pass with torch.compile (default: False).",
+    )
 
     args = parser.parse_args()
     use_cuda = not args.no_cuda and torch.cuda.is_available()
+    use_cuda = use_cuda and args.quantise == ""
     device = torch.device("cuda" if use_cuda else "cpu")
 
-    if args.load and os.path.isfile(args.load + "/checkpoint.pth.tar"):
-        # (savedir, savename) = os.path.split(args.load)
-        # print(savedir, savename)
-        model = load_model(args.load + "/model.tar")
-        (model, points, _, _, _, _, prev_args) = load_checkpoint(
-            model, args.load, "checkpoint.pth.tar", device
+    if args.load and (
+        os.path.isfile(args.load + "/bundle.pt")
+        or os.path.isfile(args.load + "/checkpoint.pth.tar")
+    ):
+        (model, points, normaliser) = load_run(
+            args.load,
+            args.points,
+            device,
+            not args.no_optimise,
+            args.quantise,
+            args.calibration,
         )
-        model = model.to(device)
-        model.eval()
     else:
         print("--load must point to a run directory.")
         sys.exit(0)
 
-    points = PointsTen(device=device)
-
-    normaliser = NormaliseNull()
-    if prev_args.normalise_basic:
-        normaliser = NormaliseBasic()
+    if args.compile:
+        compile_model(model)
 
-    # Potentially load a different set of points
-    if args.points != "":
-        if "ply" in args.points:
-            points.from_points(load_ply(args.points))
-        else:
-            points.from_points(load_obj(args.points))
-
-    if os.path.isfile(args.image):
+    if args.batch != "":
+        paths = gather_images(args.batch)
+        print("Running over", len(paths), "images.")
+        batch_run(model, points, device, normaliser, paths, args)
+    elif os.path.isfile(args.image):
         input_image = load_fits(args.image, flip=True)
         image_test(model, points, device, args.sigma, input_image, normaliser)
+
+        if args.templates != "":
+            index = TemplateIndex.load_or_build(
+                args.templates,
+                points,
+                count=args.template_count,
+                sigma=args.sigma,
+                components=args.template_pca,
+                device=device,
+            )
+            template_check(index, input_image, normaliser)
     else:
         print("--image must point to a valid fits file.")
         sys.exit(0)
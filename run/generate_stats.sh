@@ -60,8 +60,17 @@ echo $base
 echo $groundtruth
 echo $extras
 
-# Generate a single animated JSON 3D points model from our OBJ files.
-python ../stats/objs_to_json.py --path $base/objs --limit -1
+# Generate a single animated JSON 3D points model and the last ply from our
+# trajectory file. Older runs wrote an OBJ and PLY file per interval instead.
+if [ -f $base/points.traj ]; then
+  mkdir -p $base/objs
+  python ../stats/trajectory.py --path $base/points.traj --animation $base/objs/animation.json --animation-bin $base/objs/animation.bin --ply $base/last.ply
+else
+  python ../stats/objs_to_json.py --path $base/objs --limit -1
+  python ../stats/objs_to_json.py --path $base/objs --limit -1 --binary
+  lastply=`ls -rt $base/plys/shape*ply | tail -1`
+  cp $lastply $base/last.ply
+fi
 
 # Find out which sigma file we used.
 sigmafile=`grep "sigma" $base/run.conf | sed -En "s/.*sigma-file ([^ ]+).*/\1/p"`
@@ -72,9 +81,6 @@ if [ -f $sigmafile ]; then
   cp $sigmafile $base/$sigmafile
 fi
 
-lastply=`ls -rt $base/plys/shape*ply | tail -1`
-cp $lastply $base/last.ply
-
 # Create a subdir we can rsync to the server.
 subdir="${1##*/}"
 
@@ -97,8 +103,10 @@ montage -frame 3 -geometry 128x64 /tmp/pair_* $base/pair_montage.jpg
 rm /tmp/pair_*
 
 
-# Copy the stats jupyter notebook
+# Copy the stats jupyter notebook, along with the reader for local stats.db files
 cp stats.ipynb $base
+cp ../stats/reader.py $base
+cp ../stats/encoding.py $base
 
 # Make our diff image with a nice shift.
 convert '(' $base/montage_out.jpg -flatten -grayscale Rec709Luminance ')'\
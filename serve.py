@@ -0,0 +1,422 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/          # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/          # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+serve.py - a long running, local pose estimation service.
+
+The model and points are loaded once, as run.py does. Requests arriving
+at the same time are gathered into micro-batches - up to --max-batch
+images, waiting no more than --max-wait milliseconds after the first -
+and run through the model in a single forward pass.
+
+Over HTTP on localhost (or a Unix socket with --socket):
+
+  POST /pose       the image as raw float32 bytes (little-endian, height
+                   x width), or as JSON {"image": [[...], ...]}. Add
+                   ?guess=1 for the rendered guess, base64 float32.
+                   Returns the rotation, translation, sigma and loss.
+  GET  /health     whether we are up, and the queue length.
+  GET  /metrics    request and batch counts, batch sizes and latencies.
+
+For example:
+
+  python serve.py --load ../runs/2021_05_06_bl_0 --port 8808
+
+"""
+
+import argparse
+import base64
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class MicroBatcher(object):
+    """Gathers single images into batches for the model, on a thread of
+    its own. Each image gets a Future that the thread fills in."""
+
+    def __init__(self, model, points, normaliser, max_batch=32, max_wait=0.005):
+        """
+        Start our batcher.
+
+        Parameters
+        ----------
+        model : Net
+            The model, in eval mode.
+        points : PointsTen
+            The points to render with.
+        normaliser : NormaliseBasic or NormaliseNull
+            The normaliser the model was trained with.
+        max_batch : int
+            The most images in a batch (default: 32).
+        max_wait : float
+            How long, in seconds, a batch waits for more images after
+            its first (default: 0.005).
+
+        Returns
+        -------
+        MicroBatcher
+        """
+        self.model = model
+        self.points = points
+        self.normaliser = normaliser
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.size = tuple(model.splat.size)
+        self.queue = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        # The recent latencies, in seconds, and batch sizes
+        self.latencies = deque(maxlen=1000)
+        self.batch_sizes = deque(maxlen=1000)
+        self.started = time.time()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image: torch.Tensor, guess=False) -> Future:
+        """
+        Queue an image.
+
+        Parameters
+        ----------
+        image : torch.Tensor
+            The (h, w) image, the size the model was trained at.
+        guess : bool
+            Return the rendered guess too (default: False).
+
+        Returns
+        -------
+        Future
+            Resolves to a dictionary of the results.
+        """
+        assert tuple(image.shape) == self.size, "Image must be of size " + str(
+            self.size
+        )
+        future = Future()
+        self.queue.put((image, guess, future, time.perf_counter()))
+        return future
+
+    def _gather(self) -> list:
+        """ Internal function. Wait for an image, then gather a batch."""
+        try:
+            jobs = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+
+            try:
+                if remaining > 0:
+                    jobs.append(self.queue.get(timeout=remaining))
+                else:
+                    jobs.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return jobs
+
+    def _run(self):
+        """ Internal function. The batching loop."""
+        while self.running:
+            jobs = self._gather()
+
+            if len(jobs) == 0:
+                continue
+
+            try:
+                results = self.infer(torch.stack([j[0] for j in jobs]), jobs)
+            except Exception as e:
+                self.errors += 1
+
+                for job in jobs:
+                    job[2].set_exception(e)
+
+                continue
+
+            now = time.perf_counter()
+            self.batches += 1
+            self.requests += len(jobs)
+            self.batch_sizes.append(len(jobs))
+
+            for (job, result) in zip(jobs, results):
+                self.latencies.append(now - job[3])
+                job[2].set_result(result)
+
+    def infer(self, images: torch.Tensor, jobs: list) -> list:
+        """
+        Run a batch of images through the model.
+
+        Parameters
+        ----------
+        images : torch.Tensor
+            The (B, h, w) images.
+        jobs : list
+            The queued jobs, saying which want the guess.
+
+        Returns
+        -------
+        list
+            A dictionary of results for each image.
+        """
+        device = self.points.data.device
+
+        with torch.no_grad():
+            images = images.reshape(len(jobs), 1, *self.size).to(device)
+            images = self.normaliser.normalise(images)
+            guesses = self.normaliser.normalise(self.model.forward(images, self.points))
+            losses = F.l1_loss(guesses, images, reduction="none").sum(dim=(1, 2, 3))
+            (rots, trans, sigmas) = self.model.get_poses()
+
+        results = []
+
+        for i in range(len(jobs)):
+            result = {
+                "rotation": rots.data[i].tolist(),
+                "translation": trans.data[i].tolist(),
+                "sigma": float(sigmas[i]),
+                "loss": float(losses[i]),
+            }
+
+            if jobs[i][1]:
+                guess = guesses[i].squeeze().cpu().numpy().astype("<f4")
+                result["guess"] = base64.b64encode(guess.tobytes()).decode("ascii")
+                result["guess_shape"] = list(guess.shape)
+
+            results.append(result)
+
+        return results
+
+    def metrics(self) -> dict:
+        """
+        Return our counts and the recent latencies, in milliseconds.
+
+        Returns
+        -------
+        dict
+        """
+        latencies = np.array(self.latencies) * 1000.0
+        sizes = np.array(self.batch_sizes)
+        stats = {
+            "uptime": time.time() - self.started,
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "queue": self.queue.qsize(),
+            "mean_batch_size": float(sizes.mean()) if len(sizes) > 0 else 0.0,
+        }
+
+        for p in (50, 95, 99):
+            key = "latency_p" + str(p) + "_ms"
+            stats[key] = float(np.percentile(latencies, p)) if len(latencies) else 0.0
+
+        return stats
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+class PoseHandler(BaseHTTPRequestHandler):
+    """ Our HTTP requests. The batcher is held by the server."""
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        batcher = self.server.batcher
+        path = urlparse(self.path).path
+
+        if path == "/health":
+            alive = batcher.thread.is_alive()
+            self._reply(
+                200 if alive else 503,
+                {"status": "ok" if alive else "down", "queue": batcher.queue.qsize()},
+            )
+        elif path == "/metrics":
+            self._reply(200, batcher.metrics())
+        else:
+            self._reply(404, {"error": "Unknown path " + path})
+
+    def do_POST(self):
+        batcher = self.server.batcher
+        url = urlparse(self.path)
+
+        if url.path != "/pose":
+            self._reply(404, {"error": "Unknown path " + url.path})
+            return
+
+        guess = parse_qs(url.query).get("guess", ["0"])[0] in ("1", "true")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                image = np.array(json.loads(body)["image"], dtype=np.float32)
+            else:
+                image = np.frombuffer(body, dtype="<f4").reshape(batcher.size)
+
+            result = batcher.submit(torch.from_numpy(image.copy()), guess).result()
+        except (AssertionError, ValueError, KeyError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+            return
+
+        self._reply(200, result)
+
+    def log_message(self, format, *args):
+        # One line per request would swamp the console
+        pass
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    """ The HTTP server, but on a Unix socket."""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(batcher: MicroBatcher, host="127.0.0.1", port=8808, unix_socket=""):
+    """
+    Create the server, on a port of localhost or a Unix socket.
+
+    Parameters
+    ----------
+    batcher : MicroBatcher
+        The batcher for the model.
+    host : str
+        The host to listen on (default: "127.0.0.1").
+    port : int
+        The port to listen on, or 0 for any free one (default: 8808).
+    unix_socket : str
+        Listen on this Unix socket instead, if given (default: "").
+
+    Returns
+    -------
+    ThreadingHTTPServer
+    """
+    if unix_socket != "":
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+        server = UnixHTTPServer(unix_socket, PoseHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), PoseHandler)
+
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+if __name__ == "__main__":
+    from run import load_run
+
+    parser = argparse.ArgumentParser(description="Shaper pose server")
+    parser.add_argument("--load", default=".", help="Path to our model dir.")
+    parser.add_argument(
+        "--points", default="", help="Alternative points to use (default: none)."
+    )
+    parser.add_argument(
+        "--no-cuda", action="store_true", default=False, help="disables CUDA"
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Host to listen on (default: 127.0.0.1)."
+    )
+    parser.add_argument(
+        "--port", type=int, default=8808, help="Port to listen on (default: 8808)."
+    )
+    parser.add_argument(
+        "--socket", default="", help="Listen on this Unix socket instead of a port."
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=32,
+        help="The most images in a micro-batch (default: 32).",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=5.0,
+        help="Milliseconds a micro-batch waits for more images (default: 5).",
+    )
+    parser.add_argument(
+        "--no-optimise",
+        action="store_true",
+        default=False,
+        help="Run the model as trained, without folding the BatchNorm layers.",
+    )
+    parser.add_argument(
+        "--quantise",
+        default="",
+        choices=["", "static", "dynamic"],
+        help="Serve an int8 copy of the model on the CPU (default: none).",
+    )
+    parser.add_argument(
+        "--calibration",
+        default="",
+        help="Images to calibrate static quantisation on (default: rendered).",
+    )
+
+    args = parser.parse_args()
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    use_cuda = use_cuda and args.quantise == ""
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    if not (
+        os.path.isfile(args.load + "/bundle.pt")
+        or os.path.isfile(args.load + "/checkpoint.pth.tar")
+    ):
+        print("--load must point to a run directory.")
+        sys.exit(0)
+
+    (model, points, normaliser) = load_run(
+        args.load,
+        args.points,
+        device,
+        not args.no_optimise,
+        args.quantise,
+        args.calibration,
+    )
+    batcher = MicroBatcher(
+        model, points, normaliser, args.max_batch, args.max_wait / 1000.0
+    )
+    server = make_server(batcher, args.host, args.port, args.socket)
+    print("Serving on", args.socket if args.socket != "" else server.server_address)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
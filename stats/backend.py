@@ -0,0 +1,331 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+backend.py - where our stats end up. Either the remote Redis and
+PostgreSQL databases we use for the dashboards, or a local SQLite
+file that lives alongside the run and needs no external service.
+
+The records are already converted by the time they reach the
+backend - either an array blob (see stats/encoding.py) or something
+JSON friendly.
+
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from stats.encoding import is_encoded, encode_record
+
+
+class StatsBackend(object):
+    """ The base class for all our stats backends."""
+
+    def add(self, name: str, epoch: int, step: int, idx: int, data):
+        """
+        Add a single record.
+
+        Parameters
+        ----------
+        name : str
+            The name of the statistic, such as loss_train.
+        epoch : int
+            The current epoch.
+        step : int
+            The current step.
+        idx : int
+            The index (x-axis) of this record.
+        data : object
+            The JSON friendly value, or an array blob.
+
+        Returns
+        -------
+        None
+        """
+        assert False
+
+    def flush(self):
+        """ Write out anything we are holding on to."""
+        pass
+
+    def close(self):
+        """ Flush and close any connections."""
+        self.flush()
+
+
+class RemoteBackend(StatsBackend):
+    """The Redis and PostgreSQL backend, used for our live dashboards.
+    Records are held in memory and written in batches - a Redis pipeline
+    and a single multi-row INSERT into an append-only PostgreSQL table
+    keyed on (experiment, name, idx) - through connection pools. If only
+    one of the two databases is up, we carry on with that one."""
+
+    def __init__(
+        self,
+        exp_name: str,
+        redis_client=None,
+        pg_pool=None,
+        batch_size=128,
+        flush_interval=5.0,
+        host="localhost",
+    ):
+        """
+        Connect to Redis and PostgreSQL. Raises a ConnectionError if
+        neither is available.
+
+        Parameters
+        ----------
+        exp_name : str
+            The name of the experiment, used to prefix our keys.
+        redis_client : redis.Redis
+            A Redis client to use instead of connecting to host
+            (default: None).
+        pg_pool : psycopg2.pool.AbstractConnectionPool
+            A pool with getconn and putconn to use instead of connecting
+            to host (default: None).
+        batch_size : int
+            How many records to hold before writing (default: 128).
+        flush_interval : float
+            The most seconds a record can wait before being written
+            (default: 5.0).
+        host : str
+            The host running Redis and PostgreSQL (default: localhost).
+
+        Returns
+        -------
+        RemoteBackend
+        """
+        self.exp_name = exp_name  # WARNING - overwrite potential in the REDIS
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # The number of seconds in a month. Used to invalidate Redis Keys
+        self._redis_ttl = 2629800
+        self._pending = []
+        # Records a backend failed to write, kept to try again next flush
+        self._retry = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self.R = redis_client
+        self.pool = pg_pool
+
+        if self.R is None:
+            try:
+                import redis
+
+                rpool = redis.ConnectionPool(host=host, port=6379, db=0)
+                self.R = redis.Redis(connection_pool=rpool)
+                self.R.ping()
+            except Exception:
+                self.R = None
+
+        if self.pool is None:
+            try:
+                from psycopg2.pool import ThreadedConnectionPool
+
+                conn_string = "host='" + host + "' dbname='phd' user='postgres' \
+                    password='postgres'"
+                self.pool = ThreadedConnectionPool(1, 4, conn_string)
+            except Exception:
+                self.pool = None
+
+        if self.R is None and self.pool is None:
+            raise ConnectionError("Cannot connect to PostgreSQL or Redis.")
+
+        if self.pool is not None:
+            conn = self.pool.getconn()
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS experiment_stats (experiment TEXT \
+                        NOT NULL, name TEXT NOT NULL, idx BIGINT NOT NULL, \
+                        epoch INTEGER, step INTEGER, data JSONB, blob BYTEA)"
+                )
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS experiment_stats_key ON \
+                        experiment_stats (experiment, name, idx)"
+                )
+                conn.commit()
+            finally:
+                self.pool.putconn(conn)
+
+    def add(self, name: str, epoch: int, step: int, idx: int, data):
+        with self._lock:
+            self._pending.append((name, epoch, step, idx, data))
+
+            if (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush > self.flush_interval
+            ):
+                self._flush()
+
+    def _flush_redis(self, records: list):
+        """ Internal function. Write our records in one pipeline."""
+        pipe = self.R.pipeline(transaction=False)
+        keys = set()
+
+        for (name, epoch, step, idx, data) in records:
+            key = self.exp_name + ":" + name
+            pipe.zadd(key, {encode_record(epoch, step, data): idx})
+            keys.add(key)
+
+        for key in keys:
+            pipe.expire(key, self._redis_ttl)
+
+        pipe.execute()
+
+    def _flush_postgres(self, records: list):
+        """ Internal function. Write our records in one INSERT."""
+        values = []
+        params = []
+
+        for (name, epoch, step, idx, data) in records:
+            values.append("(%s, %s, %s, %s, %s, %s, %s)")
+            params.extend([self.exp_name, name, idx, epoch, step])
+
+            if is_encoded(data):
+                params.extend([None, data])
+            else:
+                params.extend([json.dumps(data), None])
+
+        conn = self.pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO experiment_stats (experiment, name, idx, epoch, \
+                    step, data, blob) VALUES " + ", ".join(values),
+                params,
+            )
+            conn.commit()
+        except Exception:
+            # Don't hand the pool back a connection in an aborted transaction
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _flush(self):
+        """ Internal function. Write our pending records. Lock must be held."""
+        records = self._pending
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+        # Write to both before raising, so one failing doesn't stop the other.
+        # A failed batch is tried again with the next one, on that backend
+        # only - re-adding to a Redis sorted set is harmless, and the
+        # PostgreSQL INSERT is all or nothing, so nothing is written twice.
+        error = None
+
+        for name, write, ready in (
+            ("redis", self._flush_redis, self.R is not None),
+            ("postgres", self._flush_postgres, self.pool is not None),
+        ):
+            batch = self._retry.pop(name, []) + records
+
+            if ready and len(batch) > 0:
+                try:
+                    write(batch)
+                except Exception as e:
+                    self._retry[name] = batch
+                    error = e
+
+        if error is not None:
+            raise error
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+            if self.pool is not None and hasattr(self.pool, "closeall"):
+                self.pool.closeall()
+
+
+class SQLiteBackend(StatsBackend):
+    """A local, append-only stats store. Records are held in memory and
+    written in batches to an SQLite database in WAL mode, so each write
+    costs the same no matter how long the run has been going. Read it
+    back with stats.reader.StatsReader."""
+
+    def __init__(self, path: str, batch_size=256, flush_interval=10.0):
+        """
+        Open (or create) our database.
+
+        Parameters
+        ----------
+        path : str
+            The path to the database file.
+        batch_size : int
+            How many records to hold before writing (default: 256).
+        flush_interval : float
+            The most seconds a record can wait before being written
+            (default: 10.0).
+
+        Returns
+        -------
+        SQLiteBackend
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path) != "" and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT NOT NULL, \
+                idx INTEGER NOT NULL, epoch INTEGER, step INTEGER, data TEXT)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS stats_name_idx ON stats (name, idx)"
+        )
+        self.conn.commit()
+
+    def add(self, name: str, epoch: int, step: int, idx: int, data):
+        with self._lock:
+            # Blobs are stored as is, in the same column as the JSON
+            if not is_encoded(data):
+                data = json.dumps(data)
+
+            self._pending.append((name, idx, epoch, step, data))
+
+            if (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush > self.flush_interval
+            ):
+                self._flush()
+
+    def _flush(self):
+        """ Internal function. Write our pending records. Lock must be held."""
+        if len(self._pending) > 0:
+            self.conn.executemany(
+                "INSERT INTO stats (name, idx, epoch, step, data) \
+                    VALUES (?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self.conn.commit()
+            self._pending = []
+
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.conn.close()
@@ -0,0 +1,193 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+encoding.py - the binary format for the arrays we store as stats.
+Rotations, sigmas and images are written as typed, little-endian
+blobs with a small header holding the dtype and shape, rather than
+nested JSON lists. Scalars are still stored as JSON.
+
+Blob layout:
+    b"HTEN", dtype code (uint8), ndim (uint8), shape (ndim x uint64),
+    then the raw data in C order.
+
+Only needs the standard library to decode (numpy is used if it is
+there), so it can be copied next to the stats.ipynb notebook along
+with reader.py.
+
+"""
+
+import array
+import json
+import struct
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"HTEN"
+RECORD_MAGIC = b"HREC"
+
+# Our dtype codes, with the numpy and array module type for each
+_DTYPES = {
+    0: ("<f4", "f"),
+    1: ("<f8", "d"),
+    2: ("<i4", "i"),
+    3: ("<i8", "q"),
+    4: ("|u1", "B"),
+}
+_CODES = {v[0]: k for (k, v) in _DTYPES.items()}
+
+
+def is_encoded(blob) -> bool:
+    """
+    Is this an array blob, as created by encode?
+
+    Parameters
+    ----------
+    blob : object
+        Anything read back from a backend.
+
+    Returns
+    -------
+    bool
+    """
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(
+        blob[0:4]
+    ) == MAGIC
+
+
+def encode(arr) -> bytes:
+    """
+    Encode a numpy array into our blob format. Bools and 16-bit floats
+    are widened; anything else we don't have a code for becomes float64.
+
+    Parameters
+    ----------
+    arr : numpy.ndarray
+        The array to encode.
+
+    Returns
+    -------
+    bytes
+    """
+    arr = np.asarray(arr)
+
+    if arr.dtype == np.bool_:
+        arr = arr.astype(np.uint8)
+    elif arr.dtype == np.float16:
+        arr = arr.astype(np.float32)
+
+    dtype = arr.dtype.newbyteorder("<") if arr.dtype.itemsize > 1 else arr.dtype
+
+    if dtype.str not in _CODES:
+        dtype = np.dtype("<f8")
+
+    arr = np.ascontiguousarray(arr, dtype=dtype)
+    header = struct.pack(
+        "<4sBB" + "Q" * arr.ndim, MAGIC, _CODES[dtype.str], arr.ndim, *arr.shape
+    )
+    return header + arr.tobytes()
+
+
+def _nest(flat: list, shape: tuple) -> list:
+    """ Internal function. Turn a flat list into nested lists of shape."""
+    if len(shape) <= 1:
+        return flat
+
+    step = len(flat) // shape[0]
+    return [_nest(flat[i * step:(i + 1) * step], shape[1:]) for i in range(shape[0])]
+
+
+def decode(blob, as_list=False):
+    """
+    Decode a blob created by encode. We return a numpy array that
+    views the blob without copying if numpy is available, otherwise
+    (or if as_list is set) nested lists, as json.loads would give.
+
+    Parameters
+    ----------
+    blob : bytes
+        The blob to decode.
+    as_list : bool
+        Return nested lists rather than an array (default: False).
+
+    Returns
+    -------
+    numpy.ndarray or list
+    """
+    blob = bytes(blob)
+    (magic, code, ndim) = struct.unpack_from("<4sBB", blob, 0)
+    assert magic == MAGIC
+    shape = struct.unpack_from("<" + "Q" * ndim, blob, 6)
+    offset = 6 + 8 * ndim
+    (np_type, array_type) = _DTYPES[code]
+
+    if np is not None:
+        arr = np.frombuffer(blob, dtype=np_type, offset=offset).reshape(shape)
+        return arr.tolist() if as_list else arr
+
+    flat = array.array(array_type)
+    flat.frombytes(blob[offset:])
+
+    if sys.byteorder != "little":
+        flat.byteswap()
+
+    if ndim == 0:
+        return flat[0]
+
+    return _nest(flat.tolist(), shape)
+
+
+def encode_record(epoch: int, step: int, data):
+    """
+    Encode a full record, for stores (such as Redis) that hold the
+    epoch, step and data together. Blobs get a binary record, everything
+    else the JSON record we have always used.
+
+    Parameters
+    ----------
+    epoch : int
+        The epoch.
+    step : int
+        The step.
+    data : object
+        Either a blob from encode, or something JSON friendly.
+
+    Returns
+    -------
+    bytes or str
+    """
+    if is_encoded(data):
+        return RECORD_MAGIC + struct.pack("<qq", epoch, step) + bytes(data)
+
+    return json.dumps({"epoch": epoch, "step": step, "data": data})
+
+
+def decode_record(record, as_list=False) -> dict:
+    """
+    Decode a record created by encode_record.
+
+    Parameters
+    ----------
+    record : bytes or str
+        The record.
+    as_list : bool
+        Return any array as nested lists (default: False).
+
+    Returns
+    -------
+    dict
+        With the keys epoch, step and data.
+    """
+    if isinstance(record, (bytes, bytearray)) and bytes(record[0:4]) == RECORD_MAGIC:
+        (epoch, step) = struct.unpack_from("<qq", record, 4)
+        data = decode(record[20:], as_list=as_list)
+        return {"epoch": epoch, "step": step, "data": data}
+
+    return json.loads(record)
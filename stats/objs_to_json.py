@@ -1,20 +1,182 @@
-""" # noqa 
+""" # noqa
    ___           __________________  ___________
   / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
- / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa 
-/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa 
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
 Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
 
-objs_to_json.py - Given a list of OBJ files representing our points, combine 
+objs_to_json.py - Given a list of OBJ files representing our points, combine
 them into JSON animation for our analysis.
 
 This file is used in the generate stats script. The resulting json can be used
 in the jupyter notebook provided, or with the blender_vis.py script.
+
+The OBJ files are parsed in a pool of processes and the frames are written out
+as they arrive, so the whole animation is never held in memory. Passing
+--binary writes animation.bin instead - a compact file that blender_vis.py and
+train/icp_test.py read far faster than the JSON:
+
+    b"HANI", header length (uint32), a JSON header padded with spaces
+    (frames, points, dtype), then the (frames, points, 3) float32 data
+    starting at byte 256.
 """
 
 import math
 import os
 import json
+import struct
+import numpy as np
+from multiprocessing import Pool
+
+MAGIC = b"HANI"
+DATA_OFFSET = 256
+
+
+def parse_obj(objpath: str) -> np.ndarray:
+    """
+    Read the vertices from one of our shape OBJ files.
+
+    Parameters
+    ----------
+    objpath : str
+        The path to the OBJ file.
+
+    Returns
+    -------
+    np.ndarray
+        The (N, 3) float32 vertices.
+    """
+    vertices = []
+
+    with open(objpath, "r") as f:
+        for line in f:
+            if line.startswith("v "):
+                vertices.append(line.split()[1:4])
+
+    return np.array(vertices, dtype=np.float32).reshape(-1, 3)
+
+
+class AnimationJSONWriter(object):
+    """ Write the animation JSON a frame at a time."""
+
+    def __init__(self, path: str):
+        self.f = open(path, "w")
+        self.f.write('{"frames": [')
+        self.frames = 0
+
+    def append(self, vertices: np.ndarray):
+        """
+        Add a frame.
+
+        Parameters
+        ----------
+        vertices : np.ndarray
+            The (N, 3) vertices of this frame.
+
+        Returns
+        -------
+        self
+        """
+        scene = {
+            "vertices": [
+                {"x": x, "y": y, "z": z} for (x, y, z) in vertices.tolist()
+            ]
+        }
+
+        if self.frames > 0:
+            self.f.write(",\n")
+
+        self.f.write(json.dumps(scene))
+        self.frames += 1
+        return self
+
+    def close(self):
+        self.f.write("]}\n")
+        self.f.close()
+
+
+class AnimationBinaryWriter(object):
+    """Write the binary animation a frame at a time. The header is
+    filled in once we know how many frames there are."""
+
+    def __init__(self, path: str):
+        self.f = open(path, "wb")
+        self.f.write(b"\0" * DATA_OFFSET)
+        self.frames = 0
+        self.points = None
+
+    def append(self, vertices: np.ndarray):
+        """
+        Add a frame.
+
+        Parameters
+        ----------
+        vertices : np.ndarray
+            The (N, 3) vertices of this frame.
+
+        Returns
+        -------
+        self
+        """
+        if self.points is None:
+            self.points = vertices.shape[0]
+
+        assert vertices.shape == (self.points, 3), "All frames need the same points"
+        self.f.write(np.ascontiguousarray(vertices, dtype="<f4").tobytes())
+        self.frames += 1
+        return self
+
+    def close(self):
+        header = json.dumps(
+            {"frames": self.frames, "points": self.points or 0, "dtype": "<f4"}
+        )
+        header = header.ljust(DATA_OFFSET - 8).encode("utf-8")
+        self.f.seek(0)
+        self.f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.f.close()
+
+
+def load_animation(path: str) -> np.ndarray:
+    """
+    Load an animation, either the binary or the JSON version.
+
+    Parameters
+    ----------
+    path : str
+        The path to animation.bin or animation.json.
+
+    Returns
+    -------
+    np.ndarray
+        The (frames, points, 3) float32 vertices. For the binary
+        version, this is memory-mapped.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+        if magic == MAGIC:
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length).decode("utf-8"))
+            shape = (header["frames"], header["points"], 3)
+
+            if header["frames"] == 0:
+                return np.zeros(shape, dtype=np.float32)
+
+            return np.memmap(
+                path, dtype=header["dtype"], mode="r", offset=DATA_OFFSET, shape=shape
+            )
+
+    with open(path, "r") as f:
+        animation = json.load(f)
+
+    return np.array(
+        [
+            [(v["x"], v["y"], v["z"]) for v in frame["vertices"]]
+            for frame in animation["frames"]
+        ],
+        dtype=np.float32,
+    ).reshape(len(animation["frames"]), -1, 3)
+
 
 if __name__ == "__main__":
     import argparse
@@ -29,6 +191,18 @@ if __name__ == "__main__":
         help="number of OBJ files to \
                         consider(default: all)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes parsing the OBJ files (default: all cpus)",
+    )
+    parser.add_argument(
+        "--binary",
+        default=False,
+        action="store_true",
+        help="write the compact animation.bin rather than animation.json",
+    )
     args = parser.parse_args()
 
     obj_files = []
@@ -38,6 +212,8 @@ if __name__ == "__main__":
             if any(x in filename for x in obj_extentions) and "shape" in filename:
                 obj_files.append(os.path.join(dirname, filename))
 
+    # Sort first, so the frames we pick with limit are equally spaced in time
+    obj_files.sort()
     final_objs = []
     # Go through and select 'limit' number of objects equally spaced
     if args.limit != -1:
@@ -48,31 +224,16 @@ if __name__ == "__main__":
     else:
         final_objs = obj_files
 
-    print("Exporting OBJ files to animation json")
-    final_objs.sort()
-    frameidx = 0
-
-    animation = {}
-    animation["frames"] = []
-
-    for objpath in final_objs:
-        # scene = pywavefront.Wavefront(objpath, parse=True)
-        scene = {}
-        scene["vertices"] = []
-        with open(objpath, "r") as f:
-            for line in f.readlines()[2:]:
-                if "v" in line:
-                    tokens = line.replace("v", "").replace("\n", "").split(" ")
-                    vertex = {}
-                    vertex["x"] = float(tokens[1])
-                    vertex["y"] = float(tokens[2])
-                    vertex["z"] = float(tokens[3])
-                    scene["vertices"].append(vertex)
-                frameidx += 1
-        animation["frames"].append(scene)
-        # if frameidx > args.limit:
-        #  break
-
-    final_json = json.dumps(animation, indent=2)
-    with open(args.path + "/animation.json", "w") as f:
-        f.write(final_json)
+    if args.binary:
+        print("Exporting OBJ files to animation bin")
+        writer = AnimationBinaryWriter(args.path + "/animation.bin")
+    else:
+        print("Exporting OBJ files to animation json")
+        writer = AnimationJSONWriter(args.path + "/animation.json")
+
+    with Pool(processes=args.workers) as pool:
+        # imap keeps the frames in order while we write them out
+        for vertices in pool.imap(parse_obj, final_objs, chunksize=16):
+            writer.append(vertices)
+
+    writer.close()
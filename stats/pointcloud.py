@@ -6,7 +6,8 @@ from scipy import spatial
 
 class PointCloud:
 
-    def __init__(self, x, y, z):
+    def __init__(self, x, y, z, rebuild_tol=1e-3):
+
         self.x = x
         self.y = y
         self.z = z
@@ -19,6 +20,38 @@ class PointCloud:
         self.no_points = len(x)
         self.sel = None
 
+        # The KD-tree is built once, on the coordinates at the time. While
+        # the transforms applied since stay close to rigid, we query it with
+        # the inverse transform rather than building a new one.
+        self.rebuild_tol = rebuild_tol
+        self._kdtree = None
+        self._H = np.eye(4)
+
+    def xyz(self):
+
+        return np.column_stack((self.x, self.y, self.z))
+
+    def query(self, points, k=1):
+        """Nearest neighbours (indices) of points in this cloud, reusing
+        our KD-tree where we can."""
+
+        A = self._H[0:3, 0:3]
+
+        if self._kdtree is not None:
+            if np.abs(A.T @ A - np.eye(3)).max() > self.rebuild_tol:
+                self._kdtree = None
+
+        if self._kdtree is None:
+            self._kdtree = spatial.cKDTree(self.xyz())
+            self._H = np.eye(4)
+            A = self._H[0:3, 0:3]
+
+        # Take the points back into the frame the tree was built in
+        local = (points - self._H[0:3, 3]) @ np.linalg.inv(A).T
+        _, idx = self._kdtree.query(local, k=k, p=2, workers=-1)
+
+        return idx
+
     def select_n_points(self, n):
 
         if self.no_points > n:
@@ -33,25 +66,58 @@ class PointCloud:
         self.nz = np.full(self.no_points, np.nan)
         self.planarity = np.full(self.no_points, np.nan)
 
-        kdtree = spatial.cKDTree(np.column_stack((self.x, self.y, self.z)))
-        query_points = np.column_stack((self.x[self.sel], self.y[self.sel], self.z[self.sel]))
-        _, idxNN_all_qp = kdtree.query(query_points, k=neighbors, p=2, n_jobs=-1)
-
-        for (i, idxNN) in enumerate(idxNN_all_qp):
-            selected_points = np.column_stack((self.x[idxNN], self.y[idxNN], self.z[idxNN]))
-            C = np.cov(selected_points.T, bias=False)
-            eig_vals, eig_vecs = np.linalg.eig(C)
-            idx_sort = eig_vals.argsort()[::-1] # sort from large to small
-            eig_vals = eig_vals[idx_sort]
-            eig_vecs = eig_vecs[:,idx_sort]
-            self.nx[self.sel[i]] = eig_vecs[0,2]
-            self.ny[self.sel[i]] = eig_vecs[1,2]
-            self.nz[self.sel[i]] = eig_vecs[2,2]
-            self.planarity[self.sel[i]] = (eig_vals[1]-eig_vals[2])/eig_vals[0]
+        X = self.xyz()
+        idxNN_all_qp = self.query(X[self.sel], k=neighbors)
+
+        # All the neighbourhoods at once - (selected, neighbors, 3)
+        neighbourhoods = X[idxNN_all_qp]
+        centred = neighbourhoods - neighbourhoods.mean(axis=1, keepdims=True)
+        C = np.einsum("nki,nkj->nij", centred, centred) / (neighbors - 1)
+
+        eig_vals, normals = PointCloud.eigh3(C)
+        self.nx[self.sel] = normals[:, 0]
+        self.ny[self.sel] = normals[:, 1]
+        self.nz[self.sel] = normals[:, 2]
+        self.planarity[self.sel] = (eig_vals[:, 1] - eig_vals[:, 0]) / eig_vals[:, 2]
+
+    @staticmethod
+    def eigh3(C):
+        """Eigenvalues (small to large) and the eigenvector of the smallest
+        eigenvalue, for a stack of symmetric 3x3 matrices. Closed form, as
+        LAPACK's per-matrix overhead dominates for matrices this small."""
+
+        # The trigonometric solution of the characteristic cubic
+        q = np.trace(C, axis1=1, axis2=2) / 3
+        p1 = C[:, 0, 1]**2 + C[:, 0, 2]**2 + C[:, 1, 2]**2
+        p2 = ((C[:, 0, 0] - q)**2 + (C[:, 1, 1] - q)**2 + (C[:, 2, 2] - q)**2
+              + 2 * p1)
+        p = np.sqrt(p2 / 6)
+        safe_p = np.where(p > 0, p, 1)
+        B = (C - q[:, None, None] * np.eye(3)) / safe_p[:, None, None]
+        r = np.clip(np.linalg.det(B) / 2, -1, 1)
+        phi = np.arccos(r) / 3
+
+        large = q + 2 * p * np.cos(phi)
+        small = q + 2 * p * np.cos(phi + 2 * np.pi / 3)
+        eig_vals = np.column_stack((small, 3 * q - large - small, large))
+
+        # The smallest eigenvector is orthogonal to the rows of C - small I,
+        # so take the best conditioned cross product of two of those rows
+        M = C - small[:, None, None] * np.eye(3)
+        crosses = np.stack((np.cross(M[:, 0], M[:, 1]),
+                            np.cross(M[:, 0], M[:, 2]),
+                            np.cross(M[:, 1], M[:, 2])), axis=1)
+        norms = np.linalg.norm(crosses, axis=2)
+        best = norms.argmax(axis=1)
+        rows = np.arange(C.shape[0])
+        normals = crosses[rows, best] / np.where(norms[rows, best] > 0,
+                                                 norms[rows, best], 1)[:, None]
+
+        return eig_vals, normals
 
     def transform(self, H):
 
-        XInE = np.column_stack((self.x, self.y, self.z))
+        XInE = self.xyz()
         XInH = PointCloud.euler_coord_to_homogeneous_coord(XInE)
         XOutH = np.transpose(H @ XInH.T)
         XOut = PointCloud.homogeneous_coord_to_euler_coord(XOutH)
@@ -59,6 +125,7 @@ class PointCloud:
         self.x = XOut[:,0]
         self.y = XOut[:,1]
         self.z = XOut[:,2]
+        self._H = H @ self._H
 
     @staticmethod
     def euler_coord_to_homogeneous_coord(XE):
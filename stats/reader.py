@@ -0,0 +1,180 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+reader.py - read back the stats written by the local SQLite
+backend. Only needs the standard library (and encoding.py), so it
+can be copied next to the stats.ipynb notebook (generate_stats.sh
+does this).
+
+The zrange function mimics the Redis call the notebook uses, so
+a StatsReader can be dropped in wherever the notebook uses R.
+RedisReader wraps a real Redis client, decoding any binary records
+back into the JSON the notebook expects.
+
+"""
+
+import json
+import sqlite3
+
+try:
+    from stats.encoding import decode, decode_record, is_encoded
+except ImportError:
+    # We've been copied next to the notebook, along with encoding.py
+    from encoding import decode, decode_record, is_encoded
+
+
+def _json_record(record: dict) -> str:
+    """ Internal function. Turn a decoded record back into JSON."""
+    data = record["data"]
+
+    if hasattr(data, "tolist"):
+        data = data.tolist()
+
+    return json.dumps({"epoch": record["epoch"], "step": record["step"], "data": data})
+
+
+class StatsReader(object):
+    """ Read-only access to a stats.db file."""
+
+    def __init__(self, path="stats.db"):
+        """
+        Open our stats database, read only.
+
+        Parameters
+        ----------
+        path : str
+            The path to the stats.db file (default: stats.db).
+
+        Returns
+        -------
+        StatsReader
+        """
+        self.conn = sqlite3.connect("file:" + path + "?mode=ro", uri=True)
+
+    def names(self) -> list:
+        """
+        Return the names of all the statistics we have.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            A sorted list of str
+        """
+        rows = self.conn.execute("SELECT DISTINCT name FROM stats ORDER BY name")
+        return [r[0] for r in rows]
+
+    def series(self, name: str) -> list:
+        """
+        Return all the records for one statistic, in idx order. Arrays
+        come back as numpy arrays if numpy is available.
+
+        Parameters
+        ----------
+        name : str
+            The name of the statistic, such as loss_test.
+
+        Returns
+        -------
+        list
+            A list of (idx, epoch, step, data) tuples.
+        """
+        rows = self.conn.execute(
+            "SELECT idx, epoch, step, data FROM stats WHERE name = ? \
+                ORDER BY idx, rowid",
+            (name,),
+        )
+        return [
+            (r[0], r[1], r[2], decode(r[3]) if is_encoded(r[3]) else json.loads(r[3]))
+            for r in rows
+        ]
+
+    def zrange(self, key: str, start=0, end=-1, withscores=True) -> list:
+        """
+        Return records as the Redis zrange call would, with each
+        record a JSON string holding the epoch, step and data.
+        The key can be given with or without the experiment prefix.
+
+        Parameters
+        ----------
+        key : str
+            The statistic name, optionally as experiment:name.
+        start : int
+            The first record to return (default: 0).
+        end : int
+            The last record to return, inclusive (default: -1, the end).
+        withscores : bool
+            Return (record, idx) tuples rather than just the records.
+
+        Returns
+        -------
+        list
+        """
+        name = key.rsplit(":", 1)[-1]
+        records = self.series(name)
+        end = len(records) if end == -1 else end + 1
+        result = []
+
+        for (idx, epoch, step, data) in records[start:end]:
+            record = _json_record({"epoch": epoch, "step": step, "data": data})
+            result.append((record, idx) if withscores else record)
+
+        return result
+
+    def close(self):
+        self.conn.close()
+
+
+class RedisReader(object):
+    """Wraps a Redis client so zrange returns JSON records, as it did
+    before arrays were stored as binary blobs."""
+
+    def __init__(self, redis_client):
+        """
+        Wrap our client.
+
+        Parameters
+        ----------
+        redis_client : redis.Redis
+            The client to read from.
+
+        Returns
+        -------
+        RedisReader
+        """
+        self.R = redis_client
+
+    def zrange(self, key: str, start=0, end=-1, withscores=True) -> list:
+        """
+        As Redis zrange, but with every record as a JSON string.
+
+        Parameters
+        ----------
+        key : str
+            The key, as experiment:name.
+        start : int
+            The first record to return (default: 0).
+        end : int
+            The last record to return, inclusive (default: -1, the end).
+        withscores : bool
+            Return (record, idx) tuples rather than just the records.
+
+        Returns
+        -------
+        list
+        """
+        result = []
+
+        for item in self.R.zrange(key, start, end, withscores=withscores):
+            (record, idx) = item if withscores else (item, None)
+            record = _json_record(decode_record(record))
+            result.append((record, idx) if withscores else record)
+
+        return result
@@ -2,7 +2,6 @@
 
 from datetime import datetime
 from .pointcloud import PointCloud
-from scipy import spatial, stats
 import numpy as np
 import time
 
@@ -13,22 +12,13 @@ def log(text):
 
 
 def matching(pcfix, pcmov):
-    kdtree = spatial.cKDTree(np.column_stack((pcmov.x, pcmov.y, pcmov.z)))
-    query_points = np.column_stack((pcfix.x[pcfix.sel], pcfix.y[pcfix.sel], pcfix.z[pcfix.sel]))
-    _, pcmov.sel = kdtree.query(query_points, k=1, p=2, n_jobs=-1)
+    query_points = pcfix.xyz()[pcfix.sel]
+    pcmov.sel = pcmov.query(query_points, k=1)
 
-    dx = pcmov.x[pcmov.sel] - pcfix.x[pcfix.sel]
-    dy = pcmov.y[pcmov.sel] - pcfix.y[pcfix.sel]
-    dz = pcmov.z[pcmov.sel] - pcfix.z[pcfix.sel]
-
-    nx = pcfix.nx[pcfix.sel]
-    ny = pcfix.ny[pcfix.sel]
-    nz = pcfix.nz[pcfix.sel]
-
-    no_correspondences = len(pcfix.sel)
-    distances = np.empty(no_correspondences)
-    for i in range(0, no_correspondences):
-        distances[i] = dx[i]*nx[i] + dy[i]*ny[i] + dz[i]*nz[i]
+    # Point to plane distances for every correspondence at once
+    dxyz = pcmov.xyz()[pcmov.sel] - query_points
+    normals = np.column_stack((pcfix.nx[pcfix.sel], pcfix.ny[pcfix.sel], pcfix.nz[pcfix.sel]))
+    distances = np.einsum("ij,ij->i", dxyz, normals)
 
     return distances
 
@@ -38,12 +28,13 @@ def reject(pcfix, pcmov, min_planarity, distances):
     planarity = pcfix.planarity[pcfix.sel]
 
     med = np.median(distances)
-    sigmad = stats.median_absolute_deviation(distances)
+    # The median absolute deviation, scaled to match a normal sigma
+    sigmad = 1.4826 * np.median(np.abs(distances - med))
 
-    keep_distance = [abs(d-med) <= 3*sigmad for d in distances]
-    keep_planarity = [p > min_planarity for p in planarity]
+    keep_distance = np.abs(distances - med) <= 3*sigmad
+    keep_planarity = planarity > min_planarity
 
-    keep = keep_distance and keep_planarity
+    keep = keep_distance & keep_planarity
 
     pcfix.sel = pcfix.sel[keep]
     pcmov.sel = pcmov.sel[keep]
@@ -64,7 +55,7 @@ def estimate_rigid_body_transformation(x_fix, y_fix, z_fix, nx_fix, ny_fix, nz_f
 
     l = nx_fix*(x_fix-x_mov) + ny_fix*(y_fix-y_mov) + nz_fix*(z_fix-z_mov)
 
-    x, _, _, _ = np.linalg.lstsq(A, l)
+    x, _, _, _ = np.linalg.lstsq(A, l, rcond=None)
 
     residuals = A @ x - l
 
@@ -10,18 +10,15 @@ similar during training of the network but also during running.
 
 """
 
-from util.plyobj import save_ply, save_obj
 import util.image
 import numpy as np
 import torch
-import json
-try:
-    import redis
-    import psycopg2
-except ImportError:
-    print("No Redis or Postgresql found. No intermediate stats will be recorded.")
 import os
-from util.math import PointsTen, VecRot, VecRotTen
+from util.math import PointsTen, VecRot, VecRotTen, VecRotTenBatch
+from stats.writer import AsyncWriter, snapshot
+from stats.backend import RemoteBackend, SQLiteBackend
+from stats.encoding import encode
+from stats.trajectory import TrajectoryWriter
 
 
 class Stats(object):
@@ -31,36 +28,58 @@ class Stats(object):
     def __init__(self):
         # create a stream for logging
         self.watching = {}
+        self.writer = None
+        self.backend = None
+        self.trajectory = None
+        self._error_message = False
+
+    def start_writer(self, queue_size=64):
+        """Start a background writer. From now on, all our file, database
+        and checkpoint writes happen off the training thread."""
+        if self.writer is None:
+            self.writer = AsyncWriter(queue_size)
+
+    def submit(self, fn, *args, **kwargs):
+        """Call fn with these args on the writer thread if we have one,
+        or right now if we don't."""
+        if self.writer is not None:
+            self.writer.submit(fn, *args, **kwargs)
+        else:
+            fn(*args, **kwargs)
+
+    def flush(self):
+        """ Wait for any outstanding writes to finish."""
+        if self.writer is not None:
+            self.writer.flush()
 
-    def on(self, savedir: str):
+    def on(self, savedir: str, backend="remote"):
+        """Turn on our stats, choosing where they are stored. The 'remote'
+        backend uses Redis and PostgreSQL on localhost, 'sqlite' writes to
+        stats.db in the savedir."""
         self.savedir = savedir
         self._error_message = False
         path = os.path.normpath(savedir)
         parts = path.split(os.sep)
-        self.exp_name = parts[-1]  # WARNING - overwrite potential in the REDIS
-        try:
-            self.R = redis.Redis(host="localhost", port=6379, db=0)
-            conn_string = "host='localhost' dbname='phd' user='postgres' \
-                password='postgres'"
-            self.pconn = psycopg2.connect(conn_string)
-            self.P = self.pconn.cursor()
-            # The number of seconds in a month. Used to invalidate Redis Keys
-            self._redis_ttl = 2629800
-        except Exception:
-            print(
-                "Cannot connect to PostgreSQL or Redis. Only immediate images \
+        self.exp_name = parts[-1]
+
+        if backend == "sqlite":
+            self.backend = SQLiteBackend(os.path.join(savedir, "stats.db"))
+        elif backend == "remote":
+            try:
+                self.backend = RemoteBackend(self.exp_name)
+            except Exception:
+                print(
+                    "Cannot connect to PostgreSQL or Redis. Only immediate images \
 will be recorded."
-            )
+                )
+        else:
+            raise ValueError("Unknown stats backend " + str(backend))
 
         # Create the subdirs we need if they aren't there already
         if not os.path.exists(os.path.join(savedir, "fits")):
             os.mkdir(os.path.join(savedir, "fits"))
         if not os.path.exists(os.path.join(savedir, "jpgs")):
             os.mkdir(os.path.join(savedir, "jpgs"))
-        if not os.path.exists(os.path.join(savedir, "objs")):
-            os.mkdir(os.path.join(savedir, "objs"))
-        if not os.path.exists(os.path.join(savedir, "plys")):
-            os.mkdir(os.path.join(savedir, "plys"))
 
     def watch(self, obj, name: str):
         """Add something to be watched via tensorwatch. This may already be
@@ -71,6 +90,19 @@ will be recorded."
     def close(self):
         """ Make sure we write to the DB. """
         self._error_message = False
+
+        if self.writer is not None:
+            self.writer.close()
+            print("Writer metrics:", self.writer.metrics())
+            self.writer = None
+
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+        if self.trajectory is not None:
+            self.trajectory.close()
+            self.trajectory = None
         # TODO - will probably get rid
         # self.db.close()
         # Zip now happens in the generate_stats.sh script
@@ -96,98 +128,83 @@ will be recorded."
             elif isinstance(item, VecRotTen):
                 new_list = [item.x.tolist(), item.y.tolist(), item.z.tolist()]
                 new_contain.append(new_list)
+            elif isinstance(item, VecRotTenBatch):
+                new_contain.append(self.tensor_to_list(item.data.unsqueeze(2)))
             else:
                 new_contain.append(item)
         return new_contain
 
-    def _cxkey(self, key):
-        """ Check if this key already exists in the postgres table."""
-        self.P.execute("SELECT * from experiments where pname = %s", (key,))
-        res = self.P.fetchone()
-        return res is not None
-
-    def _padd(self, name: str, epoch: int, step: int, idx: int, key, obj):
-        """ Add to postgres."""
-        fd = {}
-        fd[idx] = {"epoch": epoch, "step": step, "data": obj}
-
-        if not self._cxkey(key):
-            self.P.execute(
-                "INSERT INTO experiments \
-                            VALUES (%s, ARRAY[%s::jsonb])",
-                [key, json.dumps(fd)],
-            )
-        else:
-            self.P.execute(
-                "UPDATE experiments SET pdata = \
-                    array_cat(pdata, ARRAY[%s::jsonb])\
-                    WHERE pname = %s;",
-                [json.dumps(fd), key],
-            )
-
-        self.pconn.commit()
+    def _to_array(self, obj):
+        """Internal function. Turn a tensor, VecRotTen or (nested) list of
+        them into a single numpy array, or None if they won't stack."""
+        if isinstance(obj, torch.Tensor):
+            return obj.detach().cpu().numpy()
+        elif isinstance(obj, VecRotTen):
+            return np.stack([self._to_array(v) for v in (obj.x, obj.y, obj.z)])
+        elif isinstance(obj, VecRotTenBatch):
+            # The same (B, 3, 1) layout as a list of VecRotTen
+            return self._to_array(obj.data.unsqueeze(2))
+        elif isinstance(obj, list) and len(obj) > 0:
+            items = [self._to_array(item) for item in obj]
+
+            if any(item is None for item in items):
+                return None
+
+            if any(item.shape != items[0].shape for item in items):
+                return None
+
+            return np.stack(items)
+        return None
+
+    def _to_data(self, obj):
+        """Convert a watched object into something we can store. Tensors,
+        and lists of them, become binary blobs (see stats/encoding.py).
+        Everything else is kept JSON friendly."""
+        if isinstance(obj, (torch.Tensor, list, VecRotTenBatch)):
+            arr = self._to_array(obj)
+
+            if arr is not None:
+                return arr.item() if arr.ndim == 0 else encode(arr)
+
+        if isinstance(obj, list):
+            return self._rconv(obj)
+        elif isinstance(obj, VecRotTen):
+            return [float(obj.x[0]), float(obj.y[0]), float(obj.z[0])]
+        elif isinstance(obj, VecRot):
+            return [obj.x, obj.y, obj.z]
+        return obj
 
     def _conv(self, obj, name: str, epoch: int, step: int, idx: int):
         # Now check what the object is and write it out properly
-        # Using one letter keys to save a little space.
-        key = self.exp_name + ":" + name
-        if isinstance(obj, str):
-            self._padd(name, epoch, step, idx, key, obj)
-            self.R.zadd(
-                key, {json.dumps({"epoch": epoch, "step": step, "data": obj}): idx}
-            )
-            self.R.expire(key, self._redis_ttl)
-
-        elif isinstance(obj, torch.Tensor):
-            converted = self.tensor_to_list(obj)
-            self._padd(name, epoch, step, idx, key, converted)
-            self.R.zadd(
-                key,
-                {json.dumps({"epoch": epoch, "step": step, "data": converted}): idx},
-            )
-            self.R.expire(key, self._redis_ttl)
-
-        elif isinstance(obj, list):
-            new_list = self._rconv(obj)
-            self._padd(name, epoch, step, idx, key, new_list)
-            self.R.zadd(
-                key, {json.dumps({"epoch": epoch, "step": step, "data": new_list}): idx}
-            )
-            self.R.expire(key, self._redis_ttl)
-
-        elif isinstance(obj, VecRotTen):
-            new_list = [obj.x[0], obj.y[0], obj.z[0]]
-            self.R.zadd(
-                key, {json.dumps({"epoch": epoch, "step": step, "data": new_list}): idx}
-            )
-            self.R.expire(key, self._redis_ttl)
+        self.backend.add(name, epoch, step, idx, self._to_data(obj))
 
-        elif isinstance(obj, VecRot):
-            new_list = [obj.x, obj.y, obj.z]
-            self.R.zadd(
-                key, {json.dumps({"epoch": epoch, "step": step, "data": new_list}): idx}
+    def update(self, epoch: int, set_size: int, batch_size: int, step: int):
+        """ Update all our streams with the current idx value. """
+        if self.writer is not None:
+            # Snapshot now, as the watched objects keep changing.
+            self.writer.submit(
+                self._update, snapshot(self.watching), epoch, set_size,
+                batch_size, step
             )
-            self.R.expire(key, self._redis_ttl)
-
         else:
-            self._padd(name, epoch, step, idx, key, obj)
-            self.R.zadd(
-                key, {json.dumps({"epoch": epoch, "step": step, "data": obj}): idx}
-            )
-            self.R.expire(key, self._redis_ttl)
+            self._update(self.watching, epoch, set_size, batch_size, step)
 
-    def update(self, epoch: int, set_size: int, batch_size: int, step: int):
+    def _update(
+        self, watching: dict, epoch: int, set_size: int, batch_size: int, step: int
+    ):
         try:
             idx = epoch * set_size + step * batch_size
-            """ Update all our streams with the current idx value. """
-            for name in self.watching.keys():
-                obj = self.watching[name]
+            for name in watching.keys():
+                obj = watching[name]
                 self._conv(obj, name, epoch, step, idx)
         except Exception as e:
             print("Exception in stats saving")
             print(e)
 
     def write_immediate(self, obj, name, epoch, step, idx):
+        self.submit(self._write_immediate, obj, name, epoch, step, idx)
+
+    def _write_immediate(self, obj, name, epoch, step, idx):
         try:
             self._conv(obj, name, epoch, step, idx)
         except Exception:
@@ -203,6 +220,17 @@ will be recorded."
         epoch: int,
         step: int,
         idx: int,
+    ):
+        self.submit(self._save_jpg, data, savedir, prefix, epoch, step, idx)
+
+    def _save_jpg(
+        self,
+        data: torch.Tensor,
+        savedir: str,
+        prefix: str,
+        epoch: int,
+        step: int,
+        idx: int,
     ):
         util.image.save_image(
             data,
@@ -225,6 +253,17 @@ will be recorded."
         epoch: int,
         step: int,
         idx: int,
+    ):
+        self.submit(self._save_fits, data, savedir, prefix, epoch, step, idx)
+
+    def _save_fits(
+        self,
+        data: torch.Tensor,
+        savedir: str,
+        prefix: str,
+        epoch: int,
+        step: int,
+        idx: int,
     ):
         util.image.save_fits(
             data,
@@ -239,32 +278,21 @@ will be recorded."
             + ".fits",
         )
 
-    def save_points(
-        self, points: PointsTen, savedir: str, epoch: int, step: int, ply=False
-    ):
-        """Save the points as either an obj or ply file."""
-        if not os.path.exists(savedir + "/objs"):
-            os.makedirs(savedir + "/objs/")
-
-        if not os.path.exists(savedir + "/plys"):
-            os.makedirs(savedir + "/plys/")
+    def save_points(self, points: PointsTen, savedir: str, epoch: int, step: int):
+        """Append the points to the trajectory file, points.traj, in the
+        savedir. See stats/trajectory.py for exporting OBJ/PLY files."""
+        self.submit(self._save_points, points, savedir, epoch, step)
 
-        path_obj = (
-            savedir + "/objs/shape_e" + str(epoch).zfill(3) + "_s" + str(step).zfill(5)
-        )
-        path_ply = (
-            savedir + "/plys/shape_e" + str(epoch).zfill(3) + "_s" + str(step).zfill(5)
-        )
+    def _save_points(self, points: PointsTen, savedir: str, epoch: int, step: int):
+        path = os.path.join(savedir, "points.traj")
+        tv = points.data.detach().cpu().numpy()
 
-        vertices = []
-        tv = points.data.clone().cpu().detach().numpy()
-        for v in tv:
-            vertices.append((v[0][0], v[1][0], v[2][0], 1.0))
+        if self.trajectory is None or self.trajectory.path != path:
+            if self.trajectory is not None:
+                self.trajectory.close()
+            self.trajectory = TrajectoryWriter(path, tv.shape[0])
 
-        if ply:
-            save_ply(path_ply + ".ply", vertices)
-        else:
-            save_obj(path_obj + ".obj", vertices)
+        self.trajectory.append(tv, epoch, step)
 
 
 # This is the one and only logging object. It's global and we have helper
@@ -282,8 +310,8 @@ def write_immediate(obj, name: str, epoch: int, step: int, idx: int):
     stat.write_immediate(obj, name, epoch, step, idx)
 
 
-def on(savedir: str):
-    stat.on(savedir)
+def on(savedir: str, backend="remote"):
+    stat.on(savedir, backend)
 
 
 def save_jpg(data, savedir: str, prefix: str, epoch: int, step: int, idx: int):
@@ -294,14 +322,31 @@ def save_fits(data, savedir: str, prefix: str, epoch: int, step: int, idx: int):
     stat.save_fits(data, savedir, prefix, epoch, step, idx)
 
 
-def save_points(points: torch.Tensor, savedir: str, epoch: int, step: int):
+def save_points(points: PointsTen, savedir: str, epoch: int, step: int):
     stat.save_points(points, savedir, epoch, step)
-    stat.save_points(points, savedir, epoch, step, True)
 
 
 def update(epoch: int, set_size: int, batch_size: int, step: int):
     stat.update(epoch, set_size, batch_size, step)
 
 
+def start_writer(queue_size=64):
+    stat.start_writer(queue_size)
+
+
+def submit(fn, *args, **kwargs):
+    stat.submit(fn, *args, **kwargs)
+
+
+def flush():
+    stat.flush()
+
+
+def writer_metrics() -> dict:
+    if stat.writer is not None:
+        return stat.writer.metrics()
+    return {}
+
+
 def close():
     stat.close()
@@ -0,0 +1,314 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+trajectory.py - a single, append-only binary file holding the points
+at every log interval, in place of an OBJ and a PLY file per interval.
+
+The file is a 16 byte header - b"HTRJ", the version, the number of
+points N (all little-endian uint32) and padding - followed by one
+record per interval: the epoch and step (int64) and the N x 3 float32
+points. The whole file can be memory-mapped, giving the points as a
+(steps, N, 3) array without reading them in.
+
+If a run dies part way through writing a record, the partial record is
+ignored when reading.
+
+Example usage (export the last frame and the animations):
+    python trajectory.py --path /tmp/runs/test_run/points.traj \
+        --obj last.obj --ply last.ply --animation animation.json \
+        --animation-bin animation.bin
+
+"""
+
+import math
+import os
+import struct
+import numpy as np
+
+MAGIC = b"HTRJ"
+VERSION = 1
+HEADER_SIZE = 16
+
+
+def _record_dtype(num_points: int) -> np.dtype:
+    """ Internal function. The numpy dtype of a single record."""
+    return np.dtype(
+        [("epoch", "<i8"), ("step", "<i8"), ("points", "<f4", (num_points, 3))]
+    )
+
+
+class TrajectoryWriter(object):
+    """ Appends frames of points to a trajectory file."""
+
+    def __init__(self, path: str, num_points: int):
+        """
+        Open (or create) a trajectory file for appending. If the file
+        already exists it must hold the same number of points.
+
+        Parameters
+        ----------
+        path : str
+            The path to the trajectory file.
+        num_points : int
+            The number of points in each frame.
+
+        Returns
+        -------
+        TrajectoryWriter
+        """
+        self.path = path
+        self.num_points = num_points
+        self.dtype = _record_dtype(num_points)
+
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            header = Trajectory.read_header(path)
+            assert header == num_points, "Trajectory has a different number of points"
+            # Drop any partial record left by a run that died mid-write
+            size = os.path.getsize(path)
+            whole = (size - HEADER_SIZE) // self.dtype.itemsize
+            self.f = open(path, "r+b")
+            self.f.truncate(HEADER_SIZE + whole * self.dtype.itemsize)
+            self.f.seek(0, os.SEEK_END)
+        else:
+            dirname = os.path.dirname(path)
+
+            if dirname != "" and not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            self.f = open(path, "wb")
+            self.f.write(struct.pack("<4sIII", MAGIC, VERSION, num_points, 0))
+
+    def append(self, points, epoch: int, step: int):
+        """
+        Append one frame of points.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            Of shape (N, 3) or more columns, such as the (N, 4, 1) data
+            of a PointsTen. Only x, y and z are kept.
+        epoch : int
+            The current epoch.
+        step : int
+            The current step.
+
+        Returns
+        -------
+        self
+        """
+        points = np.asarray(points).reshape(self.num_points, -1)[:, 0:3]
+        record = np.empty(1, dtype=self.dtype)
+        record["epoch"] = epoch
+        record["step"] = step
+        record["points"] = points
+        self.f.write(record.tobytes())
+        self.f.flush()
+        return self
+
+    def close(self):
+        self.f.close()
+
+
+class Trajectory(object):
+    """Read access to a trajectory file. The points, epochs and steps
+    are memory-mapped, so opening even a very long run is quick."""
+
+    def __init__(self, path: str):
+        """
+        Open our trajectory file.
+
+        Parameters
+        ----------
+        path : str
+            The path to the trajectory file.
+
+        Returns
+        -------
+        Trajectory
+        """
+        self.path = path
+        self.num_points = Trajectory.read_header(path)
+        dtype = _record_dtype(self.num_points)
+        steps = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+
+        if steps > 0:
+            records = np.memmap(
+                path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(steps,)
+            )
+        else:
+            records = np.zeros(0, dtype=dtype)
+
+        self.points = records["points"]
+        self.epochs = records["epoch"]
+        self.steps = records["step"]
+
+    @staticmethod
+    def read_header(path: str) -> int:
+        """
+        Check the header of a trajectory file, returning the number
+        of points.
+
+        Parameters
+        ----------
+        path : str
+            The path to the trajectory file.
+
+        Returns
+        -------
+        int
+        """
+        with open(path, "rb") as f:
+            (magic, version, num_points, _) = struct.unpack(
+                "<4sIII", f.read(HEADER_SIZE)
+            )
+
+        assert magic == MAGIC, path + " is not a trajectory file"
+        assert version == VERSION, "Unknown trajectory version " + str(version)
+        return num_points
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def __getitem__(self, idx) -> np.ndarray:
+        """ Return the (N, 3) points for frame idx."""
+        return self.points[idx]
+
+    def frames(self, limit=-1) -> list:
+        """
+        Return the indices of limit frames, equally spaced, as the
+        objs_to_json script chose them.
+
+        Parameters
+        ----------
+        limit : int
+            The number of frames, or -1 for all of them (default: -1).
+
+        Returns
+        -------
+        list
+        """
+        if limit == -1 or limit >= len(self):
+            return list(range(len(self)))
+
+        step_size = math.floor(len(self) / limit)
+        return [i * step_size for i in range(limit)]
+
+    def export_obj(self, idx: int, path: str):
+        """
+        Export a single frame as an OBJ file.
+
+        Parameters
+        ----------
+        idx : int
+            The frame to export. Negative indices count from the end.
+        path : str
+            The OBJ file to write.
+
+        Returns
+        -------
+        None
+        """
+        from util.plyobj import save_obj
+
+        save_obj(path, self[idx])
+
+    def export_ply(self, idx: int, path: str):
+        """
+        Export a single frame as a PLY file.
+
+        Parameters
+        ----------
+        idx : int
+            The frame to export. Negative indices count from the end.
+        path : str
+            The PLY file to write.
+
+        Returns
+        -------
+        None
+        """
+        from util.plyobj import save_ply
+
+        save_ply(path, self[idx])
+
+    def export_animation(self, path: str, limit=-1, binary=False):
+        """
+        Export the animation that objs_to_json.py creates, for the
+        notebook, blender_vis.py and train/icp_test.py.
+
+        Parameters
+        ----------
+        path : str
+            The file to write.
+        limit : int
+            The number of frames, or -1 for all of them (default: -1).
+        binary : bool
+            Write the compact animation.bin format rather than JSON
+            (default: False).
+
+        Returns
+        -------
+        None
+        """
+        from stats.objs_to_json import AnimationBinaryWriter, AnimationJSONWriter
+
+        writer = AnimationBinaryWriter(path) if binary else AnimationJSONWriter(path)
+
+        for idx in self.frames(limit):
+            writer.append(self[idx])
+
+        writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    # So we can find util.plyobj when run from another directory
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+    parser = argparse.ArgumentParser(description="Export from a trajectory file")
+    parser.add_argument("--path", default="points.traj", help="The trajectory file")
+    parser.add_argument(
+        "--frame",
+        type=int,
+        default=-1,
+        help="The frame to export as OBJ/PLY (default: -1, the last)",
+    )
+    parser.add_argument("--obj", default="", help="Export the frame to this OBJ")
+    parser.add_argument("--ply", default="", help="Export the frame to this PLY")
+    parser.add_argument(
+        "--animation", default="", help="Export the animation JSON to this file"
+    )
+    parser.add_argument(
+        "--animation-bin",
+        default="",
+        help="Export the binary animation to this file",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=-1,
+        metavar="N",
+        help="number of frames in the animation (default: all)",
+    )
+    args = parser.parse_args()
+
+    traj = Trajectory(args.path)
+    print("Trajectory with", len(traj), "frames of", traj.num_points, "points")
+
+    if args.obj != "":
+        traj.export_obj(args.frame, args.obj)
+
+    if args.ply != "":
+        traj.export_ply(args.frame, args.ply)
+
+    if args.animation != "":
+        traj.export_animation(args.animation, args.limit)
+
+    if args.animation_bin != "":
+        traj.export_animation(args.animation_bin, args.limit, binary=True)
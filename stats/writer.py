@@ -0,0 +1,240 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+writer.py - a background thread that performs our file, database
+and checkpoint writes so the training loop doesn't wait on the disk.
+
+Work is passed in as a function and its arguments. The arguments are
+snapshotted (tensors detached and copied to the CPU) at submission so
+the training loop is free to carry on modifying them.
+
+"""
+
+import atexit
+import copy
+import queue
+import threading
+import time
+import torch
+from util.math import PointsTen, VecRotTen, TransTen
+
+
+def _snapshot_module(module: torch.nn.Module) -> torch.nn.Module:
+    """
+    Deep-copy a module to the CPU. Tensors that are not graph leaves
+    can't be deep-copied, wherever they hang off the module - on it, on
+    objects it holds such as the Splat, or in their lists, tuples and
+    dicts - so we swap in detached copies via the deepcopy memo.
+
+    This copies the whole module, so it's for one-off copies. Submit a
+    state_dict for anything done every few steps.
+    """
+    memo = {}
+    seen = set()
+
+    def gather(obj):
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+
+        if isinstance(obj, torch.Tensor):
+            if not obj.is_leaf:
+                memo[id(obj)] = obj.detach().clone()
+        elif isinstance(obj, (list, tuple, set)):
+            for v in obj:
+                gather(v)
+        elif isinstance(obj, dict):
+            for v in obj.values():
+                gather(v)
+        elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+            if callable(obj) and not isinstance(obj, torch.nn.Module):
+                return
+            for v in vars(obj).values():
+                gather(v)
+
+    gather(module)
+    return copy.deepcopy(module, memo).to("cpu")
+
+
+def snapshot(obj):
+    """
+    Take a copy of an object that is safe to hand to another thread.
+    Tensors are detached and copied to the CPU, containers are copied
+    recursively and modules are deep-copied to the CPU. Anything else is assumed
+    to be immutable and is passed through as is.
+
+    Parameters
+    ----------
+    obj : object
+        The object to snapshot.
+
+    Returns
+    -------
+    object
+        The snapshot
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    elif isinstance(obj, PointsTen):
+        return PointsTen(device="cpu").from_tensor(snapshot(obj.data))
+    elif isinstance(obj, VecRotTen):
+        return VecRotTen(snapshot(obj.x), snapshot(obj.y), snapshot(obj.z))
+    elif isinstance(obj, TransTen):
+        return TransTen(snapshot(obj.x), snapshot(obj.y))
+    elif isinstance(obj, torch.nn.Module):
+        return _snapshot_module(obj)
+    elif isinstance(obj, list):
+        return [snapshot(o) for o in obj]
+    elif isinstance(obj, tuple):
+        return tuple(snapshot(o) for o in obj)
+    elif isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    return obj
+
+
+class AsyncWriter(object):
+    """A single background thread with a bounded queue of jobs. If the
+    queue is full, submit blocks, so a slow disk slows training down
+    rather than eating all our memory. We keep count of how often that
+    happens so it can be reported."""
+
+    def __init__(self, queue_size=64):
+        """
+        Create and start our writer.
+
+        Parameters
+        ----------
+        queue_size : int
+            The maximum number of jobs waiting to be written (default: 64).
+
+        Returns
+        -------
+        AsyncWriter
+        """
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        self.blocked = 0
+        self.blocked_time = 0.0
+        self.max_depth = 0
+        self._thread = threading.Thread(
+            target=self._run, name="holly-writer", daemon=True
+        )
+        self._thread.start()
+        # Make sure everything hits the disk, even if close is never called
+        atexit.register(self.close)
+
+    def _run(self):
+        """ Internal function. The loop our thread runs."""
+        while True:
+            job = self._queue.get()
+
+            if job is None:
+                self._queue.task_done()
+                break
+
+            (fn, args, kwargs) = job
+
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self.errors += 1
+                print("Writer exception", e)
+            finally:
+                self.completed += 1
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue up a function to be called on the writer thread. The
+        arguments are snapshotted first.
+
+        Parameters
+        ----------
+        fn : callable
+            The function to call.
+        args :
+            The arguments to pass to fn.
+        kwargs :
+            The keyword arguments to pass to fn.
+
+        Returns
+        -------
+        self
+        """
+        job = (fn, snapshot(args), snapshot(kwargs))
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.blocked += 1
+            start = time.perf_counter()
+            self._queue.put(job)
+            self.blocked_time += time.perf_counter() - start
+
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return self
+
+    def flush(self):
+        """
+        Wait until every job submitted so far has been written.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        self
+        """
+        if self._thread.is_alive():
+            self._queue.join()
+        return self
+
+    def close(self):
+        """
+        Flush the queue and stop the thread. Safe to call more than once.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        self
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        return self
+
+    def metrics(self) -> dict:
+        """
+        Return the back-pressure metrics for this writer.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            The counts of jobs submitted, completed and failed, the
+            current and maximum queue depth and how many times (and for
+            how long in seconds) submit had to wait on a full queue.
+        """
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "errors": self.errors,
+            "depth": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "blocked": self.blocked,
+            "blocked_time": self.blocked_time,
+        }
@@ -18,7 +18,7 @@ import torch.nn.functional as F
 from data.loader import Loader
 from data.imageload import ImageLoader
 from data.sets import DataSet, SetType
-from data.buffer import Buffer, BufferImage
+from data.buffer import Buffer, BufferCached, BufferImage
 from data.batcher import Batcher
 from net.renderer import Splat
 from util.math import vec_to_quat, qdist
@@ -147,6 +147,38 @@ class Data(unittest.TestCase):
         # save_image(datum.cpu().detach().numpy(), "databuffer_test_1c.jpg")
         self.assertTrue(torch.sum(torch.abs(torch.sub(datum, out3))) < 1.0)
 
+    def test_buffer_cached(self):
+        """ Test the buffer that keeps its renders between passes."""
+        splat = Splat(device="cpu")
+        loader = Loader(size=20, objpath="./objs/teapot_large.obj")
+        loader.set_sigma(2.0)
+        dataset = DataSet(SetType.TEST, 20, loader)
+        buffer = BufferCached(
+            dataset, splat, buffer_size=20, device="cpu", sigma_tolerance=0.5
+        )
+        batcher = Batcher(buffer, batch_size=4)
+
+        first = [b.data.clone() for b in batcher]
+        self.assertEqual(len(buffer._cache), 20)
+        cached = dict(buffer._cache)
+
+        # Small sigma change and a shuffle - we should reuse our renders.
+        loader.set_sigma(2.25)
+        dataset.shuffle()
+        second = [b.data.clone() for b in batcher]
+        self.assertEqual(len(second), len(first))
+
+        for idx, item in buffer._cache.items():
+            self.assertTrue(item is cached[idx])
+
+        # A larger change should force a re-render at the new sigma.
+        loader.set_sigma(4.0)
+        [b for b in batcher]
+
+        for idx, item in buffer._cache.items():
+            self.assertFalse(item is cached[idx])
+            self.assertEqual(item.sigma, 4.0)
+
     def test_batcher(self):
         """ Test the batcher."""
         splat = Splat(device="cpu")
@@ -11,8 +11,13 @@ util/math.py
 
 import unittest
 import math
+import numpy as np
+import torch
 from random import random
 from util.math import PointsTen, gen_mat_from_rod, mat_to_rod, VecRot, Point, Points
+from util.math import VecRotTenBatch, TransTenBatch, Trans
+from util.math import quat_distances, rotation_tour
+from util.math import gen_mats_from_rods, gen_trans_xys, gen_trans_xy
 
 
 class Math(unittest.TestCase):
@@ -22,6 +27,21 @@ class Math(unittest.TestCase):
         (u, b) = mat_to_rod(m)
         self.assertTrue(math.fabs(b - math.radians(90)) < 0.01)
 
+    def test_gen_mats(self):
+        torch.manual_seed(5)
+        rots = VecRotTenBatch.random(6)
+        rots.data[2] = 0.0
+        mats = gen_mats_from_rods(rots.data)
+        self.assertEqual(tuple(mats.shape), (6, 4, 4))
+
+        # The batch, zero rotation included, matches one at a time
+        for (r, m) in zip(rots, mats):
+            self.assertTrue(torch.allclose(m, gen_mat_from_rod(r), atol=1e-6))
+
+        trans = torch.tensor([[0.1, -0.2], [0.3, 0.0]])
+        tms = gen_trans_xys(trans)
+        self.assertTrue(torch.allclose(tms[0], gen_trans_xy(trans[0, 0], trans[0, 1])))
+
     def test_vec_rot(self):
         a = VecRot(math.radians(90), 0, 0)
         self.assertTrue(math.fabs(a.get_length() - math.radians(90)) < 0.01)
@@ -38,3 +58,80 @@ class Math(unittest.TestCase):
 
         rot_points = r.rotate_points(points)
         self.assertTrue(math.fabs(rot_points[9].y - 0.9) < 0.0001)
+
+    def test_vec_rot_batch(self):
+        rots = [VecRot(0.1 * i, 0.2, -0.3).to_ten() for i in range(5)]
+        batch = VecRotTenBatch.from_list(rots)
+        self.assertEqual(tuple(batch.data.shape), (5, 3))
+        self.assertEqual(len(batch), 5)
+        length = float(rots[2].get_length())
+        self.assertAlmostEqual(float(batch.get_length()[2]), length, 6)
+        self.assertAlmostEqual(float(batch[4].x), 0.4, 6)
+        lengths = batch.get_normalised().norm(dim=1)
+        self.assertTrue(torch.allclose(lengths, torch.ones(5)))
+
+        # The quaternion should rotate as the matrix does
+        q = batch[1].to_quaternion()
+        (w, v) = (float(q[0]), q[1:4].double())
+        mat = gen_mat_from_rod(batch[1])[0:3, 0:3].double()
+        p = torch.tensor([0.3, -0.5, 0.8], dtype=torch.float64)
+        rotated = p + 2.0 * torch.cross(v, torch.cross(v, p, dim=0) + w * p, dim=0)
+        self.assertTrue(torch.allclose(mat @ p, rotated, atol=1e-5))
+
+        # Uniform on SO(3), where the mean |w| of the quaternions is 4 / 3pi
+        torch.manual_seed(4)
+        rand = VecRotTenBatch.random(20000)
+        self.assertTrue(bool((rand.get_length() <= math.pi + 1e-5).all()))
+        mean_w = float(rand.to_quaternions()[:, 0].abs().mean())
+        self.assertAlmostEqual(mean_w, 4.0 / (3.0 * math.pi), 2)
+
+        trans = [Trans(0.1, 0.2).to_ten(), Trans(0.3, 0.4).to_ten()]
+        trans = TransTenBatch.from_list(trans)
+        self.assertEqual(tuple(trans.data.shape), (2, 2))
+        self.assertAlmostEqual(float(trans[1].y), 0.4, 6)
+
+    def test_rotation_tour(self):
+        torch.manual_seed(2)
+        rots = VecRotTenBatch.random(50)
+        q = rots.to_quaternions().double()
+        dists = quat_distances(q, q)
+        self.assertAlmostEqual(float(dists[3, 3]), 0.0, 3)
+        # q and -q are the same rotation
+        self.assertAlmostEqual(float(quat_distances(q[0:1], -q[0:1])[0, 0]), 0.0, 3)
+
+        # The greedy tour, the slow way
+        order = [0]
+        while len(order) < 50:
+            left = [i for i in range(50) if i not in order]
+            order.append(min(left, key=lambda i: float(dists[order[-1], i])))
+
+        self.assertEqual(rotation_tour(rots), order)
+
+        def length(o):
+            return sum(float(dists[a, b]) for (a, b) in zip(o[:-1], o[1:]))
+
+        improved = rotation_tour(rots, passes=3)
+        self.assertEqual(sorted(improved), list(range(50)))
+        self.assertEqual(improved[0], 0)
+        self.assertLessEqual(length(improved), length(order) + 1e-9)
+
+    def test_points_array(self):
+        points = Points().from_chunk([0.1, 0.2, 0.3, 1.0, 0.4, 0.5, 0.6, 1.0])
+        points.append(Point(0.7, 0.8, 0.9))
+        self.assertEqual(points.data.shape, (3, 4))
+        self.assertEqual(points.data.dtype, np.float32)
+        self.assertAlmostEqual(points[2].y, 0.8, places=6)
+        self.assertEqual(len(points.get_iterable()), 3)
+        self.assertEqual(len(points.get_chunk()), 12)
+
+        # A Point from a Points is a view onto it
+        points[0].x = 2.0
+        self.assertEqual(float(points.data[0, 0]), 2.0)
+
+        # Conversions to and from PointsTen share memory on the cpu
+        tpoints = PointsTen(device="cpu").from_points(points)
+        self.assertEqual(tuple(tpoints.data.shape), (3, 4, 1))
+        self.assertTrue(np.shares_memory(tpoints.data.numpy(), points.data))
+        back = tpoints.get_points()
+        self.assertTrue(np.shares_memory(tpoints.data.numpy(), back.data))
+        self.assertTrue(torch.equal(tpoints.data[:, :, 0], torch.from_numpy(back.data)))
@@ -9,6 +9,10 @@ poisson.py - test the poisson point sampler
 """
 
 import unittest
+import random
+import time
+import numpy as np
+from scipy.spatial import cKDTree
 from util.poisson import PoissonSampler
 
 
@@ -18,3 +22,18 @@ class Poisson(unittest.TestCase):
         sample = sampler.sample(100)
         print(sample[0])
      
+
+    def test_spacing(self):
+        random.seed(1)
+        sampler = PoissonSampler(20000)
+        start = time.time()
+        sample = sampler.sample(2000)
+        self.assertLess(time.time() - start, 30.0)
+        self.assertEqual(sample.shape, (2000, 3))
+
+        # Far more evenly spread than picking the same number at random
+        picked = sampler.points[np.random.choice(20000, 2000, replace=False)]
+        (poisson, _) = cKDTree(sample).query(sample, k=2)
+        (uniform, _) = cKDTree(picked).query(picked, k=2)
+        self.assertGreater(poisson[:, 1].min(), 5.0 * uniform[:, 1].min())
+        self.assertGreater(poisson[:, 1].mean(), 1.3 * uniform[:, 1].mean())
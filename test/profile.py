@@ -142,3 +142,34 @@ class Profile(unittest.TestCase):
                 sort_by="self_cuda_time_total", row_limit=100
             )
         )
+
+    def test_inference(self):
+        """ CPU latency of the encoder, as trained and optimised."""
+        import time
+        from net.optimise import optimise_for_inference
+
+        torch.manual_seed(1)
+        model = Net(Splat(size=(128, 128)))
+        model.eval()
+        variants = {
+            "as trained": model,
+            "folded": optimise_for_inference(model, channels_last=False),
+            "folded, channels_last": optimise_for_inference(model),
+            "folded, channels_last, jit": optimise_for_inference(model, jit=True),
+        }
+
+        for batch_size in (1, 8, 32):
+            image = torch.rand(batch_size, 1, 128, 128)
+
+            for (name, variant) in variants.items():
+                with torch.no_grad():
+                    for _ in range(3):
+                        variant.seq(image)
+
+                    start = time.perf_counter()
+
+                    for _ in range(10):
+                        variant.seq(image)
+
+                latency = (time.perf_counter() - start) / 10 * 1000
+                print("Batch", batch_size, name, "%.2f ms" % latency)
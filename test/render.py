@@ -14,10 +14,14 @@ import unittest
 import torch
 import random
 import math
+import os
+import tempfile
+import numpy as np
 import util.plyobj as plyobj
 from net.renderer import Splat
 from util.image import save_image
-from util.math import TransTen, PointsTen, VecRot
+from util.math import TransTen, PointsTen, VecRot, VecRotTenBatch, TransTenBatch
+from util.templates import TemplateIndex, hopf_grid
 
 
 class Render(unittest.TestCase):
@@ -69,6 +73,33 @@ class Render(unittest.TestCase):
         self.assertTrue(torch.sum(model) > 200)
         save_image(model, name="test_renderer_tall.jpg")
 
+    def test_render_batch(self):
+        torch.manual_seed(6)
+        points = PointsTen().from_points(plyobj.load_obj("./objs/bunny_large.obj"))
+        splat = Splat(size=(48, 40))
+        mask = torch.ones(len(points))
+        mask[0:10] = 0.0
+        rots = VecRotTenBatch.random(4)
+        rots.data[0] = 0.0
+        trans = TransTenBatch(torch.rand(4, 2) * 0.2 - 0.1)
+        sigmas = torch.tensor([1.0, 1.25, 1.8, 2.5])
+
+        images = splat.render_batch(points.data, rots.data, trans.data, mask, sigmas)
+        self.assertEqual(tuple(images.shape), (4, 48, 40))
+
+        for i in range(4):
+            image = splat.render(points, rots[i], trans[i], mask, sigmas[i])
+            self.assertTrue(torch.allclose(images[i], image, atol=1e-5))
+
+        # A renderer pickled before render_batch existed has no grids
+        state = splat.__dict__.copy()
+        del state["grid_x"], state["grid_y"]
+        old = Splat.__new__(Splat)
+        old.__setstate__(state)
+        old = old.to("cpu")
+        again = old.render_batch(points.data, rots.data, trans.data, mask, sigmas)
+        self.assertTrue(torch.equal(again, images))
+
     def test_dropout(self):
         use_cuda = False
         device = torch.device("cuda" if use_cuda else "cpu")
@@ -103,6 +134,64 @@ class Render(unittest.TestCase):
         self.assertTrue(torch.sum(model2) > torch.sum(model))
         save_image(model, name="test_renderer_1.jpg")
 
+    def test_plyobj(self):
+        obj = plyobj.load_obj_vertices("./objs/bunny_detailed.obj")
+        ply = plyobj.load_ply_vertices("./objs/bunny_detailed.ply")
+        self.assertEqual(obj.shape, (690, 3))
+        self.assertEqual(obj.dtype, np.float32)
+        self.assertEqual(ply.shape, (690, 3))
+
+        points = plyobj.load_obj("./objs/bunny_detailed.obj")
+        self.assertEqual(len(points), 690)
+        self.assertAlmostEqual(points[0].x, float(obj[0, 0]))
+        self.assertEqual(points[0].w, 1.0)
+
+        with tempfile.TemporaryDirectory() as savedir:
+            path = os.path.join(savedir, "binary.ply")
+            plyobj.save_ply(path, ply, binary=True)
+            self.assertTrue(np.array_equal(plyobj.load_ply_vertices(path), ply))
+
+            path = os.path.join(savedir, "ascii.ply")
+            plyobj.save_ply(path, ply)
+            self.assertTrue(np.allclose(plyobj.load_ply_vertices(path), ply, atol=1e-4))
+
+            # Lists of x, y, z, w still work, as the old writers took
+            path = os.path.join(savedir, "shape.obj")
+            plyobj.save_obj(path, [(1.0, 2.0, 3.0, 1.0), (4.0, 5.0, 6.0, 1.0)])
+            self.assertEqual(plyobj.load_obj_vertices(path).tolist()[1], [4, 5, 6])
+
+    def test_templates(self):
+        grid = hopf_grid(300)
+        self.assertTrue(abs(len(grid) - 300) < 30)
+        self.assertTrue(torch.allclose(grid.norm(dim=1), torch.ones(len(grid))))
+
+        points = PointsTen().from_points(plyobj.load_obj("./objs/bunny_large.obj"))
+        splat = Splat(size=(32, 32))
+        mask = torch.ones(len(points))
+        t = TransTen(torch.tensor([0.0]), torch.tensor([0.0]))
+
+        with tempfile.TemporaryDirectory() as savedir:
+            index = TemplateIndex.load_or_build(
+                savedir, points, count=300, sigma=1.2, size=(32, 32), components=16
+            )
+            self.assertEqual(len(os.listdir(savedir)), 1)
+            self.assertEqual(tuple(index.templates.shape), (len(grid), 16))
+
+            # Brighter renders of template poses should find those templates
+            rots = index.rotations(torch.tensor([7, 123]))
+            images = torch.stack(
+                [5.0 * splat.render(points, r, t, mask, sigma=1.2) for r in rots]
+            )
+            (_, idx) = index.query(images, k=2)
+            self.assertEqual(idx[:, 0].tolist(), [7, 123])
+
+            # The second time round, it comes from disk
+            loaded = TemplateIndex.load_or_build(
+                savedir, points, count=300, sigma=1.2, size=(32, 32), components=16
+            )
+            self.assertTrue(torch.equal(loaded.templates, index.templates))
+            self.assertEqual(loaded.query(images)[1][:, 0].tolist(), [7, 123])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,138 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+run.py - testing the batch run over many images.
+
+"""
+
+import unittest
+import argparse
+import csv
+import os
+import tempfile
+import torch
+from net.net import Net
+from net.renderer import Splat
+from run import gather_images, ImageFiles, ResultsWriter, batch_run
+from util.image import NormaliseBasic, save_fits, save_image
+from util.math import PointsTen
+from util.plyobj import load_obj
+
+
+class Run(unittest.TestCase):
+    def make_images(self, savedir, count, size=(32, 32)):
+        torch.manual_seed(1)
+        images = torch.rand(count, *size)
+
+        for i in range(count):
+            save_fits(images[i], name=os.path.join(savedir, "im_%03d.fits" % i))
+
+        return images
+
+    def test_gather_images(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            self.make_images(savedir, 3)
+            save_image(torch.rand(32, 32), name=os.path.join(savedir, "extra.jpg"))
+
+            with open(os.path.join(savedir, "notes.txt"), "w") as f:
+                f.write("not an image\n")
+
+            paths = gather_images(savedir)
+            self.assertEqual(
+                [os.path.basename(p) for p in paths],
+                ["extra.jpg", "im_000.fits", "im_001.fits", "im_002.fits"],
+            )
+
+            paths = gather_images(os.path.join(savedir, "im_*.fits"))
+            self.assertEqual(len(paths), 3)
+
+            listing = os.path.join(savedir, "list.txt")
+            with open(listing, "w") as f:
+                f.write(paths[2] + "\n\n" + paths[0] + "\n")
+
+            self.assertEqual(gather_images(listing), [paths[2], paths[0]])
+
+    def test_image_files(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            images = self.make_images(savedir, 2)
+            jpg = os.path.join(savedir, "extra.jpg")
+            save_image(torch.rand(32, 32), name=jpg)
+            paths = gather_images(os.path.join(savedir, "im_*.fits")) + [jpg]
+            files = ImageFiles(paths, (32, 32))
+            self.assertEqual(len(files), 3)
+
+            (image, idx) = files[1]
+            self.assertEqual(idx, 1)
+            self.assertEqual(tuple(image.shape), (1, 32, 32))
+            # save_fits flips the image and ImageFiles flips it back
+            self.assertTrue(torch.allclose(image[0], images[1]))
+
+            (image, _) = files[2]
+            self.assertEqual(tuple(image.shape), (1, 32, 32))
+            self.assertLessEqual(float(image.max()), 1.0)
+
+            with self.assertRaises(AssertionError):
+                ImageFiles(paths, (16, 16))[0]
+
+    def test_results_writer(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            path = os.path.join(savedir, "poses.csv")
+            results = ResultsWriter(path)
+            results.append([["a.fits", 0.1, 0.2, 0.3, 0.0, 0.0, 1.2, 5.0]])
+            results.append([["b.fits", 0.4, 0.5, 0.6, 0.1, -0.1, 1.5, 6.0]])
+            results.close()
+
+            with open(path, "r", newline="") as f:
+                rows = list(csv.reader(f))
+
+            self.assertEqual(rows[0], ResultsWriter.FIELDS)
+            self.assertEqual(len(rows), 3)
+            self.assertEqual(rows[2][0], "b.fits")
+            self.assertAlmostEqual(float(rows[2][4]), 0.1)
+
+    def test_batch_run(self):
+        torch.manual_seed(1)
+        model = Net(Splat(size=(32, 32)))
+        model.eval()
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+        normaliser = NormaliseBasic()
+
+        with tempfile.TemporaryDirectory() as savedir:
+            images = self.make_images(savedir, 5)
+            paths = gather_images(savedir)
+            args = argparse.Namespace(
+                batch_size=2,
+                workers=0,
+                output=os.path.join(savedir, "poses.csv"),
+                guesses=os.path.join(savedir, "guesses"),
+            )
+            batch_run(model, points, torch.device("cpu"), normaliser, paths, args)
+
+            with open(args.output, "r", newline="") as f:
+                rows = list(csv.reader(f))[1:]
+
+            self.assertEqual([r[0] for r in rows], paths)
+            self.assertEqual(len(os.listdir(args.guesses)), 10)
+
+            # Each row should match a single pass of the model
+            with torch.no_grad():
+                model.forward(normaliser.normalise(images[3:4, None]), points)
+                rot = model.get_poses()[0].data[0]
+
+            row = torch.tensor([float(v) for v in rows[3][1:4]])
+            self.assertTrue(torch.allclose(row, rot, atol=1e-4))
+
+            # Without --guesses nothing else is written
+            args.guesses = ""
+            args.output = os.path.join(savedir, "again.csv")
+            batch_run(model, points, torch.device("cpu"), normaliser, paths, args)
+            self.assertTrue(os.path.isfile(args.output))
+            self.assertEqual(len(os.listdir(os.path.join(savedir, "guesses"))), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
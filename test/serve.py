@@ -0,0 +1,97 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+serve.py - testing the pose server, on localhost.
+
+"""
+
+import unittest
+import json
+import threading
+import urllib.request
+import urllib.error
+import numpy as np
+import torch
+from net.net import Net
+from net.renderer import Splat
+from serve import MicroBatcher, make_server
+from util.image import NormaliseBasic
+from util.math import PointsTen
+from util.plyobj import load_obj
+
+
+class Serve(unittest.TestCase):
+    def test_server(self):
+        torch.manual_seed(1)
+        model = Net(Splat(size=(32, 32)))
+        model.eval()
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+        batcher = MicroBatcher(model, points, NormaliseBasic(), max_wait=0.25)
+        server = make_server(batcher, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:" + str(server.server_address[1])
+
+        def post(body, path="/pose", json_body=False):
+            req = urllib.request.Request(url + path, data=body, method="POST")
+            if json_body:
+                req.add_header("Content-Type", "application/json")
+            try:
+                with urllib.request.urlopen(req) as res:
+                    return (res.status, json.loads(res.read()))
+            except urllib.error.HTTPError as e:
+                return (e.code, json.loads(e.read()))
+
+        try:
+            images = torch.rand(6, 32, 32)
+            replies = [None] * 6
+
+            def send(i):
+                replies[i] = post(images[i].numpy().astype("<f4").tobytes())
+
+            threads = [threading.Thread(target=send, args=(i,)) for i in range(6)]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+
+            self.assertTrue(all(r[0] == 200 for r in replies))
+            self.assertEqual(len(replies[0][1]["rotation"]), 3)
+            self.assertEqual(len(replies[0][1]["translation"]), 2)
+
+            # Concurrent requests should share batches, and match the model
+            metrics = json.loads(urllib.request.urlopen(url + "/metrics").read())
+            self.assertEqual(metrics["requests"], 6)
+            self.assertLess(metrics["batches"], 6)
+            self.assertGreater(metrics["latency_p50_ms"], 0)
+
+            with torch.no_grad():
+                model.forward(
+                    NormaliseBasic().normalise(images[2:3].reshape(1, 1, 32, 32)), points
+                )
+                rot = model.get_poses()[0].data[0].tolist()
+
+            self.assertTrue(np.allclose(replies[2][1]["rotation"], rot, atol=1e-4))
+
+            (code, reply) = post(
+                json.dumps({"image": images[0].tolist()}).encode("utf-8"),
+                path="/pose?guess=1",
+                json_body=True,
+            )
+            self.assertEqual(code, 200)
+            self.assertEqual(reply["guess_shape"], [32, 32])
+
+            (code, _) = post(np.zeros(10, dtype="<f4").tobytes())
+            self.assertEqual(code, 400)
+
+            health = json.loads(urllib.request.urlopen(url + "/health").read())
+            self.assertEqual(health["status"], "ok")
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
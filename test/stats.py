@@ -0,0 +1,354 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+stats.py - testing our stats recording and the background
+writer.
+
+"""
+
+import unittest
+import json
+import os
+import sqlite3
+import tempfile
+import numpy as np
+import torch
+from stats.backend import RemoteBackend
+from stats.stats import Stats as StatsRecorder
+from stats.reader import StatsReader, RedisReader
+import stats.encoding as encoding
+from stats.pointcloud import PointCloud
+from stats.simpleicp import simpleicp, matching, reject
+from stats.objs_to_json import parse_obj, load_animation
+from stats.trajectory import Trajectory, TrajectoryWriter
+from stats.writer import AsyncWriter, snapshot
+from util.math import PointsTen, VecRotTen
+from util.plyobj import load_obj, load_ply
+
+
+class SQLitePool(object):
+    """ Stands in for a psycopg2 pool, translating the placeholders."""
+
+    class Cursor(object):
+        def __init__(self, pool):
+            self.pool = pool
+            self.cur = pool.conn.cursor()
+
+        def execute(self, query, params=()):
+            if self.pool.failures > 0 and query.startswith("INSERT"):
+                self.pool.failures -= 1
+                self.pool.aborted = True
+                raise sqlite3.OperationalError("connection lost")
+
+            assert not self.pool.aborted, "current transaction is aborted"
+            self.cur.execute(query.replace("%s", "?"), params)
+
+    class Conn(object):
+        def __init__(self, pool):
+            self.pool = pool
+
+        def cursor(self):
+            return SQLitePool.Cursor(self.pool)
+
+        def commit(self):
+            self.pool.conn.commit()
+
+        def rollback(self):
+            self.pool.conn.rollback()
+            self.pool.aborted = False
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.given = 0
+        # How many INSERTs to fail, leaving the transaction aborted
+        self.failures = 0
+        self.aborted = False
+
+    def getconn(self):
+        self.given += 1
+        return SQLitePool.Conn(self)
+
+    def putconn(self, conn):
+        self.given -= 1
+
+
+class Stats(unittest.TestCase):
+    def test_snapshot(self):
+        a = torch.ones(3, requires_grad=True)
+        b = a * 2.0
+        r = VecRotTen(torch.tensor([1.0]), torch.tensor([2.0]), torch.tensor([3.0]))
+        snap = snapshot({"b": b, "rots": [r], "loss": 1.5})
+        b.data.fill_(0.0)
+        r.x.fill_(0.0)
+
+        self.assertFalse(snap["b"].requires_grad)
+        self.assertTrue(torch.equal(snap["b"], torch.full((3,), 2.0)))
+        self.assertEqual(float(snap["rots"][0].x), 1.0)
+        self.assertEqual(snap["loss"], 1.5)
+
+    def test_snapshot_model(self):
+        from net.net import Net
+        from net.renderer import Splat
+
+        model = Net(Splat(size=(32, 32)))
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+        points.data.requires_grad_(True)
+
+        # A forward pass with gradients on leaves non-leaf tensors behind
+        model(torch.rand(2, 1, 32, 32), points).sum().backward()
+        snap = snapshot(model)
+
+        for (a, b) in zip(snap.parameters(), model.parameters()):
+            self.assertTrue(torch.equal(a, b.detach()))
+
+        # Non-leaf tensors held in containers, however deep, are copied too
+        model.held = {"outputs": [(model(torch.rand(1, 1, 32, 32), points),)]}
+        snap = snapshot(model)
+        self.assertFalse(snap.held["outputs"][0][0].requires_grad)
+
+    def test_writer(self):
+        written = []
+        writer = AsyncWriter(queue_size=2)
+        data = torch.zeros(4)
+
+        for i in range(10):
+            data.fill_(i)
+            writer.submit(lambda t, j: written.append((float(t[0]), j)), data, i)
+
+        writer.close()
+        self.assertEqual(written, [(float(i), i) for i in range(10)])
+        metrics = writer.metrics()
+        self.assertEqual(metrics["completed"], 10)
+        self.assertEqual(metrics["errors"], 0)
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            recorder = StatsRecorder()
+            recorder.on(savedir, backend="sqlite")
+            rots = [
+                VecRotTen(torch.tensor([0.1]), torch.tensor([0.2]), torch.tensor([0.3]))
+            ]
+
+            for step in range(5):
+                recorder.watch(float(step), "loss_train")
+                recorder.watch(torch.ones(2, 3) * step, "rotations_out_train")
+                recorder.watch(rots, "rotations_in_train")
+                recorder.update(0, 100, 10, step)
+
+            recorder.close()
+
+            reader = StatsReader(os.path.join(savedir, "stats.db"))
+            self.assertEqual(
+                reader.names(),
+                ["loss_train", "rotations_in_train", "rotations_out_train"],
+            )
+            loss = reader.series("loss_train")
+            self.assertEqual([r[3] for r in loss], [0.0, 1.0, 2.0, 3.0, 4.0])
+            self.assertEqual([r[0] for r in loss], [0, 10, 20, 30, 40])
+
+            zr = reader.zrange("experiment:rotations_out_train", 0, -1)
+            self.assertEqual(len(zr), 5)
+            (record, idx) = zr[2]
+            self.assertEqual(idx, 20)
+            self.assertEqual(json.loads(record)["data"], [[2.0] * 3] * 2)
+            rots_in = reader.series("rotations_in_train")
+            self.assertEqual(rots_in[0][3].shape, (1, 3, 1))
+            self.assertAlmostEqual(float(rots_in[0][3][0, 2, 0]), 0.3, places=6)
+            reader.close()
+
+    def test_encoding(self):
+        arr = torch.arange(24, dtype=torch.float32).reshape(2, 3, 4).numpy()
+        blob = encoding.encode(arr)
+        self.assertTrue(encoding.is_encoded(blob))
+        self.assertEqual(len(blob), 6 + 3 * 8 + 24 * 4)
+
+        back = encoding.decode(blob)
+        self.assertEqual(back.dtype.str, "<f4")
+        self.assertTrue((back == arr).all())
+        self.assertEqual(encoding.decode(blob, as_list=True), arr.tolist())
+
+        # Decoding with only the standard library gives the same lists
+        np = encoding.np
+        try:
+            encoding.np = None
+            self.assertEqual(encoding.decode(blob), arr.tolist())
+        finally:
+            encoding.np = np
+
+        self.assertEqual(encoding.decode(encoding.encode(arr > 5)).dtype.str, "|u1")
+        record = encoding.encode_record(2, 7, blob)
+        decoded = encoding.decode_record(record, as_list=True)
+        self.assertEqual((decoded["epoch"], decoded["step"]), (2, 7))
+        self.assertEqual(decoded["data"], arr.tolist())
+        scalar = encoding.encode_record(1, 2, 0.5)
+        self.assertEqual(encoding.decode_record(scalar)["data"], 0.5)
+
+    def test_remote(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest("fakeredis is not installed")
+
+        R = fakeredis.FakeRedis()
+        pool = SQLitePool()
+        backend = RemoteBackend(
+            "experiment", redis_client=R, pg_pool=pool, batch_size=4, flush_interval=60
+        )
+
+        for idx in range(6):
+            backend.add("loss_train", 0, idx, idx * 10, float(idx))
+
+        # The first batch of four has gone, the last two are held
+        rows = pool.conn.execute("SELECT COUNT(*) FROM experiment_stats").fetchone()
+        self.assertEqual(rows[0], 4)
+        self.assertEqual(R.zcard("experiment:loss_train"), 4)
+
+        backend.close()
+        self.assertEqual(pool.given, 0)
+        rows = pool.conn.execute(
+            "SELECT experiment, name, idx, data FROM experiment_stats ORDER BY idx"
+        ).fetchall()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[5][:3], ("experiment", "loss_train", 50))
+        self.assertEqual(json.loads(str(rows[5][3])), 5.0)
+
+        zr = R.zrange("experiment:loss_train", 0, -1, withscores=True)
+        self.assertEqual([int(i) for (_, i) in zr], [0, 10, 20, 30, 40, 50])
+        self.assertEqual(json.loads(zr[3][0]), {"epoch": 0, "step": 3, "data": 3.0})
+        self.assertGreater(R.ttl("experiment:loss_train"), 0)
+
+        # Arrays go in as blobs and come back out as JSON through the reader
+        backend = RemoteBackend("experiment", redis_client=R, pg_pool=pool)
+        rots = torch.ones(2, 3)
+        backend.add("rotations_out_train", 0, 1, 10, encoding.encode(rots.numpy()))
+        backend.close()
+        zr = RedisReader(R).zrange("experiment:rotations_out_train", 0, -1)
+        self.assertEqual(json.loads(zr[0][0])["data"], rots.tolist())
+        blob = pool.conn.execute(
+            "SELECT blob FROM experiment_stats WHERE name='rotations_out_train'"
+        ).fetchone()[0]
+        self.assertTrue((encoding.decode(blob) == rots.numpy()).all())
+
+        # A failed INSERT is rolled back and its records written next time
+        backend = RemoteBackend(
+            "retry", redis_client=R, pg_pool=pool, batch_size=2, flush_interval=60
+        )
+        pool.failures = 1
+
+        with self.assertRaises(sqlite3.OperationalError):
+            for idx in range(2):
+                backend.add("loss_train", 0, idx, idx, float(idx))
+
+        self.assertFalse(pool.aborted)
+        self.assertEqual(R.zcard("retry:loss_train"), 2)
+        backend.add("loss_train", 0, 2, 2, 2.0)
+        backend.close()
+        rows = pool.conn.execute(
+            "SELECT idx FROM experiment_stats WHERE experiment='retry' ORDER BY idx"
+        ).fetchall()
+        self.assertEqual([r[0] for r in rows], [0, 1, 2])
+        self.assertEqual(R.zcard("retry:loss_train"), 3)
+        self.assertEqual(pool.given, 0)
+
+    def test_trajectory(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            recorder = StatsRecorder()
+            recorder.start_writer()
+
+            for step in range(3):
+                points = PointsTen(device="cpu").from_tensor(
+                    torch.full((5, 4, 1), float(step))
+                )
+                recorder.save_points(points, savedir, 1, step * 100)
+
+            recorder.close()
+            path = os.path.join(savedir, "points.traj")
+
+            # A partial record, as if the run died mid-write, is ignored
+            with open(path, "ab") as f:
+                f.write(b"\x00" * 10)
+
+            traj = Trajectory(path)
+            self.assertEqual(traj.points.shape, (3, 5, 3))
+            self.assertEqual(traj.steps.tolist(), [0, 100, 200])
+            self.assertEqual(traj.epochs.tolist(), [1, 1, 1])
+            self.assertTrue((traj[2] == 2.0).all())
+            self.assertEqual(traj.frames(2), [0, 1])
+
+            traj.export_obj(-1, os.path.join(savedir, "last.obj"))
+            traj.export_ply(-1, os.path.join(savedir, "last.ply"))
+            traj.export_animation(os.path.join(savedir, "animation.json"))
+            self.assertEqual(len(load_obj(os.path.join(savedir, "last.obj"))), 5)
+            self.assertEqual(len(load_ply(os.path.join(savedir, "last.ply"))), 5)
+
+            with open(os.path.join(savedir, "animation.json")) as f:
+                animation = json.load(f)
+
+            self.assertEqual(len(animation["frames"]), 3)
+            self.assertEqual(animation["frames"][1]["vertices"][0]["x"], 1.0)
+
+    def test_animation(self):
+        with tempfile.TemporaryDirectory() as savedir:
+            writer = TrajectoryWriter(os.path.join(savedir, "points.traj"), 4)
+            frames = torch.rand(6, 4, 3).numpy()
+
+            for step, frame in enumerate(frames):
+                writer.append(frame, 0, step)
+
+            writer.close()
+            traj = Trajectory(os.path.join(savedir, "points.traj"))
+            traj.export_obj(2, os.path.join(savedir, "shape.obj"))
+            self.assertTrue(
+                abs(parse_obj(os.path.join(savedir, "shape.obj")) - frames[2]).max()
+                < 1e-4
+            )
+
+            traj.export_animation(os.path.join(savedir, "animation.bin"), binary=True)
+            traj.export_animation(os.path.join(savedir, "animation.json"), limit=3)
+            binary = load_animation(os.path.join(savedir, "animation.bin"))
+            self.assertEqual(binary.shape, (6, 4, 3))
+            self.assertTrue((binary == frames).all())
+            sparse = load_animation(os.path.join(savedir, "animation.json"))
+            self.assertTrue((sparse == frames[0:6:2]).all())
+
+    def test_icp(self):
+        rng = np.random.default_rng(0)
+        cov = rng.normal(size=(100, 10, 3)) * np.array([1.0, 0.5, 0.01])
+        cov = np.einsum("nki,nkj->nij", cov, cov)
+        (vals, normals) = PointCloud.eigh3(cov)
+        (evals, evecs) = np.linalg.eigh(cov)
+        self.assertTrue(np.allclose(vals, evals))
+        self.assertTrue(np.allclose(np.abs((normals * evecs[:, :, 0]).sum(axis=1)), 1))
+
+        # A wavy surface, moved slightly
+        u = rng.random((2000, 2)) * 4
+        X = np.column_stack((u, np.sin(u[:, 0]) * np.cos(u[:, 1])))
+        theta = 0.02
+        R = np.array(
+            [
+                [np.cos(theta), -np.sin(theta), 0],
+                [np.sin(theta), np.cos(theta), 0],
+                [0, 0, 1],
+            ]
+        )
+        Y = X @ R.T + np.array([0.02, -0.01, 0.01])
+        H = simpleicp(X, Y, correspondences=500, neighbors=10)
+        self.assertTrue(np.allclose(H[0:3, 0:3] @ R, np.eye(3), atol=1e-3))
+
+        # Both rejection masks apply, not just the planarity one
+        pcfix = PointCloud(X[:, 0], X[:, 1], X[:, 2])
+        pcmov = PointCloud(X[:, 0], X[:, 1], X[:, 2])
+        pcfix.select_n_points(200)
+        pcfix.estimate_normals(10)
+        distances = matching(pcfix, pcmov)
+        self.assertTrue(np.allclose(distances, 0))
+        distances[0:5] = 10.0
+        pcfix.planarity[pcfix.sel[5:10]] = 0.0
+        dropped = pcfix.sel[0:10]
+        kept = reject(pcfix, pcmov, 0.3, distances)
+        self.assertFalse(np.isin(dropped, pcfix.sel).any())
+        self.assertTrue((kept == 0).all())
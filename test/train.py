@@ -12,10 +12,16 @@ training file as well as the Net class.
 
 import unittest
 import math
+import os
+import tempfile
 import torch
 import torch.nn.functional as F
 from util.image import NormaliseBasic
 from train.train import cont_sigma
+from train.loss import match_distance, calculate_move_loss
+from train.icp_test import rmsd_score, perform_icp
+from train.convergence import ConvergenceMonitor, kabsch_distance
+from stats.trajectory import TrajectoryWriter
 from util.math import PointsTen, VecRot, TransTen, Points
 from util.plyobj import load_obj
 from net.renderer import Splat
@@ -82,6 +88,286 @@ class Train(unittest.TestCase):
 
         print(sigmas)
 
+    def test_move_loss(self):
+        torch.manual_seed(1)
+
+        cases = [(60, 60, 0.02), (60, 60, 0.8), (80, 50, 0.3), (50, 80, 0.3)]
+
+        for (n, m, noise) in cases:
+            k = min(n, m)
+            fixed = torch.rand(n, 3, dtype=torch.float64)
+            moved = torch.rand(m, 3, dtype=torch.float64)
+            moved[0:k] = fixed[0:k] + torch.randn(k, 3) * noise
+            expected = rmsd_score(
+                [tuple(v) for v in fixed.tolist()], [tuple(v) for v in moved.tolist()]
+            )
+            greedy = float(match_distance(fixed, moved))
+            self.assertAlmostEqual(greedy, expected, places=9)
+            # The optimal matching can never be worse than greedy
+            self.assertLessEqual(
+                float(match_distance(fixed, moved, exact=True)), expected + 1e-9
+            )
+
+        p0 = PointsTen(device="cpu").from_tensor(torch.rand(30, 4, 1) * 10.0)
+        p1 = PointsTen(device="cpu").from_tensor(p0.data.clone())
+        p1.data[:, 0] += 0.01
+        self.assertAlmostEqual(calculate_move_loss(p0, p1), 0.01, places=5)
+        self.assertAlmostEqual(calculate_move_loss(p0, p1, exact=True), 0.01, places=5)
+
+    def test_perform_icp(self):
+        torch.manual_seed(2)
+        base = torch.rand(40, 3, dtype=torch.float64)
+
+        with tempfile.TemporaryDirectory() as savedir:
+            path = os.path.join(savedir, "points.traj")
+            writer = TrajectoryWriter(path, 40)
+
+            for step in range(8):
+                writer.append((base + step * 0.001).numpy(), 0, step)
+
+            writer.close()
+            scores = perform_icp(savedir, dist=3, workers=1)
+            self.assertEqual([s[0] for s in scores], [3, 4, 5, 6, 7])
+            self.assertTrue(all(s[1] < 0.01 for s in scores))
+
+            # Mark a cached score, add frames, and check only new pairs are run
+            cache = os.path.join(savedir, "icp_pairs.csv")
+
+            with open(cache) as f:
+                lines = f.readlines()
+
+            lines = [line for line in lines if not line.startswith("0,3,")]
+
+            with open(cache, "w") as f:
+                f.writelines(lines + ["0,3,-1.0\n"])
+
+            writer = TrajectoryWriter(path, 40)
+
+            for step in range(8, 10):
+                writer.append((base + step * 0.001).numpy(), 0, step)
+
+            writer.close()
+            scores = perform_icp(savedir, dist=3, workers=1)
+            self.assertEqual(len(scores), 7)
+            self.assertEqual(scores[0], (3, -1.0))
+
+            # The cache is added to, not rewritten, and a partial line from
+            # an interrupted run is skipped
+            with open(cache) as f:
+                lines = f.readlines()
+
+            self.assertEqual(lines[-3], "0,3,-1.0\n")
+            self.assertEqual(len(lines), 8)
+
+            with open(cache, "a") as f:
+                f.write("6,9,0.12")
+
+            scores = perform_icp(savedir, dist=3, workers=1)
+            self.assertEqual(len(scores), 7)
+            self.assertEqual(scores[0], (3, -1.0))
+            self.assertTrue(scores[-1][1] < 0.01)
+
+            with open(cache) as f:
+                lines = f.readlines()
+
+            # The partial line is ended, so new scores start on their own line
+            self.assertEqual(lines[-1], "6,9,0.12\n")
+            self.assertEqual(len(lines), 9)
+
+    def test_bundle(self):
+        from net.net import Net
+        from util.loadsave import save_bundle, load_bundle
+
+        args = Args()
+        args.image_height = 32
+        args.image_width = 48
+        args.max_trans = 0.2
+        args.normalise_basic = False
+        model = Net(Splat(size=(32, 48)), max_trans=0.2)
+        model.eval()
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+
+        with tempfile.TemporaryDirectory() as savedir:
+            path = os.path.join(savedir, "bundle.pt")
+            save_bundle(model, points, args, path)
+            (loaded, loaded_points, settings) = load_bundle(path)
+
+            self.assertEqual(settings.image_width, 48)
+            self.assertFalse(settings.normalise_basic)
+            self.assertEqual(loaded.max_shift, 0.2)
+            self.assertTrue(torch.equal(loaded_points.data, points.data))
+
+            image = torch.rand(2, 1, 32, 48)
+            with torch.no_grad():
+                expected = model.forward(image, points)
+                output = loaded.forward(image, loaded_points)
+
+            self.assertTrue(torch.allclose(output, expected))
+
+    def test_model_saver(self):
+        from net.net import Net
+        from stats.writer import snapshot
+        from util.loadsave import ModelSaver, load_model
+
+        model = Net(Splat(size=(32, 32)))
+        saver = ModelSaver(model)
+
+        with torch.no_grad():
+            model.fc2.bias.fill_(0.5)
+
+        with tempfile.TemporaryDirectory() as savedir:
+            path = os.path.join(savedir, "model.tar")
+            saver(snapshot(model.state_dict()), path)
+            loaded = load_model(path)
+
+        self.assertTrue(torch.equal(loaded.fc2.bias, model.fc2.bias.detach()))
+
+    def test_optimise(self):
+        from net.net import Net
+        from net.optimise import optimise_for_inference
+
+        torch.manual_seed(3)
+        model = Net(Splat(size=(32, 32)))
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+
+        # Give the BatchNorm layers some running statistics to fold
+        with torch.no_grad():
+            for _ in range(3):
+                model.seq(torch.rand(4, 1, 32, 32) * 5.0)
+
+        model.eval()
+        image = torch.rand(3, 1, 32, 32)
+
+        for jit in (False, True):
+            optimised = optimise_for_inference(model, jit=jit)
+
+            with torch.no_grad():
+                expected = model.seq(image)
+                output = optimised.seq(image)
+
+            self.assertTrue(torch.allclose(output, expected, atol=1e-4))
+
+            with torch.no_grad():
+                rendered = optimised.forward(image, points)
+
+            self.assertEqual(tuple(rendered.shape), (3, 1, 32, 32))
+
+        # The original is left as it was
+        self.assertIsInstance(model.seq[1], torch.nn.BatchNorm2d)
+
+    def test_quantise(self):
+        from net.net import Net
+        from net.optimise import quantise, render_calibration
+
+        torch.manual_seed(3)
+        model = Net(Splat(size=(32, 32)))
+        model.eval()
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+        normaliser = NormaliseBasic()
+        (calibration, _, _) = render_calibration(model.splat, points, 24)
+        calibration = normaliser.normalise(calibration)
+        (held_out, rots, _) = render_calibration(model.splat, points, 6)
+        held_out = normaliser.normalise(held_out)
+
+        self.assertEqual(tuple(calibration.shape), (24, 1, 32, 32))
+        self.assertEqual(len(rots), 6)
+
+        with torch.no_grad():
+            expected = model.seq(held_out)
+
+        for static in (False, True):
+            quantised = quantise(model, calibration, static=static)
+
+            with torch.no_grad():
+                output = quantised.seq(held_out)
+                rendered = quantised.forward(held_out, points)
+
+            # int8 is close to float, relative to the size of the outputs
+            error = (output - expected).abs().max() / expected.abs().max()
+            self.assertLess(float(error), 0.2)
+            self.assertEqual(tuple(rendered.shape), (6, 1, 32, 32))
+
+        # Static quantisation needs its calibration images
+        with self.assertRaises(AssertionError):
+            quantise(model, None, static=True)
+
+        self.assertIsInstance(model.seq[0], torch.nn.Conv2d)
+
+    @unittest.skipUnless(hasattr(torch, "compile"), "needs torch.compile")
+    def test_compile(self):
+        from net.net import Net
+        from net.optimise import compile_model
+
+        torch.manual_seed(3)
+        model = Net(Splat(size=(32, 32)))
+        model.eval()
+        points = PointsTen().from_points(load_obj("./objs/bunny_large.obj"))
+        points.data.requires_grad_(True)
+        image = torch.rand(3, 1, 32, 32)
+
+        expected = model.forward(image, points)
+        expected.sum().backward()
+        expected_grad = points.data.grad.clone()
+        expected_rots = model.get_poses()[0].data
+
+        # The tensor-only forward traces as well as compiles
+        traced = torch.jit.trace_module(
+            model, {"render_tensors": (image, points.data.detach())}
+        )
+        self.assertTrue(
+            torch.allclose(
+                traced.render_tensors(image, points.data)[0], expected, atol=1e-5
+            )
+        )
+
+        compile_model(model)
+        points.data.grad = None
+        output = model.forward(image, points)
+        output.sum().backward()
+
+        self.assertTrue(torch.allclose(output, expected, atol=1e-4))
+        self.assertTrue(torch.allclose(model.get_poses()[0].data, expected_rots))
+        self.assertTrue(torch.allclose(points.data.grad, expected_grad, atol=1e-4))
+
+        # The compiled function isn't saved with the model
+        with tempfile.TemporaryDirectory() as tmp:
+            torch.save(model, tmp + "/model.tar")
+            loaded = torch.load(tmp + "/model.tar", weights_only=False)
+
+        self.assertIsNone(loaded._compiled)
+
+    def test_convergence(self):
+        torch.manual_seed(3)
+        base = torch.rand(50, 3, dtype=torch.float64) * 4.0
+
+        def rot_z(angle):
+            (c, s) = (math.cos(angle), math.sin(angle))
+            return torch.tensor(
+                [[c, -s, 0], [s, c, 0], [0, 0, 1]], dtype=torch.float64
+            )
+
+        # A rotation about z and a shift is no change at all to the structure
+        shift = torch.tensor([1.0, -2.0, 0.5], dtype=torch.float64)
+        moved = base @ rot_z(0.7).T + shift
+        self.assertLess(float(kabsch_distance(base, moved)), 1e-6)
+        squashed = base * torch.tensor([1.0, 1.0, 0.5], dtype=torch.float64)
+        self.assertGreater(float(kabsch_distance(base, squashed)), 0.05)
+
+        monitor = ConvergenceMonitor(window=2, threshold=0.001, patience=2)
+
+        for i in range(6):
+            rotated = base @ rot_z(0.1 * i).T
+            points = PointsTen(device="cpu").from_tensor(
+                torch.cat([rotated, torch.ones(50, 1)], dim=1).unsqueeze(2)
+            )
+            converged = monitor.update(points)
+            self.assertEqual(converged, i >= 3)
+
+        # Change the structure and we are no longer converged
+        points.data[:, 0] *= 2.0
+        self.assertFalse(monitor.update(points))
+        self.assertGreater(monitor.distance, 0.001)
+
     def test_draw_sigma(self):
         import seaborn as sns
 
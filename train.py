@@ -23,14 +23,15 @@ import argparse
 import os
 import sys
 from util.points import init_points_poisson, load_points, save_points, init_points, init_points_spot
-from util.loadsave import save_checkpoint, save_model
+from util.loadsave import save_checkpoint, save_bundle, ModelSaver
 from data.loader import Loader
 from data.imageload import ImageLoader
 from data.sets import DataSet, SetType
-from data.buffer import Buffer, BufferImage
+from data.buffer import Buffer, BufferCached, BufferImage
 from stats import stats as S
 from net.renderer import Splat
 from net.net import Net
+from net.optimise import compile_model
 from util.math import PointsTen
 from train.train import train
 
@@ -153,12 +154,22 @@ def init(args, device):
             set_train, splat_in, buffer_size=args.buffer_size, device=device
         )
 
-        buffer_test = Buffer(
-            set_test, splat_in, buffer_size=test_set_size, device=device
+        # The test and validation buffers keep their images between
+        # passes, only re-rendering when the sigma has moved enough.
+        buffer_test = BufferCached(
+            set_test,
+            splat_in,
+            buffer_size=test_set_size,
+            device=device,
+            sigma_tolerance=args.test_sigma_tolerance,
         )
 
-        buffer_valid = Buffer(
-            set_validate, splat_in, buffer_size=valid_set_size, device=device
+        buffer_valid = BufferCached(
+            set_validate,
+            splat_in,
+            buffer_size=valid_set_size,
+            device=device,
+            sigma_tolerance=args.test_sigma_tolerance,
         )
     else:
         raise ValueError("You must provide either fitspath or objpath argument.")
@@ -185,6 +196,9 @@ def init(args, device):
         max_trans=args.max_trans,
     ).to(device)
 
+    if args.compile:
+        compile_model(model)
+
     if args.poseonly:
         from util.plyobj import load_obj, load_ply
 
@@ -239,7 +253,10 @@ def init(args, device):
         optimiser,
     )
 
-    save_model(model, args.savedir + "/model.tar")
+    S.submit(ModelSaver(model), model.state_dict(), args.savedir + "/model.tar")
+    S.submit(
+        save_bundle, model.state_dict(), points, args, args.savedir + "/bundle.pt"
+    )
 
 
 if __name__ == "__main__":
@@ -306,6 +323,27 @@ if __name__ == "__main__":
         help="Save the stats of the training for later \
                           graphing.",
     )
+    parser.add_argument(
+        "--stats-backend",
+        default="remote",
+        choices=["remote", "sqlite"],
+        help="Where to store the stats - Redis/PostgreSQL or a local \
+                          stats.db file (default: remote).",
+    )
+    parser.add_argument(
+        "--async-write",
+        action="store_true",
+        default=False,
+        help="Write stats, images and checkpoints on a background thread \
+                          (default: False).",
+    )
+    parser.add_argument(
+        "--write-queue",
+        type=int,
+        default=64,
+        help="How many writes can wait on the background thread before \
+                          training blocks (default: 64).",
+    )
     parser.add_argument(
         "--no-cuda", action="store_true", default=False, help="disables CUDA training"
     )
@@ -392,6 +430,43 @@ if __name__ == "__main__":
         help="Adaptive learning rate (default: False)",
         required=False,
     )
+    parser.add_argument(
+        "--adapt-exact",
+        default=False,
+        action="store_true",
+        help="Use the optimal (Hungarian) point matching for the adaptive \
+            learning rate, rather than greedy nearest neighbour (default: False)",
+        required=False,
+    )
+    parser.add_argument(
+        "--converge-window",
+        type=int,
+        default=10,
+        help="How many log intervals back we compare the points against when \
+            checking for convergence (default: 10)",
+    )
+    parser.add_argument(
+        "--converge-threshold",
+        type=float,
+        default=0.001,
+        help="The aligned point distance, relative to the size of the structure, \
+            below which it counts as stable (default: 0.001)",
+    )
+    parser.add_argument(
+        "--converge-patience",
+        type=int,
+        default=3,
+        help="How many stable checks in a row before the structure has converged \
+            (default: 3)",
+    )
+    parser.add_argument(
+        "--converge-action",
+        default="none",
+        choices=["none", "stop", "shorten"],
+        help="What to do once the structure has converged - nothing, stop \
+            training or finish the sigma schedule by the end of the next epoch \
+            (default: none)",
+    )
     parser.add_argument(
         "--image-width",
         type=int,
@@ -475,6 +550,13 @@ if __name__ == "__main__":
         default=200,
         help="The size of the training set (default: 200)",
     )
+    parser.add_argument(
+        "--test-sigma-tolerance",
+        type=float,
+        default=0.0,
+        help="How far the sigma may drift before the test and validation \
+                          images are re-rendered (default: 0.0).",
+    )
     parser.add_argument(
         "--buffer-size",
         type=int,
@@ -482,11 +564,21 @@ if __name__ == "__main__":
         help="How big is the buffer in images? \
                           (default: 40000)",
     )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        default=False,
+        help="Compile the forward pass with torch.compile (default: False).",
+    )
     args = parser.parse_args()
 
     # Stats turn on
     if args.save_stats:
-        S.on(args.savedir)
+        S.on(args.savedir, backend=args.stats_backend)
+
+    # Move our file, database and checkpoint writing off the main thread
+    if args.async_write:
+        S.start_writer(args.write_queue)
 
     # Initial setup of PyTorch
     use_cuda = not args.no_cuda and torch.cuda.is_available()
@@ -0,0 +1,120 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+convergence.py - has the structure stopped changing, with the points
+now just rotating as a whole? This is the question train/icp_test.py
+answers after a run; here we answer it as we train.
+
+We keep a ring of recent snapshots of the points. The points are the
+same parameters from one snapshot to the next, so the correspondence
+is already known, and the best rigid alignment between two snapshots
+is a single 3x3 SVD (the Kabsch algorithm) - no ICP iterations needed.
+
+"""
+
+import torch
+from collections import deque
+from util.math import PointsTen
+
+
+def kabsch_distance(fixed: torch.Tensor, moved: torch.Tensor) -> torch.Tensor:
+    """
+    The RMSD between two sets of matched points once moved has been
+    rigidly aligned (rotated and translated) onto fixed, divided by the
+    RMS radius of fixed so the result doesn't depend on the scale of
+    the model.
+
+    Parameters
+    ----------
+    fixed : torch.Tensor
+        The (N, 3) fixed points.
+    moved : torch.Tensor
+        The (N, 3) moved points, row i matching row i of fixed.
+
+    Returns
+    -------
+    torch.Tensor
+        A single-element tensor.
+    """
+    p = fixed - fixed.mean(dim=0)
+    q = moved - moved.mean(dim=0)
+    (u, _, vh) = torch.linalg.svd(q.T @ p)
+    # Flip the last axis if we'd otherwise have a reflection
+    d = torch.sign(torch.linalg.det(u @ vh))
+    flip = torch.ones(3, dtype=p.dtype, device=p.device)
+    flip[2] = d
+    rot = (u * flip) @ vh
+    rmsd = ((q @ rot - p) ** 2).sum(dim=1).mean().sqrt()
+    radius = (p ** 2).sum(dim=1).mean().sqrt()
+    return rmsd / radius.clamp(min=1e-12)
+
+
+class ConvergenceMonitor(object):
+    """Watch the points during training, deciding when the structure
+    has converged."""
+
+    def __init__(self, window=10, threshold=0.001, patience=3):
+        """
+        Create our monitor.
+
+        Parameters
+        ----------
+        window : int
+            How many checks back we compare the current points against
+            (default: 10).
+        threshold : float
+            The aligned distance, relative to the size of the structure,
+            below which we count a check as stable (default: 0.001).
+        patience : int
+            How many stable checks in a row we need before we say the
+            structure has converged (default: 3).
+
+        Returns
+        -------
+        ConvergenceMonitor
+        """
+        assert window > 0 and patience > 0
+        self.window = window
+        self.threshold = threshold
+        self.patience = patience
+        self.snapshots = deque(maxlen=window)
+        self.distance = None
+        self.stable = 0
+
+    def update(self, points: PointsTen) -> bool:
+        """
+        Add the current points, returning whether we have converged.
+        Until the ring is full there is nothing to compare against and
+        the distance is None.
+
+        Parameters
+        ----------
+        points : PointsTen
+            The points being trained.
+
+        Returns
+        -------
+        bool
+        """
+        with torch.no_grad():
+            current = points.data[:, 0:3, 0].detach().clone()
+
+            if len(self.snapshots) == self.window:
+                self.distance = float(kabsch_distance(self.snapshots[0], current))
+
+                if self.distance < self.threshold:
+                    self.stable += 1
+                else:
+                    self.stable = 0
+
+            self.snapshots.append(current)
+
+        return self.converged
+
+    @property
+    def converged(self) -> bool:
+        return self.stable >= self.patience
@@ -5,17 +5,20 @@
 /_/ \___/_/   /___/\___/___/___/_/|_/\___/___/          # noqa
 Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
 
-icp_test.py - Using icp along with RMSD across the animation.json
-file in order to detect when the network has come up with a good
+icp_test.py - Using icp along with RMSD across the points.traj (or
+animation) file in order to detect when the network has come up with a good
 final structure and is merely rotating around what it has.
 
 """
 
 from typing import List
 import numpy as np
-import json
 import argparse
+import json
 import math
+import os
+import torch
+from multiprocessing import Pool
 from stats.simpleicp import (
     PointCloud,
     matching,
@@ -24,6 +27,9 @@ from stats.simpleicp import (
     check_convergence_criteria,
     create_homogeneous_transformation_matrix,
 )
+from stats.objs_to_json import load_animation
+from stats.trajectory import Trajectory
+from train.loss import match_distance
 from numba import jit
 import matplotlib.pyplot as plt
 
@@ -73,7 +79,7 @@ def icp(
 
                 break
 
-        return (pcfix, pcmov, H)
+    return (pcfix, pcmov, H)
 
 
 @jit(nopython=True)
@@ -106,49 +112,160 @@ def rmsd_score(fixed: List, moved: List):
     return total_dist
 
 
-def perform_icp(path):
-    models = []
-    scores = []
-
-    with open(path + "/objs/animation.json") as json_file:
-        animation = json.load(json_file)
-        obj = animation["frames"][0]
-        dirs = []
+def load_frames(path) -> np.ndarray:
+    """
+    Load the frames for the run in path. We read the binary trajectory,
+    points.traj, directly if there is one, falling back to the animation
+    exported from older runs (animation.bin, then animation.json).
 
-        for idx, vertex in enumerate(obj["vertices"]):
+    Parameters
+    ----------
+    path : str
+        The save directory of the run.
 
-            for v in animation["frames"]:
-                x = v["vertices"][idx]["x"]
-                y = v["vertices"][idx]["y"]
-                z = v["vertices"][idx]["z"]
-                dirs.append((x, y, z))
+    Returns
+    -------
+    np.ndarray
+        The (frames, points, 3) positions of the points.
+    """
+    if os.path.exists(os.path.join(path, "points.traj")):
+        return Trajectory(os.path.join(path, "points.traj")).points
 
-            models.append(np.array(dirs))
+    for name in ("animation.bin", "animation.json"):
+        anim_path = os.path.join(path, "objs", name)
 
-    dist = 10
+        if os.path.exists(anim_path):
+            return load_animation(anim_path)
 
-    for midx in range(dist, len(models), 1):
-        # Order seems to matter. No idea why?
-        pcfix, pcmov, _ = icp(models[midx], models[midx - dist])
+    raise FileNotFoundError("No points.traj or animation in " + path)
 
-        # Convert the clouds to something more handy
-        c0 = []
-        for i in range(len(pcfix.x)):
-            c0.append((pcfix.x[i], pcfix.y[i], pcfix.z[i]))
 
-        c1 = []
-        for i in range(len(pcmov.x)):
-            c1.append((pcmov.x[i], pcmov.y[i], pcmov.z[i]))
+def _pair_score(job):
+    """ Internal function. ICP then RMSD for one pair, in a worker."""
+    (i, j, fixed, moved, settings) = job
+    pcfix, pcmov, _ = icp(fixed, moved, **settings)
+    score = match_distance(
+        torch.from_numpy(pcfix.xyz()), torch.from_numpy(pcmov.xyz())
+    )
+    return (i, j, float(score))
+
+
+class PairCache(object):
+    """The scores for each (frame_i, frame_j) pair we've already done,
+    kept in a CSV file next to the run. The first line records what the
+    scores were computed from, and if that changes the cache is thrown
+    away."""
+
+    def __init__(self, path: str, header: str):
+        """
+        Open, and load, our cache.
+
+        Parameters
+        ----------
+        path : str
+            The path to the cache file.
+        header : str
+            A description of the frames and settings used.
+
+        Returns
+        -------
+        PairCache
+        """
+        self.path = path
+        self.scores = {}
+        header = "# " + header + "\n"
+        matched = False
+        complete = True
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                matched = f.readline() == header
+
+                if matched:
+                    for line in f:
+                        tokens = line.strip().split(",")
+                        complete = line.endswith("\n")
+
+                        # Skip a partial line from an interrupted run
+                        if complete and len(tokens) == 3:
+                            self.scores[(int(tokens[0]), int(tokens[1]))] = float(
+                                tokens[2]
+                            )
+
+        # Add to a matching cache rather than rewrite it, so an interrupted
+        # run can't lose the scores we already had
+        if matched:
+            self.f = open(path, "a")
+
+            if not complete:
+                self.f.write("\n")
+        else:
+            self.f = open(path, "w")
+            self.f.write(header)
+
+        self.f.flush()
+
+    def add(self, i: int, j: int, score: float):
+        self.scores[(i, j)] = score
+        self.f.write(str(i) + "," + str(j) + "," + repr(score) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def perform_icp(path, dist=10, workers=None, **settings):
+    """
+    Align each frame with the one dist frames before it and score how
+    far the points are from each other once aligned. Pairs are run
+    across a pool of processes and the scores cached in icp_pairs.csv in
+    the run directory, so running this again once training has moved on
+    only computes the new pairs.
+
+    Parameters
+    ----------
+    path : str
+        The save directory of the run.
+    dist : int
+        How many frames apart the pairs are (default: 10).
+    workers : int
+        The number of processes (default: None - one per cpu).
+    settings :
+        Passed on to icp, such as correspondences or neighbors.
+
+    Returns
+    -------
+    list
+        A list of (frame, score) tuples, in frame order.
+    """
+    frames = load_frames(path)
+    source = "animation"
+
+    if os.path.exists(os.path.join(path, "points.traj")):
+        source = "points.traj"
+
+    header = "source={} points={} settings={}".format(
+        source, frames.shape[1], json.dumps(settings, sort_keys=True)
+    )
+    cache = PairCache(os.path.join(path, "icp_pairs.csv"), header)
+    pairs = [(midx - dist, midx) for midx in range(dist, len(frames))]
+    # Order seems to matter. No idea why? The later frame is the fixed one.
+    jobs = (
+        (i, j, np.array(frames[j], dtype=np.float64),
+         np.array(frames[i], dtype=np.float64), settings)
+        for (i, j) in pairs
+        if (i, j) not in cache.scores
+    )
 
-        score = rmsd_score(c0, c1)
-        del c0
-        del c1
-        del pcfix
-        del pcmov
-        scores.append((midx, score))
-        print(midx, score)
+    try:
+        with Pool(processes=workers) as pool:
+            for (i, j, score) in pool.imap_unordered(_pair_score, jobs, chunksize=4):
+                cache.add(i, j, score)
+                print(j, score)
+    finally:
+        cache.close()
 
-    return scores
+    return [(j, cache.scores[(i, j)]) for (i, j) in pairs]
 
 
 if __name__ == "__main__":
@@ -160,8 +277,21 @@ if __name__ == "__main__":
     )
 
     # Initial setup of PyTorch
+    parser.add_argument(
+        "--dist",
+        type=int,
+        default=10,
+        help="How many frames apart to compare (default: 10)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes to use (default: one per cpu)",
+    )
+
     args = parser.parse_args()
-    scores = perform_icp(args.savedir)
+    scores = perform_icp(args.savedir, args.dist, args.workers)
     p = list(zip(*scores))
     plt.plot(p[0], p[1])
     plt.xlabel('Save Interval through training.')
@@ -17,8 +17,9 @@ from data.batcher import Batcher
 from util.math import PointsTen
 from util.image import NormaliseNull, NormaliseBasic
 from train.loss import calculate_loss, calculate_move_loss
+from train.convergence import ConvergenceMonitor
 import numpy as np
-from util.loadsave import save_checkpoint, save_model
+from util.loadsave import save_checkpoint, ModelSaver
 from stats import stats as S
 from net.net import Net
 from util.math import PointsTen
@@ -64,6 +65,46 @@ def cont_sigma(
     return new_sigma
 
 
+def short_sigma(
+    start: tuple,
+    end_epoch: int,
+    epoch: int,
+    batch_idx: int,
+    batches_epoch: int,
+    last: float,
+) -> float:
+    """
+    Once the structure has converged we can shorten what is left of the
+    sigma schedule, going straight from the current sigma to the last
+    one over the remaining steps.
+
+    Parameters
+    ----------
+    start : tuple
+        The (step, sigma) when we converged.
+    end_epoch : int
+        The epoch at which training will now stop.
+    epoch : int
+        The current epoch.
+    batch_idx : int
+        The current batch number
+    batches_epoch : int
+        The number of batches per epoch
+    last : float
+        The final sigma in the lookup.
+
+    Returns
+    -------
+    float
+        The sigma to use
+    """
+    (start_step, start_sigma) = start
+    end_step = end_epoch * batches_epoch
+    step = epoch * batches_epoch + batch_idx
+    progress = min(float(step - start_step) / max(end_step - start_step, 1), 1.0)
+    return start_sigma + ((last - start_sigma) * progress)
+
+
 def validate(
     args,
     model,
@@ -120,6 +161,62 @@ def validate(
     return valid_loss
 
 
+def save(
+    save_model: ModelSaver,
+    args,
+    model: Net,
+    points: PointsTen,
+    optimiser,
+    epoch: int,
+    batch_idx: int,
+    loss,
+    sigma: float,
+):
+    """
+    Save model.tar and the checkpoint, on the writer thread if we have
+    one. Only the weights and the optimiser state are handed over.
+
+    Parameters
+    ----------
+    save_model : ModelSaver
+        Writes model.tar from the weights.
+    args : dict
+        The arguments object created in the __main__ function.
+    model : nn.Module
+        Our network.
+    points : PointsTen
+        The points so far.
+    optimiser : torch.optim.Optimizer
+        The optimiser.
+    epoch : int
+        The current epoch.
+    batch_idx : int
+        The current batch number.
+    loss :
+        The current loss.
+    sigma : float
+        The current sigma.
+
+    Returns
+    -------
+    None
+    """
+    S.submit(save_model, model.state_dict(), args.savedir + "/model.tar")
+    S.submit(
+        save_checkpoint,
+        model.state_dict(),
+        points,
+        optimiser.state_dict(),
+        epoch,
+        batch_idx,
+        loss,
+        sigma,
+        args,
+        args.savedir,
+        args.savename,
+    )
+
+
 def train(
     args,
     device,
@@ -162,6 +259,9 @@ def train(
 
     model.train()
 
+    # Saves model.tar from the weights alone, on the writer thread
+    save_model = ModelSaver(model)
+
     # Set a lower limit on the lr, with a lower one on the plr. Factor is less harsh.
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(
         optimiser,
@@ -187,8 +287,19 @@ def train(
     # Keep a copy of the points so we can test for a good structure
     prev_points = points.clone()
 
+    # Watch for the structure settling down, so we can stop early
+    monitor = ConvergenceMonitor(
+        window=args.converge_window,
+        threshold=args.converge_threshold,
+        patience=args.converge_patience,
+    )
+    shortened = None
+    end_epoch = args.epochs
+
     # Begin the epochs and training
     for epoch in range(args.epochs):
+        if epoch >= end_epoch:
+            break
 
         # Now begin proper
         print("Starting Epoch", epoch)
@@ -206,7 +317,19 @@ def train(
             loss.backward()
             lossy = loss.item()
             optimiser.step()
-            sigma = cont_sigma(args, epoch, batch_idx, len(batcher), sigma_lookup)
+
+            if shortened is None:
+                sigma = cont_sigma(args, epoch, batch_idx, len(batcher), sigma_lookup)
+            else:
+                sigma = short_sigma(
+                    shortened,
+                    end_epoch,
+                    epoch,
+                    batch_idx,
+                    len(batcher),
+                    sigma_lookup[-1],
+                )
+
             data_loader.set_sigma(sigma)
 
             # We save here because we want our first step to be untrained
@@ -221,6 +344,13 @@ def train(
                     S.watch(ddata.rotations, "rotations_in_train")
                     S.watch(model.get_render_params(), "rotations_out_train")
 
+                # Has the structure settled, with the points just rotating?
+                monitor.update(points)
+
+                if monitor.distance is not None:
+                    S.watch(monitor.distance, "convergence_distance")
+                    S.watch(int(monitor.converged), "converged")
+
                 print(
                     "Train Epoch: \
                     {} [{}/{} ({:.0f}%)]\tLoss Main: {:.6f}".format(
@@ -233,17 +363,47 @@ def train(
                 )
 
                 if args.save_stats:
+                    if args.async_write:
+                        metrics = S.writer_metrics()
+                        S.watch(metrics["depth"], "writer_depth")
+                        S.watch(metrics["blocked_time"], "writer_blocked_time")
+
                     test(args, model, buffer_test, epoch, batch_idx, points, sigma)
                     S.save_points(points, args.savedir, epoch, batch_idx)
                     S.update(epoch, buffer_train.set.size, args.batch_size, batch_idx)
 
+                if monitor.converged and args.converge_action != "none":
+                    if args.converge_action == "stop":
+                        print("Structure has converged - stopping", epoch, batch_idx)
+                        # Save now, or the checkpoint lags behind model.tar
+                        save(
+                            save_model,
+                            args,
+                            model,
+                            points,
+                            optimiser,
+                            epoch,
+                            batch_idx,
+                            loss,
+                            sigma,
+                        )
+                        break
+
+                    if shortened is None:
+                        # Finish off the sigma schedule by the end of the next epoch
+                        print("Structure has converged - shortening", epoch, batch_idx)
+                        shortened = (epoch * len(batcher) + batch_idx, sigma)
+                        end_epoch = min(end_epoch, epoch + 2)
+
             steps = batch_idx + (epoch * (buffer_train.set.size / args.batch_size))
 
             if steps % args.pinterval == 0 and args.adapt:
                 # Now attempt to see if we have a good model
                 # Calculate the move loss and adjust the learning rate on the points accordingly
                 # We need a window of at least 10 steps at log interval 100.
-                move_loss = calculate_move_loss(prev_points, points)
+                move_loss = calculate_move_loss(
+                    prev_points, points, exact=args.adapt_exact
+                )
                 scheduler.step(move_loss)
                 S.watch(move_loss, "move_loss")
                 new_plr = optimiser.param_groups[1]["lr"]
@@ -257,9 +417,9 @@ def train(
 
             if batch_idx % args.save_interval == 0:
                 print("saving checkpoint", batch_idx, epoch)
-                save_model(model, args.savedir + "/model.tar")
-
-                save_checkpoint(
+                save(
+                    save_model,
+                    args,
                     model,
                     points,
                     optimiser,
@@ -267,13 +427,13 @@ def train(
                     batch_idx,
                     loss,
                     sigma,
-                    args,
-                    args.savedir,
-                    args.savename,
                 )
 
         buffer_train.set.shuffle()
 
+        if monitor.converged and args.converge_action == "stop":
+            break
+
     # Save a final points file once training is complete
     S.save_points(points, args.savedir, epoch, batch_idx)
     return points
@@ -10,9 +10,13 @@ deal with checkpoints.
 
 """
 
+import argparse
 import torch
 import torch.optim as optim
 
+BUNDLE_FORMAT = "holly-bundle"
+BUNDLE_VERSION = 1
+
 
 def save_checkpoint(
     model, points, optimiser, epoch, batch_idx, loss, sigma, args, savedir, savename
@@ -25,11 +29,11 @@ def save_checkpoint(
     Parameters
     ----------
     model : NN.module
-        The model
+        The model, or its state_dict
     points : torch.tensor
         The points the network has derived
     optimiser :
-        The optimiser used by the training function.
+        The optimiser used by the training function, or its state_dict.
     epoch : int
         The epoch we have reached
     batch_idx : int
@@ -50,16 +54,23 @@ def save_checkpoint(
     None
 
     """
+    # Passing state_dicts lets the caller snapshot them for a
+    # background save, as the model and optimiser keep changing.
+    if hasattr(model, "state_dict"):
+        model = model.state_dict()
+
+    if hasattr(optimiser, "state_dict"):
+        optimiser = optimiser.state_dict()
 
     torch.save(
         {
             "epoch": epoch,
-            "model_state_dict": model.state_dict(),
+            "model_state_dict": model,
             "points": points,
             "batch_idx": batch_idx,
             "sigma": sigma,
             "args": args,
-            "optimiser_state_dict": optimiser.state_dict(),
+            "optimiser_state_dict": optimiser,
             "loss": loss,
         },
         savedir + "/" + savename,
@@ -85,6 +96,48 @@ def save_model(model, path):
     torch.save(model, path)
 
 
+class ModelSaver(object):
+    """Saves the model file from state_dicts. It keeps a CPU copy of
+    the model, taken once, to load each state_dict into, so the training
+    loop need only hand over the weights - a cheap snapshot for the
+    background writer - rather than the whole module."""
+
+    def __init__(self, model):
+        """
+        Take our copy of the model.
+
+        Parameters
+        ----------
+        model : NN.module
+            The model
+
+        Returns
+        -------
+        ModelSaver
+        """
+        from stats.writer import snapshot
+
+        self.model = snapshot(model)
+
+    def __call__(self, state_dict: dict, path: str):
+        """
+        Save the model with these weights.
+
+        Parameters
+        ----------
+        state_dict : dict
+            The weights, from model.state_dict()
+        path : str
+            The path (including file name)
+
+        Returns
+        -------
+        None
+        """
+        self.model.load_state_dict(state_dict)
+        save_model(self.model, path)
+
+
 def load_checkpoint(
     model, savedir, savename, device="cpu"
 ):
@@ -108,7 +161,10 @@ def load_checkpoint(
 
     """
 
-    checkpoint = torch.load(savedir + "/" + savename, map_location=device)
+    # Our checkpoints pickle the args and points, so need a full unpickle
+    checkpoint = torch.load(
+        savedir + "/" + savename, map_location=device, weights_only=False
+    )
     model.load_state_dict(checkpoint["model_state_dict"])
 
     # this line seems to fail things :/
@@ -159,4 +215,98 @@ def load_model(path, device="cpu"):
     None
 
     """
-    return torch.load(path, map_location=device)
+    return torch.load(path, map_location=device, weights_only=False)
+
+
+def save_bundle(model, points, args, path):
+    """
+    Save just what inference needs - the weights, the points and the
+    few settings that shape the model - as plain tensors and numbers.
+    Unlike model.tar and the checkpoint, this loads without unpickling
+    any of our classes and without the optimiser state.
+
+    Parameters
+    ----------
+    model : NN.module
+        The model, or its state_dict
+    points : PointsTen
+        The points the network has derived, or their tensor
+    args : args object
+        The args object this model was trained with. It must have
+        image_height, image_width, normalise_basic, max_trans and
+        batch_size.
+    path : str
+        The path (including file name)
+
+    Returns
+    -------
+    None
+
+    """
+    if hasattr(model, "state_dict"):
+        model = model.state_dict()
+
+    if hasattr(points, "data"):
+        points = points.data
+
+    # No defaults here - a bundle with the wrong image size or shift
+    # would load happily and then give poor poses.
+    settings = {
+        "image_height": int(args.image_height),
+        "image_width": int(args.image_width),
+        "normalise_basic": bool(args.normalise_basic),
+        "max_trans": float(args.max_trans),
+        "batch_size": int(args.batch_size),
+    }
+
+    torch.save(
+        {
+            "format": BUNDLE_FORMAT,
+            "version": BUNDLE_VERSION,
+            "model_state_dict": {
+                k: v.detach().cpu().contiguous() for (k, v) in model.items()
+            },
+            "points": points.detach().cpu().contiguous(),
+            "settings": settings,
+        },
+        path,
+    )
+
+
+def load_bundle(path, device="cpu"):
+    """
+    Load a bundle written by save_bundle. The file is memory-mapped and
+    only tensors and plain values are allowed out of it.
+
+    Parameters
+    ----------
+    path : str
+        The path (including file name)
+    device : str
+        The device we are using, CUDA or cpu
+
+    Returns
+    -------
+    tuple
+        The model (in eval mode), the points as a PointsTen and the
+        settings, as an args-like namespace.
+
+    """
+    from net.net import Net
+    from net.renderer import Splat
+    from util.math import PointsTen
+
+    bundle = torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    assert bundle.get("format") == BUNDLE_FORMAT, path + " is not a bundle"
+    assert bundle["version"] == BUNDLE_VERSION, "Unknown bundle version"
+
+    args = argparse.Namespace(**bundle["settings"])
+    splat = Splat(size=(args.image_height, args.image_width), device=device)
+    model = Net(splat, max_trans=args.max_trans)
+    # Take the mapped tensors as they are, rather than copying them in
+    model.load_state_dict(bundle["model_state_dict"], assign=True)
+    model = model.to(device)
+    model.eval()
+
+    points = PointsTen(device=device).from_tensor(bundle["points"].to(device))
+    return (model, points, args)
@@ -12,6 +12,7 @@ pipeline and a few other places.
 
 from array import array
 import math
+import numpy as np
 import torch
 import random
 from pyquaternion import Quaternion
@@ -55,7 +56,10 @@ def vec_to_quat(rv):
 
 
 class Point:
-    """ A point for rendering."""
+    """A point for rendering. A Point taken from a Points is a view
+    onto its row of the array, so changing it changes the Points."""
+
+    __slots__ = ("_v",)
 
     def __init__(self, x: float, y: float, z: float, w=1.0):
         """
@@ -73,10 +77,57 @@ class Point:
         -------
         self
         """
-        self.x = x
-        self.y = y
-        self.z = z
-        self.w = w
+        self._v = np.array([x, y, z, w], dtype=np.float64)
+
+    @classmethod
+    def view(cls, row: np.ndarray):
+        """
+        Create a Point that views a row of 4 values, without copying.
+
+        Parameters
+        ----------
+        row : np.ndarray
+            x, y, z then w.
+
+        Returns
+        -------
+        Point
+        """
+        p = cls.__new__(cls)
+        p._v = row
+        return p
+
+    @property
+    def x(self) -> float:
+        return float(self._v[0])
+
+    @x.setter
+    def x(self, value: float):
+        self._v[0] = value
+
+    @property
+    def y(self) -> float:
+        return float(self._v[1])
+
+    @y.setter
+    def y(self, value: float):
+        self._v[1] = value
+
+    @property
+    def z(self) -> float:
+        return float(self._v[2])
+
+    @z.setter
+    def z(self, value: float):
+        self._v[2] = value
+
+    @property
+    def w(self) -> float:
+        return float(self._v[3])
+
+    @w.setter
+    def w(self, value: float):
+        self._v[3] = value
 
     def as_list(self):
         """
@@ -101,10 +152,10 @@ class Point:
 
 
 class Points:
-    """A collection of points in a list. Mostly used
-    to convert into a particular format of Tensor
-    for use in the network proper - PointsTen - and to
-    enforce types to allow type checking."""
+    """A collection of points, held as an (N, 4) float32 array of
+    x, y, z and w. Mostly used to convert into a particular format of
+    Tensor for use in the network proper - PointsTen - and to enforce
+    types to allow type checking."""
 
     def __init__(self, size=0):
         """
@@ -120,12 +171,57 @@ class Points:
         -------
         self
         """
-        self.data = []
+        self._data = np.zeros((size, 4), dtype=np.float32)
+        self._data[:, 3] = 1.0
         self.size = size
-        for _ in range(size):
-            self.data.append(Point(0.0, 0.0, 0.0, 1.0))
         self.counter = 0
 
+    @property
+    def data(self) -> np.ndarray:
+        """ The (N, 4) array of points."""
+        return self._data[0:self.size]
+
+    def _extend(self, rows: np.ndarray):
+        """ Internal function. Add an (M, 4) array of points."""
+        if self.size == 0:
+            # Take the array as it is, so from_array doesn't copy
+            self._data = rows
+        else:
+            if self.size + len(rows) > len(self._data):
+                grown = np.empty(
+                    (max(2 * len(self._data), self.size + len(rows)), 4),
+                    dtype=np.float32,
+                )
+                grown[0:self.size] = self.data
+                self._data = grown
+
+            self._data[self.size:self.size + len(rows)] = rows
+
+        self.size += len(rows)
+        return self
+
+    def from_array(self, data: np.ndarray):
+        """
+        Create our points from an (N, 3) or (N, 4) array. A float32
+        (N, 4) array is used as is, without copying.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            x, y, z and optionally w. If w is missing it is set to 1.
+
+        Returns
+        -------
+        self
+        """
+        data = np.asarray(data)
+
+        if data.ndim == 2 and data.shape[1] == 3:
+            data = np.hstack((data, np.ones((len(data), 1), dtype=data.dtype)))
+
+        assert data.ndim == 2 and data.shape[1] == 4
+        return self._extend(np.ascontiguousarray(data, dtype=np.float32))
+
     def from_iterable(self, data):
         """
         Create our points but from something in a list of
@@ -140,11 +236,9 @@ class Points:
         -------
         self
         """
-        for d in data:
-            assert len(d) == 4
-            p = Point(d[0], d[1], d[2], d[3])
-            self.append(p)
-        return self
+        data = np.asarray(data, dtype=np.float32).reshape(len(data), -1)
+        assert data.shape[1] == 4
+        return self._extend(data)
 
     def from_chunk(self, data):
         """
@@ -158,10 +252,7 @@ class Points:
         -------
         self
         """
-        for i in range(0, len(data), 4):
-            p = Point(data[i], data[i + 1], data[i + 2], data[i + 3])
-            self.append(p)
-        return self
+        return self._extend(np.asarray(data, dtype=np.float32).reshape(-1, 4))
 
     def get_iterable(self):
         """
@@ -176,10 +267,7 @@ class Points:
         List
             A list of size 4 tuples
         """
-        vertices = []
-        for p in self.data:
-            vertices.append((p.x, p.y, p.z, p.w))
-        return vertices
+        return [tuple(p) for p in self.data.tolist()]
 
     def get_chunk(self):
         """
@@ -194,13 +282,7 @@ class Points:
         List
             A 1D list of all the points
         """
-        vertices = []
-        for p in self.data:
-            vertices.append(p.x)
-            vertices.append(p.y)
-            vertices.append(p.z)
-            vertices.append(p.w)
-        return vertices
+        return self.data.reshape(-1).tolist()
 
     def append(self, point: Point):
         """
@@ -214,9 +296,7 @@ class Points:
         -------
         self
         """
-        self.data.append(point)
-        self.size = len(self.data)
-        return self
+        return self._extend(np.asarray(point._v, dtype=np.float32).reshape(1, 4))
 
     def to_ten(self, device="cpu"):
         """
@@ -231,19 +311,10 @@ class Points:
         self
 
         """
-        tp = []
-        for p in self.data:
-            ttp = []
-            ttp.append([p.x])
-            ttp.append([p.y])
-            ttp.append([p.z])
-            ttp.append([p.w])
-            tp.append(ttp)
-        tten = torch.tensor(tp, dtype=torch.float32, device=device)
-        return PointsTen().from_tensor(tten)
+        return PointsTen(device=device).from_points(self)
 
     def to_array(self) -> array:
-        return array('d', self.get_chunk())
+        return array('d', self.data.astype(np.float64).tobytes())
 
     def __next__(self) -> Point:
         if self.counter >= self.size:
@@ -255,18 +326,21 @@ class Points:
             return rval
 
     def __len__(self) -> int:
-        return len(self.data)
+        return self.size
 
     def __iter__(self):
         return self
 
     def __getitem__(self, idx) -> Point:
-        return self.data[idx]
-    
+        if isinstance(idx, slice):
+            return [Point.view(row) for row in self.data[idx]]
+
+        return Point.view(self.data[idx])
+
     def __str__(self):
         s = ""
-        for p in self.data:
-            s += p.__str__() + "\n"
+        for p in self.get_iterable():
+            s += ", ".join(str(v) for v in p) + "\n"
         return s
 
 
@@ -410,17 +484,8 @@ class VecRot:
             a new list of rotated points
 
         """
-        new_points = Points()
-        m = self.get_mat()
-        for p in points:
-            np = Point(
-                m[0][0] * p.x + m[0][1] * p.y + m[0][2] * p.z + m[0][3] * p.w,
-                m[1][0] * p.x + m[1][1] * p.y + m[1][2] * p.z + m[1][3] * p.w,
-                m[2][0] * p.x + m[2][1] * p.y + m[2][2] * p.z + m[2][3] * p.w,
-                p.w
-            )
-            new_points.append(np)
-        return new_points
+        m = np.array(self.get_mat(), dtype=np.float32)
+        return Points().from_array(points.data @ m.T)
 
     def to_ten(self, device="cpu"):
         """
@@ -556,6 +621,21 @@ class VecRotTen:
         """
         return [self.x, self.y, self.z]
 
+    def to_quaternion(self) -> torch.Tensor:
+        """
+        Convert to a unit quaternion (w, x, y, z).
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        torch.Tensor
+            The (4) quaternion.
+        """
+        return VecRotTenBatch.from_list([self]).to_quaternions()[0]
+
     def random(self):
         """
         Generate a random rotation, sampled uniformly from SO(3). This is
@@ -648,6 +728,374 @@ class TransTen:
         self.y = y
 
 
+class VecRotTenBatch:
+    """A batch of rotations as a single (B, 3) tensor of rotation
+    vectors. Indexing gives a VecRotTen that views one row, so the
+    single-sample code keeps working (and gradients still flow)."""
+
+    def __init__(self, data: torch.Tensor):
+        """
+        Create our batch.
+
+        Parameters
+        ----------
+        data : torch.Tensor
+            of shape (B, 3), or anything that reshapes to it.
+
+        Returns
+        -------
+        self
+        """
+        self.data = data.reshape(-1, 3)
+
+    @classmethod
+    def from_list(cls, rots: list):
+        """
+        Create our batch from a list of VecRotTen.
+
+        Parameters
+        ----------
+        rots : list
+            VecRotTen, each with tensors of shape [1] (or single values).
+
+        Returns
+        -------
+        VecRotTenBatch
+        """
+        return cls(
+            torch.stack(
+                [
+                    torch.cat([r.x.reshape(1), r.y.reshape(1), r.z.reshape(1)])
+                    for r in rots
+                ]
+            )
+        )
+
+    @classmethod
+    def random(cls, size: int, device="cpu"):
+        """
+        A batch of random rotations, sampled uniformly from SO(3) as
+        VecRotTen.random does, but all at once.
+
+        Parameters
+        ----------
+        size : int
+            How many rotations.
+        device : str
+            The device for the tensor. Default - cpu.
+
+        Returns
+        -------
+        VecRotTenBatch
+        """
+        (u1, u2, u3) = torch.rand(3, size, dtype=torch.float64)
+        q = torch.stack(
+            (
+                torch.sqrt(1.0 - u1) * torch.sin(2.0 * math.pi * u2),
+                torch.sqrt(1.0 - u1) * torch.cos(2.0 * math.pi * u2),
+                torch.sqrt(u1) * torch.sin(2.0 * math.pi * u3),
+                torch.sqrt(u1) * torch.cos(2.0 * math.pi * u3),
+            ),
+            dim=1,
+        )
+        return cls.from_quaternions(q, device=device)
+
+    @classmethod
+    def from_quaternions(cls, q: torch.Tensor, device=None):
+        """
+        Create our batch from unit quaternions (w, x, y, z).
+
+        Parameters
+        ----------
+        q : torch.Tensor
+            The (B, 4) quaternions.
+        device : str
+            The device for the tensor. Default - that of q.
+
+        Returns
+        -------
+        VecRotTenBatch
+        """
+        # q and -q are the same rotation - take the one with an angle <= pi
+        q = torch.where(q[:, 0:1] < 0, -q, q)
+        (w, v) = (q[:, 0], q[:, 1:4])
+        norm = torch.linalg.norm(v, dim=1)
+        angle = 2.0 * torch.atan2(norm, w)
+        rod = v * (angle / norm.clamp(min=1e-12)).unsqueeze(1)
+        return cls(rod.to(dtype=torch.float32, device=device or q.device))
+
+    def get_length(self) -> torch.Tensor:
+        """
+        Return the lengths and therefore the angles.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        torch.Tensor
+            The (B) lengths.
+        """
+        return torch.linalg.norm(self.data, dim=1)
+
+    def get_angle(self):
+        return self.get_length()
+
+    def get_normalised(self) -> torch.Tensor:
+        """
+        Return the normalised rotation axes.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        torch.Tensor
+            The (B, 3) axes.
+        """
+        return self.data / self.get_length().unsqueeze(1)
+
+    def to_quaternions(self) -> torch.Tensor:
+        """
+        Convert to unit quaternions, in the w, x, y, z order that
+        pyquaternion uses. A zero rotation gives the identity.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        torch.Tensor
+            The (B, 4) quaternions.
+        """
+        angle = self.get_length()
+        half = angle / 2.0
+        # sin(a/2) / a, without dividing by zero for the zero rotation
+        scale = torch.where(
+            angle > 1e-8,
+            torch.sin(half) / angle.clamp(min=1e-8),
+            0.5 - angle ** 2 / 48,
+        )
+        return torch.cat(
+            (torch.cos(half).unsqueeze(1), self.data * scale.unsqueeze(1)), dim=1
+        )
+
+    def as_list(self) -> list:
+        """
+        Return the rotations as a list of VecRotTen.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+        """
+        return [self[i] for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return int(self.data.shape[0])
+
+    def __iter__(self):
+        return iter(self.as_list())
+
+    def __getitem__(self, idx) -> VecRotTen:
+        return VecRotTen(
+            self.data[idx, 0:1], self.data[idx, 1:2], self.data[idx, 2:3]
+        )
+
+
+def quat_slerp(q0: torch.Tensor, q1: torch.Tensor, amount: torch.Tensor):
+    """
+    Spherical linear interpolation between batches of unit quaternions,
+    taking the shorter path as pyquaternion's slerp does.
+
+    Parameters
+    ----------
+    q0 : torch.Tensor
+        The (B, 4) starting quaternions.
+    q1 : torch.Tensor
+        The (B, 4) ending quaternions.
+    amount : torch.Tensor
+        The (B) amounts, from 0 (q0) to 1 (q1).
+
+    Returns
+    -------
+    torch.Tensor
+        The (B, 4) interpolated quaternions.
+    """
+    dot = (q0 * q1).sum(dim=1, keepdim=True)
+    q1 = torch.where(dot < 0, -q1, q1)
+    dot = dot.abs().clamp(max=1.0)
+    theta = torch.acos(dot)
+    sin_theta = torch.sin(theta)
+    amount = amount.reshape(-1, 1).to(q0.dtype)
+    # Close quaternions would divide by zero, so lerp those instead
+    close = sin_theta < 1e-6
+    safe = torch.where(close, torch.ones_like(sin_theta), sin_theta)
+    w0 = torch.where(close, 1.0 - amount, torch.sin((1.0 - amount) * theta) / safe)
+    w1 = torch.where(close, amount, torch.sin(amount * theta) / safe)
+    q = w0 * q0 + w1 * q1
+    return q / torch.linalg.norm(q, dim=1, keepdim=True)
+
+
+def quat_distances(q0: torch.Tensor, q1: torch.Tensor) -> torch.Tensor:
+    """
+    The qdist between every quaternion in q0 and every quaternion in
+    q1 - the smaller of |a - b| and |a + b|, as q and -q are the same
+    rotation.
+
+    Parameters
+    ----------
+    q0 : torch.Tensor
+        The (B0, 4) unit quaternions.
+    q1 : torch.Tensor
+        The (B1, 4) unit quaternions.
+
+    Returns
+    -------
+    torch.Tensor
+        The (B0, B1) distances.
+    """
+    # |a - b|^2 = 2 - 2 a.b for unit quaternions
+    dots = (q0 @ q1.T).abs().clamp(max=1.0)
+    return torch.sqrt(2.0 - 2.0 * dots)
+
+
+def rotation_tour(rots: VecRotTenBatch, passes=0) -> list:
+    """
+    Order rotations so that each is close to the one before, for
+    smooth sweeps. We start at the first rotation and greedily take the
+    nearest one left, as eval.py used to do pair by pair. Passes of
+    2-opt then reverse any stretch of the tour that makes it shorter.
+
+    Parameters
+    ----------
+    rots : VecRotTenBatch
+        The rotations to order.
+    passes : int
+        The most 2-opt passes to make over the tour (default: 0).
+
+    Returns
+    -------
+    list
+        The indices of rots, in order.
+    """
+    q = rots.to_quaternions().detach().to(dtype=torch.float64, device="cpu")
+    n = q.shape[0]
+
+    if n < 3:
+        return list(range(n))
+
+    # Greedy nearest neighbour - one row of distances per step
+    visited = torch.zeros(n, dtype=torch.bool)
+    tour = torch.zeros(n, dtype=torch.long)
+    visited[0] = True
+
+    for step in range(1, n):
+        dists = quat_distances(q[tour[step - 1]].unsqueeze(0), q).squeeze(0)
+        dists[visited] = math.inf
+        tour[step] = torch.argmin(dists)
+        visited[tour[step]] = True
+
+    # 2-opt on the open path, keeping the start where it is. Reversing
+    # tour[i + 1 : j + 1] swaps edges (i, i+1) and (j, j+1) for (i, j)
+    # and (i+1, j+1). The last rotation has no edge after it.
+    for _ in range(passes):
+        improved = False
+
+        for i in range(n - 2):
+            path = q[tour]
+            (a, b) = (path[i : i + 1], path[i + 1 : i + 2])
+            c = path[i + 2 :]
+            after = torch.cat((path[i + 3 :], path[n - 1 :]))
+            has_after = torch.ones(c.shape[0], dtype=torch.float64)
+            has_after[-1] = 0.0
+            edges = (c * after).sum(dim=1).abs().clamp(max=1.0)
+            gain = (
+                quat_distances(a, b)[0]
+                + torch.sqrt(2.0 - 2.0 * edges) * has_after
+                - quat_distances(a, c)[0]
+                - quat_distances(b, after)[0] * has_after
+            )
+            best = int(torch.argmax(gain))
+
+            if gain[best] > 1e-9:
+                j = i + 2 + best
+                tour[i + 1 : j + 1] = tour[i + 1 : j + 1].flip(0)
+                improved = True
+
+        if not improved:
+            break
+
+    return tour.tolist()
+
+
+class TransTenBatch:
+    """A batch of translations as a single (B, 2) tensor. Indexing
+    gives a TransTen that views one row."""
+
+    def __init__(self, data: torch.Tensor):
+        """
+        Create our batch.
+
+        Parameters
+        ----------
+        data : torch.Tensor
+            of shape (B, 2), or anything that reshapes to it.
+
+        Returns
+        -------
+        self
+        """
+        self.data = data.reshape(-1, 2)
+
+    @classmethod
+    def from_list(cls, trans: list):
+        """
+        Create our batch from a list of TransTen.
+
+        Parameters
+        ----------
+        trans : list
+            TransTen, each with tensors of shape [1] (or single values).
+
+        Returns
+        -------
+        TransTenBatch
+        """
+        return cls(
+            torch.stack([torch.cat([t.x.reshape(1), t.y.reshape(1)]) for t in trans])
+        )
+
+    def as_list(self) -> list:
+        """
+        Return the translations as a list of TransTen.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+        """
+        return [self[i] for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return int(self.data.shape[0])
+
+    def __iter__(self):
+        return iter(self.as_list())
+
+    def __getitem__(self, idx) -> TransTen:
+        return TransTen(self.data[idx, 0:1], self.data[idx, 1:2])
+
+
 class Mask:
     """ Our mask for points."""
 
@@ -725,7 +1173,8 @@ class PointsTen:
 
     def from_points(self, points):
         """
-        Create our PointsTen from a Points instance
+        Create our PointsTen from a Points instance. On the cpu, the
+        tensor shares the memory of the Points array rather than copying.
 
         Parameters
         ----------
@@ -736,15 +1185,11 @@ class PointsTen:
         self
 
         """
-        tp = []
-        for p in points:
-            ttp = []
-            ttp.append([p.x])
-            ttp.append([p.y])
-            ttp.append([p.z])
-            ttp.append([p.w])
-            tp.append(ttp)
-        self.data = torch.tensor(tp, dtype=torch.float32, device=self.device)
+        if not isinstance(points, Points):
+            points = Points().from_iterable([p.as_list() for p in points])
+
+        data = torch.from_numpy(np.ascontiguousarray(points.data))
+        self.data = data.reshape(len(points), 4, 1).to(self.device)
         return self
 
     def from_tensor(self, t: torch.Tensor):
@@ -769,7 +1214,8 @@ class PointsTen:
 
     def get_points(self) -> Points:
         """
-        Return a Points from this tensor
+        Return a Points from this tensor. On the cpu, and if w is 1
+        throughout, the Points shares the memory of the tensor.
 
         Parameters
         ----------
@@ -780,14 +1226,13 @@ class PointsTen:
             A points class
 
         """
-        vertices = []
-        for i in range(self.data.shape[0]):
-            vertices.append((float(self.data[i][0][0]),
-                             float(self.data[i][1][0]),
-                             float(self.data[i][2][0]), 1.0))
+        vertices = self.data.detach().reshape(-1, 4).cpu().numpy()
+
+        if not (vertices[:, 3] == 1.0).all():
+            vertices = vertices.copy()
+            vertices[:, 3] = 1.0
 
-        points = Points().from_iterable(vertices)
-        return points
+        return Points().from_array(vertices)
 
 
 def mat_to_rod(mat: torch.Tensor) -> tuple:
@@ -1144,6 +1589,77 @@ def gen_mat_from_rod(a: VecRotTen) -> torch.Tensor:
     return rot_mat
 
 
+def gen_mats_from_rods(rods: torch.Tensor) -> torch.Tensor:
+    """
+    Generate rotation matrices from a batch of Rodrigues vectors, as
+    gen_mat_from_rod does for one. The zero rotation gets the same
+    small epsilon, but through torch.where rather than an if, so there
+    are no data-dependent branches and torch.compile can trace it.
+
+    Parameters
+    ----------
+    rods : torch.Tensor
+        The (B, 3) Rodrigues vectors.
+
+    Returns
+    -------
+    torch.Tensor
+       The (B, 4, 4) rotation matrices.
+    """
+    zero = (rods == 0).all(dim=1, keepdim=True)
+    rods = torch.where(zero, rods + 1e-3, rods)
+    theta = torch.sqrt(torch.sum(rods ** 2, dim=1))
+    (x, y, z) = (rods / theta.unsqueeze(1)).unbind(dim=1)
+    t_cos = torch.cos(theta)
+    t_sin = torch.sin(theta)
+    m_cos = 1.0 - t_cos
+    zeros = torch.zeros_like(theta)
+    ones = torch.ones_like(theta)
+
+    rot_mat = torch.stack(
+        (
+            x * x * m_cos + t_cos,
+            x * y * m_cos - z * t_sin,
+            x * z * m_cos + y * t_sin,
+            zeros,
+            y * x * m_cos + z * t_sin,
+            y * y * m_cos + t_cos,
+            y * z * m_cos - x * t_sin,
+            zeros,
+            z * x * m_cos - y * t_sin,
+            z * y * m_cos + x * t_sin,
+            z * z * m_cos + t_cos,
+            zeros,
+            zeros,
+            zeros,
+            zeros,
+            ones,
+        ),
+        dim=1,
+    )
+    return rot_mat.reshape(-1, 4, 4)
+
+
+def gen_trans_xys(trans: torch.Tensor) -> torch.Tensor:
+    """
+    Generate translation matrices in x and y for a batch, as
+    gen_trans_xy does for one.
+
+    Parameters
+    ----------
+    trans : torch.Tensor
+        The (B, 2) translations.
+
+    Returns
+    -------
+    torch.Tensor
+       The (B, 4, 4) translation matrices.
+    """
+    # Pad the translations out to the last column of a 4x4
+    offsets = torch.nn.functional.pad(trans.reshape(-1, 2, 1), (3, 0, 0, 2))
+    return torch.eye(4, dtype=trans.dtype, device=trans.device) + offsets
+
+
 def gen_rot_rod_single(sx: torch.Tensor) -> torch.Tensor:
     """
     Generate a rotation matrix from a (4,1) shape tensor.
@@ -11,42 +11,155 @@ TODO - merge with util_points as there is a bit of
 overlap here and there.
 
 """
+import numpy as np
 from util.math import Points, Point
 
-
-def save_ply(path, vertices):
+# The PLY property types and their numpy equivalents
+_PLY_TYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
+}
+
+
+def _as_vertices(vertices) -> np.ndarray:
+    """ Internal function. Anything with at least 3 columns to (N, 3) float32."""
+    vertices = np.asarray(vertices, dtype=np.float32)
+    return vertices.reshape(len(vertices), -1)[:, 0:3]
+
+
+def _to_points(vertices: np.ndarray) -> Points:
+    """ Internal function. (N, 3) vertices to a Points with w of 1."""
+    return Points().from_array(vertices)
+
+
+def save_ply(path, vertices, binary=False):
     """
-    Save a basic ascii ply file that just has vertices.
+    Save a basic ply file that just has vertices.
 
     Parameters
     ----------
     path : str
         A path and filename for the save file
-    vertices : list
-        A list of items, each of which has at least 3 float elements.
+    vertices : list or np.ndarray
+        A list of items, each of which has at least 3 float elements,
+        or an (N, 3) or larger array.
+    binary : bool
+        Write the vertices as binary little-endian floats rather than
+        ascii (default: False).
 
     Returns
     -------
     None
 
     """
+    vertices = _as_vertices(vertices)
+    header = (
+        "ply\n"
+        + ("format binary_little_endian 1.0\n" if binary else "format ascii 1.0\n")
+        + "comment VCGLIB generated\n"
+        + "element vertex " + str(len(vertices)) + "\n"
+        + "property float x\n"
+        + "property float y\n"
+        + "property float z\n"
+        + "element face 0\n"
+        + "property list uchar int vertex_indices\n"
+        + "end_header\n"
+    )
+
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+
+        if binary:
+            f.write(np.ascontiguousarray(vertices, dtype="<f4").tobytes())
+        else:
+            np.savetxt(f, vertices, fmt="%.4f")
+
+
+def load_ply_vertices(path) -> np.ndarray:
+    """
+    Load the vertices from a ply file, either ascii or binary.
 
-    with open(path, "w") as f:
-        f.write("ply\n")
-        f.write("format ascii 1.0\n")
-        f.write("comment VCGLIB generated\n")
-        f.write("element vertex " + str(len(vertices)) + "\n")
-        f.write("property float x\n")
-        f.write("property float y\n")
-        f.write("property float z\n")
-        f.write("element face 0\n")
-        f.write("property list uchar int vertex_indices\n")
-        f.write("end_header\n")
-
-        for v in vertices:
-            f.write(str(round(v[0], 4)) + " ")
-            f.write(str(round(v[1], 4)) + " ")
-            f.write(str(round(v[2], 4)) + "\n")
+    Parameters
+    ----------
+    path : str
+        A path and filename for the ply file
+
+    Returns
+    -------
+    np.ndarray
+        The (N, 3) float32 vertices.
+
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    end = raw.index(b"end_header")
+    body = raw.index(b"\n", end) + 1
+    fmt = "ascii"
+    elements = []
+
+    for line in raw[0:end].decode("ascii").splitlines():
+        tokens = line.split()
+
+        if len(tokens) == 0:
+            continue
+        elif tokens[0] == "format":
+            fmt = tokens[1]
+        elif tokens[0] == "element":
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == "property":
+            # A list property is (count type, item type, name)
+            elements[-1][2].append(tokens[1:])
+
+    if fmt == "ascii":
+        lines = raw[body:].split(b"\n")
+        start = 0
+
+        for (name, count, props) in elements:
+            if name == "vertex":
+                names = [p[-1] for p in props]
+                cols = [names.index(c) for c in ("x", "y", "z")]
+                rows = b" ".join(lines[start:start + count]).split()
+                table = np.array(rows, dtype=np.float32).reshape(count, len(props))
+                return np.ascontiguousarray(table[:, cols])
+
+            start += count
+
+        return np.zeros((0, 3), dtype=np.float32)
+
+    order = "<" if fmt == "binary_little_endian" else ">"
+    offset = body
+
+    for (name, count, props) in elements:
+        assert all(p[0] != "list" for p in props) or name != "vertex", \
+            "Vertices with list properties are not supported"
+        dtype = np.dtype([(p[-1], order + _PLY_TYPES[p[0]]) for p in props])
+
+        if name == "vertex":
+            table = np.frombuffer(raw, dtype=dtype, count=count, offset=offset)
+            return np.column_stack((table["x"], table["y"], table["z"])).astype(
+                np.float32
+            )
+
+        assert all(p[0] != "list" for p in props), \
+            "Elements with lists must come after the vertices"
+        offset += dtype.itemsize * count
+
+    return np.zeros((0, 3), dtype=np.float32)
 
 
 def load_ply(path) -> Points:
@@ -64,26 +177,10 @@ def load_ply(path) -> Points:
         Our Points instance
 
     """
-    points = Points()
-    verts_now = False
-
-    with open(path, "r") as f:
-        for line in f.readlines():
-            if verts_now:
-                tokens = line.replace("\n", "").split(" ")
-                if not (len(tokens) >= 4 and tokens[0] == "3"):
-                    x = float(tokens[0])
-                    y = float(tokens[1])
-                    z = float(tokens[2])
-                    points.append(Point(x, y, z, 1.0))
-
-            if "end_header" in line:
-                verts_now = True
-
-    return points
+    return _to_points(load_ply_vertices(path))
 
 
-def save_obj(path, vertices: list):
+def save_obj(path, vertices):
     """
     Save a basic ascii obj file that just has vertices. '''
 
@@ -91,8 +188,9 @@ def save_obj(path, vertices: list):
     ----------
     path : str
         A path and filename for the save file
-    vertices : list
-        A list of items, each of which has at least 3 float elements.
+    vertices : list or np.ndarray
+        A list of items, each of which has at least 3 float elements,
+        or an (N, 3) or larger array.
 
     Returns
     -------
@@ -102,14 +200,31 @@ def save_obj(path, vertices: list):
     with open(path, "w") as f:
         f.write("# shaper output from our neural net\n")
         f.write("o shape\n")
-        for point in vertices:
-            vertex = "v {:.4f} {:.4f} {:.4f}\n".format(
-                float(point[0]), float(point[1]), float(point[2])
-            )
-            f.write(vertex)
+        np.savetxt(f, _as_vertices(vertices), fmt="v %.4f %.4f %.4f")
         f.write("\n")
 
 
+def load_obj_vertices(objpath) -> np.ndarray:
+    """
+    Load just the vertices from an OBJ file. Faces, normals and the
+    like are ignored.
+
+    Parameters
+    ----------
+    objpath : str
+        A path and filename for the obj file.
+
+    Returns
+    -------
+    np.ndarray
+        The (N, 3) float32 vertices.
+    """
+    with open(objpath, "rb") as f:
+        lines = [line.split()[1:4] for line in f if line.startswith(b"v ")]
+
+    return np.array(lines, dtype=np.float32).reshape(-1, 3)
+
+
 def load_obj(objpath) -> Points:
     """
     Load the points from the OBJ file and generate a Points of
@@ -124,15 +239,4 @@ def load_obj(objpath) -> Points:
     -------
     Points
     """
-    import pywavefront
-
-    scene = pywavefront.Wavefront(objpath, parse=True)
-    points = Points()
-
-    for i in range(0, len(scene.vertices)):
-        x = scene.vertices[i][0]
-        y = scene.vertices[i][1]
-        z = scene.vertices[i][2]
-        points.append(Point(x, y, z, 1.0))
-
-    return points
+    return _to_points(load_obj_vertices(objpath))
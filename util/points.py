@@ -150,16 +150,9 @@ def init_points_poisson(num_points=500, device="cpu") -> PointsTen:
         Our Points in PointsTen form.
     """
     from util.poisson import PoissonSampler
-    points = Points()
     sampler = PoissonSampler(num_points * 10)
     samples = sampler.sample(num_points)
-
-    # Everything is roughly centred in the images so spawn
-    # the points close to the centre
-    for i in range(0, num_points):
-        x, y, z = samples[i]
-        p = Point(x, y, z, 1.0)
-        points.append(p)
+    points = Points().from_array(samples[0:num_points])
 
     fpoints = PointsTen(device=device)
     fpoints.from_points(points)
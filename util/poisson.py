@@ -19,7 +19,6 @@ import pickle
 import array
 import numpy as np
 from tqdm import tqdm
-from numba.typed import List
 import heapq
 from numba import jit
 from pyquaternion import Quaternion
@@ -27,26 +26,112 @@ from data.loader import Loader
 from util.math import Points, Point, PointsTen
 
 
-def gen_weight(p, samples, rmax):
-    w = 0
-    for j in samples:
-        d = dist(p, j)
-        if d < 2.0 * rmax:
-            w += math.pow(1 - (d / (2.0 * rmax)), 8)
-    return 1 / w  # instead of w as python uses min heaps
-
-
-def redo_heap(heap: list, points: list, indices: list, new_sample: List, rmax: float):
-    new_heap = []
-
-    for hidx in range(len(heap)):
-        (w, i) = heap[hidx]
-        if i in indices:
-            w = gen_weight(points[i], new_sample, rmax)
-
-        heapq.heappush(new_heap, (w, i))
-
-    return new_heap
+def gen_weights(dists: np.ndarray, rmax: float) -> np.ndarray:
+    """
+    The weight each neighbour adds to a point - larger the closer it is,
+    nothing at all from 2 * rmax away.
+
+    Parameters
+    ----------
+    dists : np.ndarray
+        The distances to the neighbours.
+    rmax : float
+        The maximum poisson disk radius.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    return np.power(1.0 - np.minimum(dists / (2.0 * rmax), 1.0), 8)
+
+
+def neighbours(points: np.ndarray, radius: float) -> Tuple:
+    """
+    Find every pair of points closer than radius, returning the
+    neighbour lists in compressed sparse row form - the neighbours of
+    point i are nbrs[ptr[i]:ptr[i + 1]], at distances dists[ptr[i]:ptr[i + 1]].
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The (N, 3) points.
+    radius : float
+        The neighbourhood radius.
+
+    Returns
+    -------
+    Tuple
+        ptr, nbrs and dists.
+    """
+    from scipy.spatial import cKDTree
+
+    pairs = cKDTree(points).query_pairs(radius, output_type="ndarray")
+    # Each pair appears once, so add it in both directions
+    src = np.concatenate((pairs[:, 0], pairs[:, 1]))
+    dst = np.concatenate((pairs[:, 1], pairs[:, 0]))
+    order = np.argsort(src, kind="stable")
+    (src, dst) = (src[order], dst[order])
+    dists = np.linalg.norm(points[src] - points[dst], axis=1)
+    ptr = np.zeros(len(points) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(src, minlength=len(points)))
+    return (ptr, dst, dists)
+
+
+@jit(nopython=True, cache=True)
+def eliminate(
+    weights: np.ndarray,
+    ptr: np.ndarray,
+    nbrs: np.ndarray,
+    contrib: np.ndarray,
+    sample_size: int,
+) -> np.ndarray:
+    """
+    Remove the most crowded point until sample_size are left. Removing
+    a point only lowers the weights of its neighbours, so we push their
+    new weights onto the heap and skip any stale entries as they come off.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        The starting weight of each point. Updated as we go.
+    ptr : np.ndarray
+        The neighbour list offsets, from neighbours.
+    nbrs : np.ndarray
+        The neighbour lists, from neighbours.
+    contrib : np.ndarray
+        The weight each neighbour adds, matching nbrs.
+    sample_size : int
+        The number of points we want.
+
+    Returns
+    -------
+    np.ndarray
+        The boolean mask of removed points.
+    """
+    n = weights.shape[0]
+    # Python's heap is lowest first, so we store the negative weight
+    heap = [(-weights[i], i) for i in range(n)]
+    heapq.heapify(heap)
+    removed = np.zeros(n, dtype=np.bool_)
+    remaining = n
+
+    while remaining > sample_size:
+        (w, idx) = heapq.heappop(heap)
+
+        if removed[idx] or -w != weights[idx]:
+            continue  # A stale entry
+
+        removed[idx] = True
+        remaining -= 1
+
+        for k in range(ptr[idx], ptr[idx + 1]):
+            j = nbrs[k]
+
+            if not removed[j]:
+                weights[j] -= contrib[k]
+                heapq.heappush(heap, (-weights[j], j))
+
+    return removed
 
 
 def dist(p: Tuple, q: Tuple):
@@ -55,12 +140,12 @@ def dist(p: Tuple, q: Tuple):
 
 class PoissonSampler(object):
     # http://www.cemyuksel.com/cyCodeBase/soln/poisson_disk_sampling.html
-    # Optionally specify an existing set of points.
+    # Weighted sample elimination - start with many random points and
+    # remove the most crowded until we have the number we want.
     def __init__(self, num_points):
-        from sklearn.neighbors import BallTree
         self.points = []
         self.num_points = num_points
-      
+
         for i in range(num_points):
             x = random.uniform(-1.0, 1.0)
             y = random.uniform(-1.0, 1.0)
@@ -68,39 +153,31 @@ class PoissonSampler(object):
             self.points.append((x, y, z))
 
         self.points = np.array(self.points)
-        self.tree = BallTree(self.points, metric=dist)
-
-    def sample(self, sample_size):
-        # TODO - as heapq is a lowest weight first and we end up deleting and
-        # recreating, there might be a better way?
-        heap = []
-        # 1.0 here is the A3 or volume of the sample space
-        self.rmax = (1.0 / (4.0 * math.sqrt(sample_size))) ** (1.0 / 3.0)
-        # initial weights
-        for idx in range(len(self.points)):
-            w = gen_weight(self.points[idx], self.points, self.rmax)
-            heapq.heappush(heap, (w, idx))
-
-        new_sample = self.points.copy()
-        removals = []
-
-        # Go through until our sample is reduced to the sample
-        # size requested.
-        #  with tqdm(total=self.num_points-sample_size) as pbar:
-        while len(new_sample) > sample_size:
-            (q, idx) = heapq.heappop(heap)
-            removals.append(idx)
-            indices = self.tree.query_radius(
-                self.points[idx].reshape(1, -1), r=self.rmax*2.0)
-            indices = list(indices[0])
-            new_sample = List()
-            for i in range(len(self.points)):
-                if i not in removals:
-                    new_sample.append(self.points[i])
-
-            #  pbar.update(1)
-            heap = redo_heap(heap, self.points, indices, new_sample, self.rmax)
-
-        return new_sample
-
 
+    def sample(self, sample_size: int) -> np.ndarray:
+        """
+        Eliminate points until we have sample_size left. Each point's
+        weight is the sum over its neighbours within 2 * rmax, found
+        once with a KD-tree, and the points are removed, most crowded
+        first, in eliminate.
+
+        Parameters
+        ----------
+        sample_size : int
+            The number of points we want.
+
+        Returns
+        -------
+        np.ndarray
+            The (sample_size, 3) points, in their original order.
+        """
+        # 8.0 here is the volume of the sample space, the -1 to 1 cube
+        self.rmax = (8.0 / (4.0 * math.sqrt(2.0) * sample_size)) ** (1.0 / 3.0)
+        (ptr, nbrs, dists) = neighbours(self.points, self.rmax * 2.0)
+        contrib = gen_weights(dists, self.rmax)
+        weights = np.add.reduceat(np.append(contrib, 0.0), ptr[:-1])
+        # reduceat gives the next value for points without neighbours
+        weights[ptr[:-1] == ptr[1:]] = 0.0
+
+        removed = eliminate(weights, ptr, nbrs, contrib, sample_size)
+        return self.points[~removed]
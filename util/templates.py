@@ -0,0 +1,402 @@
+""" # noqa
+   ___           __________________  ___________
+  / _/__  ____  / __/ ___/  _/ __/ |/ / ___/ __/
+ / _/ _ \/ __/ _\ \/ /___/ // _//    / /__/ _/      # noqa
+/_/ \___/_/   /___/\___/___/___/_/|_/\___/___/      # noqa
+Author : Benjamin Blundell - benjamin.blundell@kcl.ac.uk
+
+templates.py - render a set of points over a uniform grid of rotations
+once, then find the closest rendered pose for any image.
+
+The grid follows the Hopf fibration of SO(3) (Yershova et al, 2010) -
+a uniform set of directions on the sphere (a Fibonacci spiral, standing
+in for HEALPix), each with equally spaced rotations about it. Each
+template is flattened and scaled to zero mean and unit length, so the
+match doesn't depend on the brightness of the image. Optionally, the
+templates are compressed with PCA.
+
+The closest template is the closest image, which isn't always the
+closest rotation - the renderer drops z, so a mirror-symmetric shape
+such as the teapot looks the same from two quite different poses.
+
+The index is saved as a numpy .npz file, keyed on the points and the
+settings, so the next run for the same points just loads it.
+
+"""
+
+import hashlib
+import math
+import os
+import numpy as np
+import torch
+from tqdm import tqdm
+from net.renderer import Splat
+from util.math import PointsTen, VecRotTenBatch
+
+
+def hopf_grid(count: int) -> torch.Tensor:
+    """
+    A uniform grid of around count rotations, as unit quaternions.
+
+    Parameters
+    ----------
+    count : int
+        Roughly how many rotations we want. The spacing is chosen so
+        the directions and the turns about them are equally fine.
+
+    Returns
+    -------
+    torch.Tensor
+        The (M, 4) quaternions, w, x, y, z.
+    """
+    # A spacing of d gives 4 pi / d^2 directions and 2 pi / d turns
+    spacing = (8.0 * math.pi ** 2 / count) ** (1.0 / 3.0)
+    num_turns = max(1, round(2.0 * math.pi / spacing))
+    num_dirs = max(1, round(count / num_turns))
+
+    # The Fibonacci sphere - equal area bands, golden angle steps
+    i = torch.arange(num_dirs, dtype=torch.float64) + 0.5
+    theta = torch.acos(1.0 - 2.0 * i / num_dirs)
+    phi = (math.pi * (3.0 - math.sqrt(5.0)) * i) % (2.0 * math.pi)
+    psi = torch.arange(num_turns, dtype=torch.float64) * 2.0 * math.pi / num_turns
+
+    (theta, psi) = torch.meshgrid(theta, psi, indexing="ij")
+    phi = phi.unsqueeze(1).expand_as(theta)
+    q = torch.stack(
+        (
+            torch.cos(theta / 2) * torch.cos(psi / 2),
+            torch.cos(theta / 2) * torch.sin(psi / 2),
+            torch.sin(theta / 2) * torch.cos(phi + psi / 2),
+            torch.sin(theta / 2) * torch.sin(phi + psi / 2),
+        ),
+        dim=2,
+    )
+    return q.reshape(-1, 4).to(torch.float32)
+
+
+def _features(images: torch.Tensor) -> torch.Tensor:
+    """ Internal function. Flatten, then zero mean and unit length."""
+    flat = images.reshape(images.shape[0], -1).to(torch.float32)
+    flat = flat - flat.mean(dim=1, keepdim=True)
+    return flat / torch.linalg.norm(flat, dim=1, keepdim=True).clamp(min=1e-12)
+
+
+def index_key(
+    points: PointsTen, count: int, sigma: float, size: tuple, components: int
+) -> str:
+    """
+    The key that identifies an index - a hash of the points and the
+    settings it was built with.
+
+    Parameters
+    ----------
+    points : PointsTen
+        The points rendered.
+    count : int
+        The rough size of the grid.
+    sigma : float
+        The sigma the templates are rendered with.
+    size : tuple
+        The size of the templates.
+    components : int
+        The number of PCA components, or 0 for none.
+
+    Returns
+    -------
+    str
+    """
+    h = hashlib.sha1(points.data[:, 0:3].detach().cpu().numpy().tobytes())
+    h.update(str((count, float(sigma), tuple(size), components)).encode("utf-8"))
+    return h.hexdigest()[0:16]
+
+
+class TemplateIndex(object):
+    """Renders of some points over a grid of rotations, for finding the
+    closest pose to an image."""
+
+    def __init__(
+        self,
+        quaternions: torch.Tensor,
+        templates: torch.Tensor,
+        sigma: float,
+        size: tuple,
+        mean=None,
+        components=None,
+        key="",
+    ):
+        """
+        Create our index from templates we already have. Use build or
+        load to get one.
+
+        Parameters
+        ----------
+        quaternions : torch.Tensor
+            The (M, 4) rotations of the templates.
+        templates : torch.Tensor
+            The (M, D) template features.
+        sigma : float
+            The sigma the templates were rendered with.
+        size : tuple
+            The size of the templates.
+        mean : torch.Tensor
+            The PCA mean, or None if we don't compress.
+        components : torch.Tensor
+            The (K, D) PCA components, or None.
+        key : str
+            The key from index_key.
+
+        Returns
+        -------
+        TemplateIndex
+        """
+        self.quaternions = quaternions
+        self.templates = templates
+        self.sigma = sigma
+        self.size = tuple(size)
+        self.mean = mean
+        self.components = components
+        self.key = key
+
+    @classmethod
+    def build(
+        cls,
+        points: PointsTen,
+        count=4608,
+        sigma=1.25,
+        size=(128, 128),
+        components=0,
+        batch_size=64,
+        device="cpu",
+    ):
+        """
+        Render the points over the grid, building the index.
+
+        Parameters
+        ----------
+        points : PointsTen
+            The points to render.
+        count : int
+            Roughly how many templates (default: 4608).
+        sigma : float
+            The sigma to render with (default: 1.25).
+        size : tuple
+            The size of the templates (default: (128, 128)).
+        components : int
+            Compress the templates to this many PCA components, or 0 to
+            keep them whole (default: 0).
+        batch_size : int
+            How many templates to render at once (default: 64).
+        device : str
+            The device to render on (default: "cpu").
+
+        Returns
+        -------
+        TemplateIndex
+        """
+        quaternions = hopf_grid(count)
+        rots = VecRotTenBatch.from_quaternions(quaternions, device=device)
+        splat = Splat(size=size, device=device)
+        mask = torch.ones(points.data.shape[0], dtype=torch.float32, device=device)
+        templates = []
+
+        with torch.no_grad():
+            for start in tqdm(range(0, len(rots), batch_size)):
+                batch = rots.data[start:start + batch_size]
+                images = splat.render_batch(
+                    points.data,
+                    batch,
+                    batch.new_zeros(len(batch), 2),
+                    mask,
+                    batch.new_full((len(batch),), sigma),
+                )
+                templates.append(_features(images).cpu())
+
+        templates = torch.cat(templates)
+        key = index_key(points, count, sigma, size, components)
+
+        if components > 0:
+            mean = templates.mean(dim=0)
+            (_, _, v) = torch.pca_lowrank(
+                templates - mean, q=min(components, *templates.shape), center=False
+            )
+            components = v.T.contiguous()
+            templates = (templates - mean) @ components.T
+            return cls(quaternions, templates, sigma, size, mean, components, key)
+
+        return cls(quaternions, templates, sigma, size, key=key)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Load an index saved with save.
+
+        Parameters
+        ----------
+        path : str
+            The .npz file.
+
+        Returns
+        -------
+        TemplateIndex
+        """
+        with np.load(path, allow_pickle=False) as f:
+            mean = None
+            components = None
+
+            if "components" in f.files:
+                mean = torch.from_numpy(f["mean"])
+                components = torch.from_numpy(f["components"])
+
+            return cls(
+                torch.from_numpy(f["quaternions"]),
+                torch.from_numpy(f["templates"]),
+                float(f["sigma"]),
+                tuple(int(s) for s in f["size"]),
+                mean,
+                components,
+                str(f["key"]),
+            )
+
+    @classmethod
+    def load_or_build(cls, cachedir: str, points: PointsTen, **kwargs):
+        """
+        Load the index for these points and settings from cachedir,
+        building and saving it there if there isn't one yet.
+
+        Parameters
+        ----------
+        cachedir : str
+            The directory holding our indices.
+        points : PointsTen
+            The points to render.
+        kwargs :
+            The settings, as for build.
+
+        Returns
+        -------
+        TemplateIndex
+        """
+        key = index_key(
+            points,
+            kwargs.get("count", 4608),
+            kwargs.get("sigma", 1.25),
+            kwargs.get("size", (128, 128)),
+            kwargs.get("components", 0),
+        )
+        path = os.path.join(cachedir, "templates_" + key + ".npz")
+
+        if os.path.isfile(path):
+            return cls.load(path)
+
+        index = cls.build(points, **kwargs)
+        index.save(path)
+        return index
+
+    def save(self, path: str):
+        """
+        Save the index as an .npz file.
+
+        Parameters
+        ----------
+        path : str
+            The file to write.
+
+        Returns
+        -------
+        self
+        """
+        dirname = os.path.dirname(path)
+
+        if dirname != "" and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        arrays = {
+            "quaternions": self.quaternions.numpy(),
+            "templates": self.templates.numpy(),
+            "sigma": np.float64(self.sigma),
+            "size": np.array(self.size, dtype=np.int64),
+            "key": np.str_(self.key),
+        }
+
+        if self.components is not None:
+            arrays["mean"] = self.mean.numpy()
+            arrays["components"] = self.components.numpy()
+
+        # Write then rename, so a reader never sees half an index
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+
+        os.replace(path + ".tmp", path)
+        return self
+
+    def __len__(self):
+        return self.quaternions.shape[0]
+
+    def encode(self, images: torch.Tensor) -> torch.Tensor:
+        """
+        Turn images into the features the templates are held as.
+
+        Parameters
+        ----------
+        images : torch.Tensor
+            The (B, 1, h, w) or (B, h, w) images, the size of the
+            templates.
+
+        Returns
+        -------
+        torch.Tensor
+            The (B, D) features, or (B, K) if compressed.
+        """
+        features = _features(images.detach().cpu())
+
+        if self.components is not None:
+            features = (features - self.mean) @ self.components.T
+
+        return features
+
+    def query(self, images: torch.Tensor, k=1, block=256):
+        """
+        Find the k closest templates to each image.
+
+        Parameters
+        ----------
+        images : torch.Tensor
+            The (B, 1, h, w) or (B, h, w) images.
+        k : int
+            How many templates to return per image (default: 1).
+        block : int
+            How many images to compare with all the templates at once
+            (default: 256).
+
+        Returns
+        -------
+        tuple
+            The (B, k) distances and the (B, k) template indices, the
+            closest first.
+        """
+        features = self.encode(images)
+        dists = []
+        idx = []
+
+        for start in range(0, features.shape[0], block):
+            d = torch.cdist(features[start:start + block], self.templates)
+            (d, i) = torch.topk(d, k, dim=1, largest=False)
+            dists.append(d)
+            idx.append(i)
+
+        return (torch.cat(dists), torch.cat(idx))
+
+    def rotations(self, idx: torch.Tensor) -> VecRotTenBatch:
+        """
+        The rotations of some templates.
+
+        Parameters
+        ----------
+        idx : torch.Tensor
+            The template indices, from query.
+
+        Returns
+        -------
+        VecRotTenBatch
+        """
+        return VecRotTenBatch.from_quaternions(self.quaternions[idx.reshape(-1)])